@@ -0,0 +1,271 @@
+# 作用：登录和接口鉴权
+#
+# - 密码用 PBKDF2-HMAC-SHA256 加盐哈希 (标准库 hashlib，不需要额外依赖)，存成
+#   pbkdf2_sha256$<迭代次数>$<盐>$<哈希>。算一次要几百毫秒 CPU，所以 login() 整个放在线程池里执行，不占事件循环
+# - 登录成功后在 user_sessions 表记一行会话，返回 token：<会话 id>.<过期时间戳>.<HMAC 签名>
+# - 除了 PUBLIC_PATHS，每个接口都先经过 require_user (main.py 里注册成全局依赖)：
+#   1. 验签名、看过期时间：纯计算，伪造 / 过期的 token 不查库直接 401
+#   2. 查进程内的已验证会话缓存 (cache.TTLCache，LRU + TTL)：命中就放行，只多几微秒
+#   3. 没命中才到 user_sessions 查一次 (线程池里)，结果 (包括「已吊销」) 放进缓存
+# - 退出登录 / 吊销：写 revoked_at 并更新本进程的缓存；其他 worker 缓存里的旧会话最多 AUTH_CACHE_TTL 秒后失效
+# - 浏览器的 WebSocket 不能带 Authorization 头，/ws/events 用 ?token= 传
+#
+# 用法 (在 backend 目录下)：
+#   python auth.py passwd admin1     # 修改 / 重置管理员密码 (库里只存哈希，不能再直接改表)
+#   python auth.py prune             # 清理已过期 / 已吊销的会话
+
+import argparse
+import base64
+import functools
+import getpass
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, WebSocketException
+from sqlalchemy import delete, or_, update
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
+
+import config
+import models
+from cache import TTLCache
+from database import SessionLocal
+
+logger = logging.getLogger("library.auth")
+
+ALGORITHM = "pbkdf2_sha256"
+# 不需要登录的接口 (路由模板)：登录本身，以及给 Prometheus 抓取的监控接口
+PUBLIC_PATHS = frozenset({"/login/", "/metrics", "/metrics/db-pool"})
+
+AuthUser = namedtuple("AuthUser", "user_id username session_id")
+
+_secret = config.AUTH_SECRET.encode("utf-8")
+if not _secret:
+    _secret = secrets.token_bytes(32)
+    logger.warning("没有配置 AUTH_SECRET，使用随机密钥：重启后 token 全部失效，多个 worker 之间 token 也不通用")
+
+# 会话 id -> AuthUser，已吊销 / 不存在的会话存 _REJECTED，避免反复查库
+_sessions = TTLCache(maxsize=config.AUTH_CACHE_SIZE, ttl=config.AUTH_CACHE_TTL)
+_REJECTED = object()
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# --- 密码 ---
+
+def hash_password(password, iterations=None):
+    iterations = iterations or config.AUTH_PBKDF2_ITERATIONS
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password, stored):
+    """返回 (密码是否正确, 是否需要用当前的迭代次数重新哈希)。"""
+    try:
+        algorithm, iterations, salt, digest = stored.split("$")
+        iterations = int(iterations)
+        salt, digest = _b64decode(salt), _b64decode(digest)
+    except (AttributeError, ValueError):
+        return False, False
+    if algorithm != ALGORITHM:
+        return False, False
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    ok = hmac.compare_digest(candidate, digest)
+    return ok, ok and iterations < config.AUTH_PBKDF2_ITERATIONS
+
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash():
+    return hash_password(secrets.token_hex(8))
+
+
+# --- token ---
+
+def _sign(payload):
+    return _b64encode(hmac.new(_secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(session_id, expires_at):
+    payload = f"{session_id}.{int(expires_at.timestamp())}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def parse_token(token):
+    """验签名、看过期时间 (不查库)，合法时返回会话 id，否则返回 None。"""
+    # 签发的令牌只有 ASCII 字符；其他字符直接拒绝 (否则算签名 / compare_digest 会抛异常变成 500)
+    if not token or not token.isascii():
+        return None
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    session_id, expires, signature = parts
+    if not hmac.compare_digest(signature, _sign(f"{session_id}.{expires}")):
+        return None
+    if not expires.isdigit() or int(expires) <= time.time():
+        return None
+    return session_id
+
+
+# --- 会话 ---
+
+def login(session_factory, username, password):
+    """校验用户名密码，成功时新建会话并返回登录结果，失败返回 None。
+    要算密码哈希，会占用几百毫秒 CPU，必须在线程池里调用。"""
+    db = session_factory()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if user is None:
+            # 用户不存在也算一次哈希，响应时间上看不出用户名是否存在
+            verify_password(password, _dummy_hash())
+            return None
+        ok, rehash = verify_password(password, user.password)
+        if not ok:
+            return None
+        if rehash:
+            user.password = hash_password(password)
+        # commit 之后 ORM 对象会过期 (再读要查库)，先把要用的值取出来
+        current = AuthUser(user.id, user.username, secrets.token_urlsafe(32))
+        now = datetime.now().replace(microsecond=0)
+        expires_at = now + timedelta(hours=config.AUTH_TOKEN_HOURS)
+        db.add(models.UserSession(
+            id=current.session_id, user_id=current.user_id, created_at=now, expires_at=expires_at
+        ))
+        db.commit()
+        _sessions.set(current.session_id, current)
+        return {
+            "message": "登录成功",
+            "user_id": current.user_id,
+            "username": current.username,
+            "token": issue_token(current.session_id, expires_at),
+            "expires_at": expires_at,
+        }
+    finally:
+        db.close()
+
+
+def _load_session(session_factory, session_id):
+    db = session_factory()
+    try:
+        row = (
+            db.query(models.UserSession.user_id, models.User.username)
+            .join(models.User, models.User.id == models.UserSession.user_id)
+            .filter(
+                models.UserSession.id == session_id,
+                models.UserSession.revoked_at.is_(None),
+                models.UserSession.expires_at > datetime.now(),
+            )
+            .first()
+        )
+    finally:
+        db.close()
+    return AuthUser(row.user_id, row.username, session_id) if row else None
+
+
+def revoke(session_factory, session_id):
+    """吊销会话 (退出登录)。本进程立刻生效，其他 worker 最多 AUTH_CACHE_TTL 秒后生效。"""
+    db = session_factory()
+    try:
+        db.execute(
+            update(models.UserSession)
+            .where(models.UserSession.id == session_id, models.UserSession.revoked_at.is_(None))
+            .values(revoked_at=datetime.now())
+        )
+        db.commit()
+    finally:
+        db.close()
+    _sessions.set(session_id, _REJECTED)
+
+
+async def authenticate(token):
+    """token -> AuthUser，不合法 / 已过期 / 已吊销返回 None。缓存命中时不查库。"""
+    session_id = parse_token(token)
+    if session_id is None:
+        return None
+    user = _sessions.get(session_id)
+    if user is None:
+        user = await run_in_threadpool(_load_session, SessionLocal, session_id)
+        _sessions.set(session_id, user or _REJECTED)
+    return None if user is _REJECTED else user
+
+
+def _token_from(connection):
+    scheme, _, credentials = connection.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials.strip()
+    if connection.scope["type"] == "websocket":
+        return connection.query_params.get("token")
+    return None
+
+
+async def require_user(connection: HTTPConnection):
+    """全局依赖：校验 token，把当前用户放到 request.state.user。PUBLIC_PATHS 里的接口直接放行。"""
+    route = connection.scope.get("route")
+    if getattr(route, "path", None) in PUBLIC_PATHS:
+        return None
+    user = await authenticate(_token_from(connection))
+    if user is None:
+        if connection.scope["type"] == "websocket":
+            raise WebSocketException(code=1008)
+        raise HTTPException(
+            status_code=401, detail="未登录或登录已过期，请重新登录", headers={"WWW-Authenticate": "Bearer"}
+        )
+    connection.state.user = user
+    return user
+
+
+def prune(db):
+    """删除已过期 / 已吊销的会话，返回删除条数。"""
+    removed = db.execute(
+        delete(models.UserSession).where(or_(
+            models.UserSession.expires_at <= datetime.now(),
+            models.UserSession.revoked_at.is_not(None),
+        ))
+    ).rowcount
+    db.commit()
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理员密码 / 登录会话")
+    parser.add_argument("command", choices=["passwd", "prune"])
+    parser.add_argument("username", nargs="?", help="passwd: 管理员用户名")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "prune":
+            print(f"已清理 {prune(db)} 个会话")
+            return
+        user = db.query(models.User).filter(models.User.username == args.username).first()
+        if user is None:
+            raise SystemExit(f"用户不存在: {args.username}")
+        password = getpass.getpass("新密码: ")
+        if not password or password != getpass.getpass("再输一次: "):
+            raise SystemExit("两次输入不一致")
+        user.password = hash_password(password)
+        # 改密码后该用户已有的会话全部作废
+        db.execute(
+            update(models.UserSession)
+            .where(models.UserSession.user_id == user.id, models.UserSession.revoked_at.is_(None))
+            .values(revoked_at=datetime.now())
+        )
+        db.commit()
+        print("密码已修改，该用户已登录的会话已全部作废")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
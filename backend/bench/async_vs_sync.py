@@ -0,0 +1,70 @@
+# 作用：对比 sync / async 两种数据库模式下 /borrow/ 和 /readers/ 的吞吐
+# 用法 (在 backend 目录下)：
+#   python -m bench.async_vs_sync                         # 自动生成本地 SQLite 数据
+#   python -m bench.async_vs_sync --url mysql+pymysql://... --concurrency 100 --duration 20
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench.common import Server, borrow_pairs, print_summary, run_workers, seed_sqlite, timed
+
+
+def readers_worker(readers):
+    async def worker(client, recorder, index, deadline):
+        rnd = random.Random(index)
+        while time.perf_counter() < deadline:
+            skip = rnd.randrange(max(1, readers - 100))
+            await timed(client, recorder, "GET /readers/", "GET", "/readers/", params={"skip": skip, "limit": 100})
+    return worker
+
+
+def borrow_worker(pairs):
+    async def worker(client, recorder, index, deadline):
+        card_id, inventory_id = pairs[index]
+        while time.perf_counter() < deadline:
+            await timed(client, recorder, "POST /borrow/", "POST", "/borrow/",
+                        json={"card_id": card_id, "inventory_id": inventory_id})
+            await timed(client, recorder, "POST /return/", "POST", "/return/",
+                        json={"inventory_id": inventory_id})
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sync / async 数据库模式吞吐对比")
+    parser.add_argument("--url", help="已有数据库的连接串；不传则生成本地 SQLite 数据")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=5000)
+    parser.add_argument("--output", help="结果保存为 JSON")
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(prefix="library_bench_"), "bench.db")
+        url = seed_sqlite(path, readers=args.readers, books=5000, copies=20000, loans=50000)
+    pairs = borrow_pairs(url, args.concurrency)
+
+    results = {}
+    for mode in ("sync", "async"):
+        with Server({"DATABASE_URL": url, "DB_MODE": mode}) as server:
+            results[mode] = {}
+            for scenario in (readers_worker(args.readers), borrow_worker(pairs)):
+                recorder, elapsed = asyncio.run(
+                    run_workers(server.base_url, args.concurrency, args.duration, scenario, server.headers)
+                )
+                results[mode].update(recorder.summary(elapsed))
+        print_summary(f"DB_MODE={mode}  并发={args.concurrency}", results[mode])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"concurrency": args.concurrency, "duration": args.duration, "results": results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
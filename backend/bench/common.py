@@ -0,0 +1,150 @@
+# 作用：压测脚本公用工具 —— 准备本地数据库、启动后端进程、并发打请求、统计延迟
+
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+from sqlalchemy import create_engine, event, text
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def seed_sqlite(path, readers, books, copies, loans, seed=42):
+    """在本地 SQLite 文件里生成模拟数据 (复用 init_db.py 的大数据量模式)，返回连接串。"""
+    import init_db
+
+    url = f"sqlite:///{os.path.abspath(path)}"
+    bind = create_engine(url)
+    event.listen(bind, "connect", init_db._fast_sqlite)
+    init_db.seed_scale(bind, readers, books, copies, loans, seed)
+    bind.dispose()
+    return url
+
+
+def borrow_pairs(url, count, seed=42):
+    """挑出 count 组 (没有未缴罚款的读者, 在馆馆藏)，每个压测协程一组，借了再还。"""
+    bind = create_engine(url)
+    with bind.connect() as conn:
+        readers = [r for (r,) in conn.execute(text(
+            "SELECT card_id FROM readers WHERE NOT EXISTS "
+            "(SELECT 1 FROM fines WHERE fines.card_id = readers.card_id AND fines.is_paid = 0) LIMIT :n"
+        ), {"n": count})]
+        copies = [c for (c,) in conn.execute(text(
+            "SELECT id FROM inventory WHERE status = 1 LIMIT :n"
+        ), {"n": count})]
+    bind.dispose()
+    if len(readers) < count or len(copies) < count:
+        raise SystemExit("可用的读者或馆藏不够，请加大数据量或降低并发")
+    rnd = random.Random(seed)
+    rnd.shuffle(copies)
+    return list(zip(readers, copies))
+
+
+class Server:
+    """用子进程启动 uvicorn main:app，env 里的配置 (DATABASE_URL / DB_MODE ...) 直接传给后端。"""
+
+    def __init__(self, env, port=8765, workers=1):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                     "--workers", str(workers), "--log-level", "warning"]
+        # 多 worker 时 token 要在各个进程之间通用，压测固定一个签名密钥
+        self._env = {"AUTH_SECRET": "bench-secret", **os.environ, **env}
+        self._proc = None
+        self.headers = {}  # 登录后的 Authorization 头，启动完成后填上
+
+    def __enter__(self):
+        self._proc = subprocess.Popen(self._cmd, cwd=BACKEND_DIR, env=self._env)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                if httpx.get(self.base_url + "/openapi.json", timeout=1).status_code == 200:
+                    self.headers = login_headers(self.base_url)
+                    return self
+            except httpx.HTTPError:
+                pass
+            if self._proc.poll() is not None:
+                raise SystemExit("后端启动失败")
+            time.sleep(0.2)
+        self._proc.terminate()
+        raise SystemExit("后端启动超时")
+
+    def __exit__(self, *exc):
+        self._proc.terminate()
+        self._proc.wait(timeout=10)
+
+
+def login_headers(base_url, username="admin1", password="123456"):
+    """登录拿 token，返回压测请求要带的 Authorization 头。"""
+    response = httpx.post(base_url + "/login/", json={"username": username, "password": password}, timeout=30)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+class Recorder:
+    """按接口名记录每次请求的耗时和状态码。"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        self.latencies.setdefault(name, []).append(seconds)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        result = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            result[name] = {
+                "requests": len(values),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(values) / elapsed, 1),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+        return result
+
+
+async def timed(client, recorder, name, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        ok = response.status_code < 500
+    except httpx.HTTPError:
+        response, ok = None, False
+    recorder.record(name, time.perf_counter() - started, ok)
+    return response
+
+
+async def run_workers(base_url, concurrency, duration, worker, headers=None):
+    """并发跑 concurrency 个 worker(client, recorder, index, deadline)，返回 (recorder, 实际耗时)。"""
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30, headers=headers) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(worker(client, recorder, i, deadline) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return recorder, elapsed
+
+
+def print_summary(title, summary):
+    print(f"\n== {title}")
+    print(f"{'接口':<20}{'请求数':>8}{'错误':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, s in summary.items():
+        print(f"{name:<20}{s['requests']:>8}{s['errors']:>6}{s['throughput_rps']:>10}"
+              f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
@@ -0,0 +1,111 @@
+# 作用：检查借还书等高频查询在大数据量下是否都走了索引 (看 EXPLAIN 执行计划 + 实测耗时)
+# 用法 (在 backend 目录下)：
+#   python -m bench.explain_indexes                          # 生成百万级本地 SQLite 数据后检查
+#   python -m bench.explain_indexes --url mysql+pymysql://... # 检查已有数据库 (会先执行迁移)
+# 有查询没走预期的索引时退出码为 1
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select
+
+from bench.common import seed_sqlite
+
+import migrate
+import models
+
+
+def hot_queries(conn):
+    """(名称, 预期使用的索引, 语句)，条件和 main.py 里对应接口的写法一致。"""
+    open_loan = conn.execute(
+        select(models.BorrowRecord.inventory_id).where(models.BorrowRecord.return_date == None).limit(1)
+    ).scalar()
+    card_id = conn.execute(select(models.Fine.card_id).limit(1)).scalar()
+    isbn = conn.execute(select(models.Book.isbn).limit(1)).scalar()
+
+    unpaid_count = (
+        select(func.count(models.Fine.id))
+        .where(models.Fine.card_id == models.Reader.card_id, models.Fine.is_paid == 0)
+        .correlate(models.Reader)
+        .scalar_subquery()
+    )
+    return [
+        ("还书：查在借记录", "ix_borrow_records_inventory_return",
+         select(models.BorrowRecord.id, models.BorrowRecord.borrow_date, models.Book.price)
+         .join(models.Inventory, models.Inventory.id == models.BorrowRecord.inventory_id)
+         .join(models.Book, models.Book.isbn == models.Inventory.isbn)
+         .where(models.BorrowRecord.inventory_id == open_loan, models.BorrowRecord.return_date == None)
+         .limit(1)),
+        ("借书：检查未缴罚款", "ix_fines_card_id_is_paid",
+         select(select(models.Fine.id)
+                .where(models.Fine.card_id == card_id, models.Fine.is_paid == 0)
+                .exists())),
+        ("读者列表：未缴罚款数", "ix_fines_card_id_is_paid",
+         select(models.Reader.card_id, unpaid_count).order_by(models.Reader.card_id).limit(100)),
+        ("馆藏：某书的在馆副本", "ix_inventory_isbn_status",
+         select(models.Inventory.id).where(models.Inventory.isbn == isbn, models.Inventory.status == 1)),
+        ("图书可借情况：按状态计数", "ix_inventory_isbn_status",
+         select(models.Inventory.status, func.count())
+         .where(models.Inventory.isbn == isbn).group_by(models.Inventory.status)),
+        ("读者的借阅记录", "ix_borrow_records_card_id",
+         select(models.BorrowRecord.id).where(models.BorrowRecord.card_id == card_id)),
+    ]
+
+
+def explain(conn, stmt):
+    sql = str(stmt.compile(conn, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql).all()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql("EXPLAIN " + sql).mappings().all()
+    return [f"{r['table']}: type={r['type']} key={r['key']} rows={r['rows']}" for r in rows]
+
+
+def time_query(conn, stmt, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(stmt).all()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查高频查询的执行计划是否走索引")
+    parser.add_argument("--url", help="已有数据库的连接串；不传则生成本地 SQLite 数据")
+    parser.add_argument("--readers", type=int, default=200000)
+    parser.add_argument("--books", type=int, default=200000)
+    parser.add_argument("--copies", type=int, default=1000000)
+    parser.add_argument("--loans", type=int, default=3000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(prefix="library_bench_"), "bench.db")
+        url = seed_sqlite(path, readers=args.readers, books=args.books, copies=args.copies, loans=args.loans)
+
+    bind = create_engine(url)
+    migrate.upgrade(bind)
+    failed = 0
+    with bind.connect() as conn:
+        counts = {t: conn.execute(select(func.count()).select_from(t)).scalar()
+                  for t in (models.BorrowRecord.__table__, models.Fine.__table__, models.Inventory.__table__)}
+        print("数据量: " + ", ".join(f"{t.name}={n}" for t, n in counts.items()))
+        for name, index, stmt in hot_queries(conn):
+            plan = explain(conn, stmt)
+            ok = any(index in line for line in plan)
+            failed += not ok
+            print(f"\n{'✅' if ok else '❌'} {name}  (预期索引 {index}，中位耗时 {time_query(conn, stmt, args.repeat):.2f} ms)")
+            for line in plan:
+                print("    " + line)
+    bind.dispose()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
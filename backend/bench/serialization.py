@@ -0,0 +1,93 @@
+# 作用：对比大列表接口 (/books/、/inventory/、/fines/all) 两种序列化方式的吞吐 (行/秒)
+#   原来：查整行 ORM 对象 -> Pydantic from_attributes 逐行校验 -> 转成 JSON 兼容对象 -> json.dumps
+#         (和 FastAPI 处理 response_model 的步骤一样)
+#   现在：只 select Response 模型需要的列 -> serialize.dumps_rows (orjson)
+# 每种方式都按接口的最大页大小反复取一页、序列化，统计 查询 + 序列化 的总耗时；
+# 同时检查两种方式输出的 JSON 内容完全一致。
+#
+# 用法 (在 backend 目录下)：
+#   python -m bench.serialization                        # 自动生成本地 SQLite 数据
+#   python -m bench.serialization --url mysql+pymysql://root:密码@localhost/library_bench --limit 1000
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from bench.common import seed_sqlite
+
+import migrate
+import models
+import schemas
+import serialize
+from pagination import MAX_PAGE_SIZE
+
+# (接口, ORM 模型, Response 模型, 排序列)
+ENDPOINTS = [
+    ("/books/", models.Book, schemas.BookResponse, models.Book.isbn),
+    ("/inventory/", models.Inventory, schemas.InventoryResponse, models.Inventory.id),
+    ("/fines/all", models.Fine, schemas.FineResponse, models.Fine.id.desc()),
+]
+
+
+def orm_pydantic(db, model, schema, order, limit):
+    rows = db.query(model).order_by(order).limit(limit).all()
+    adapter = TypeAdapter(list[schema])
+    content = adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def columns_orjson(db, model, schema, order, limit):
+    rows = db.query(*serialize.columns(schema, model)).order_by(order).limit(limit).all()
+    return serialize.dumps_rows(rows)
+
+
+def measure(bind, fn, model, schema, order, limit, repeat):
+    timings = []
+    for _ in range(repeat):
+        # 每次新开 Session，避免 ORM identity map 里留着上一轮的对象
+        with Session(bind) as db:
+            started = time.perf_counter()
+            body = fn(db, model, schema, order, limit)
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比列表接口的序列化吞吐")
+    parser.add_argument("--url", help="已有数据库的连接串；不传则生成本地 SQLite 数据")
+    parser.add_argument("--readers", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=50000)
+    parser.add_argument("--copies", type=int, default=200000)
+    parser.add_argument("--loans", type=int, default=200000)
+    parser.add_argument("--limit", type=int, default=MAX_PAGE_SIZE, help="每次取的行数 (接口最大页大小)")
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(prefix="library_bench_"), "bench.db")
+        url = seed_sqlite(path, args.readers, args.books, args.copies, args.loans)
+
+    bind = create_engine(url)
+    migrate.upgrade(bind)
+    encoder = "orjson" if serialize.orjson is not None else "json (未安装 orjson)"
+    print(f"每次 {args.limit} 行，重复 {args.repeat} 次取中位数；快速路径编码器: {encoder}")
+    print(f"{'接口':<14}{'原来 行/秒':>14}{'现在 行/秒':>14}{'加速':>8}  输出一致")
+    for path, model, schema, order in ENDPOINTS:
+        before, old_body = measure(bind, orm_pydantic, model, schema, order, args.limit, args.repeat)
+        after, new_body = measure(bind, columns_orjson, model, schema, order, args.limit, args.repeat)
+        rows = len(json.loads(new_body))
+        same = json.loads(old_body) == json.loads(new_body)
+        print(f"{path:<14}{rows / before:>14,.0f}{rows / after:>14,.0f}{before / after:>7.1f}x  {'✅' if same else '❌'}")
+    bind.dispose()
+
+
+if __name__ == "__main__":
+    main()
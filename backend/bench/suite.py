@@ -0,0 +1,208 @@
+# 作用：接口压测套件 —— 按真实比例混合请求 登录 / 读者列表 / 图书列表 / 借书 / 还书 / 缴罚款，
+# 在几档并发下分别统计每个接口的吞吐和 p50/p95/p99 延迟，结果存成 JSON 方便不同提交之间对比。
+#
+# 用法 (在 backend 目录下)：
+#   python -m bench.suite                                    # 自动生成本地 SQLite 数据，默认并发 10,50
+#   python -m bench.suite --concurrency 20,100 --duration 30 --output before.json
+#   python -m bench.suite --output after.json --compare before.json
+#   python -m bench.suite --url mysql+pymysql://root:密码@localhost/library_bench --workers 4
+#
+# 数据库默认是本地 SQLite 文件 (可复现：相同 --seed 生成相同数据)；--url 可以指向一个专门用来压测的 MySQL 库。
+# 注意压测会真实地借书 / 还书 / 缴罚款，不要指向正式库。
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+from bench.common import BACKEND_DIR, Recorder, Server, borrow_pairs, print_summary, seed_sqlite, timed
+
+# 默认请求比例 (流通台日常：查书最多，其次借还)
+# 其他请求都带着启动时登录拿到的 token；login 这一项每次都真的算一遍密码哈希 (几百毫秒 CPU)
+DEFAULT_MIX = {"login": 1, "readers": 2, "books": 6, "circulation": 4, "pay_fine": 1}
+
+SEARCH_WORDS = ["数据", "系统", "原理", "Python", "历史", "算法", "导论", "经济学"]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"未知的请求类型: {name} (可选: {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def unpaid_fines(url, limit):
+    bind = create_engine(url)
+    with bind.connect() as conn:
+        ids = [i for (i,) in conn.execute(
+            text("SELECT id FROM fines WHERE is_paid = 0 ORDER BY id LIMIT :n"), {"n": limit}
+        )]
+        readers = conn.execute(text("SELECT count(*) FROM readers")).scalar()
+    bind.dispose()
+    return ids, readers
+
+
+def mixed_worker(mix, pairs, fines, readers, seed):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    # 每组 (读者, 馆藏) 的书现在是否借在手上；预热和每档并发之间都要延续这个状态
+    holding = [False] * len(pairs)
+
+    async def worker(client, recorder, index, deadline):
+        rnd = random.Random(seed * 1000 + index)
+        card_id, inventory_id = pairs[index]
+        while time.perf_counter() < deadline:
+            action = rnd.choices(names, weights)[0]
+            if action == "login":
+                await timed(client, recorder, "POST /login/", "POST", "/login/",
+                            json={"username": "admin1", "password": "123456"})
+            elif action == "readers":
+                skip = rnd.randrange(max(1, readers - 100))
+                await timed(client, recorder, "GET /readers/", "GET", "/readers/",
+                            params={"skip": skip, "limit": 100})
+            elif action == "books":
+                params = {"limit": 20, "sort": rnd.choice(["isbn", "title", "author"])}
+                if rnd.random() < 0.5:
+                    params["q"] = rnd.choice(SEARCH_WORDS)
+                await timed(client, recorder, "GET /books/", "GET", "/books/", params=params)
+            elif action == "circulation":
+                # 同一个 worker 借了再还，保证每次请求都是合法操作
+                if holding[index]:
+                    await timed(client, recorder, "POST /return/", "POST", "/return/",
+                                json={"inventory_id": inventory_id})
+                else:
+                    await timed(client, recorder, "POST /borrow/", "POST", "/borrow/",
+                                json={"card_id": card_id, "inventory_id": inventory_id})
+                holding[index] = not holding[index]
+            elif action == "pay_fine" and fines:
+                await timed(client, recorder, "POST /fines/pay/", "POST", f"/fines/pay/{fines.pop()}")
+    return worker
+
+
+async def run_level(base_url, concurrency, duration, warmup, worker, headers=None):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30, headers=headers) as client:
+        if warmup > 0:
+            # 预热：建立连接、填满连接池和缓存，不计入结果
+            scratch = Recorder()
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(worker(client, scratch, i, deadline) for i in range(concurrency)))
+        recorder = Recorder()
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(worker(client, recorder, i, deadline) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    # 所有接口合在一起再算一遍，作为整体吞吐 / 延迟
+    overall = Recorder()
+    overall.latencies["ALL"] = [v for values in recorder.latencies.values() for v in values]
+    overall.errors["ALL"] = sum(recorder.errors.values())
+    return {**recorder.summary(elapsed), **overall.summary(elapsed)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n== 对比 {baseline_path} (提交 {baseline.get('commit')})  变化为 当前 / 基线 - 1")
+    print(f"{'并发':>6}  {'接口':<20}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+
+    def delta(new, old):
+        return f"{(new / old - 1) * 100:+.1f}%" if old else "-"
+
+    for level, endpoints in current["results"].items():
+        old_level = baseline["results"].get(level, {})
+        for name, s in endpoints.items():
+            old = old_level.get(name)
+            if not old:
+                continue
+            print(f"{level:>6}  {name:<20}{delta(s['throughput_rps'], old['throughput_rps']):>10}"
+                  f"{delta(s['p50_ms'], old['p50_ms']):>10}{delta(s['p95_ms'], old['p95_ms']):>10}"
+                  f"{delta(s['p99_ms'], old['p99_ms']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接口压测套件")
+    parser.add_argument("--url", help="压测用数据库的连接串；不传则生成本地 SQLite 数据")
+    parser.add_argument("--readers", type=int, default=20000)
+    parser.add_argument("--books", type=int, default=50000)
+    parser.add_argument("--copies", type=int, default=200000)
+    parser.add_argument("--loans", type=int, default=500000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", default="10,50", help="逗号分隔的几档并发，例如 10,50,200")
+    parser.add_argument("--duration", type=float, default=15, help="每档并发的压测秒数")
+    parser.add_argument("--warmup", type=float, default=3, help="每档并发正式计时前的预热秒数")
+    parser.add_argument("--mix", help="请求比例，例如 books=6,circulation=4,readers=2 (默认见 DEFAULT_MIX)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker 进程数")
+    parser.add_argument("--db-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="结果保存为 JSON")
+    parser.add_argument("--compare", help="和之前保存的 JSON 结果对比")
+    args = parser.parse_args()
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+
+    url = args.url
+    if not url:
+        path = os.path.join(tempfile.mkdtemp(prefix="library_bench_"), "bench.db")
+        url = seed_sqlite(path, args.readers, args.books, args.copies, args.loans, args.seed)
+
+    pairs = borrow_pairs(url, max(levels), args.seed)
+    fines, readers = unpaid_fines(url, 100000)
+    random.Random(args.seed).shuffle(fines)
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": make_url(url).render_as_string(hide_password=True),
+        "db_mode": args.db_mode,
+        "workers": args.workers,
+        "duration": args.duration,
+        "mix": mix,
+        "dataset": None if args.url else {
+            "readers": args.readers, "books": args.books, "copies": args.copies,
+            "loans": args.loans, "seed": args.seed,
+        },
+        "results": {},
+    }
+    env = {"DATABASE_URL": url, "DB_MODE": args.db_mode}
+    worker = mixed_worker(mix, pairs, fines, readers, args.seed)
+    with Server(env, port=args.port, workers=args.workers) as server:
+        for concurrency in levels:
+            summary = asyncio.run(run_level(server.base_url, concurrency, args.duration, args.warmup, worker,
+                                          server.headers))
+            report["results"][str(concurrency)] = summary
+            print_summary(f"并发={concurrency}  DB_MODE={args.db_mode}  workers={args.workers}", summary)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# 作用：图书 / 馆藏批量导入 (CSV 或 NDJSON，流式分块处理)
+# 接口 POST /import/{kind} 和命令行 import_data.py 共用这里的逻辑。
+#
+# 文件格式 (CSV 第一行是表头；NDJSON 每行一个 JSON 对象，字段相同)：
+#   books:     isbn, title, author, publisher_id, price(可选，不能为负), copies(可选，同时入库几本)
+#   inventory: isbn, copies(可选，默认 1)
+#
+# 每 chunk_size 行提交一次：出版社在开头一次性预加载，ISBN 按块查重，
+# 图书 / 馆藏用 executemany 批量插入，库存按 ISBN 聚合后一次批量更新。
+# 坏行只记录错误并跳过，不会让整个文件失败。
+
+import asyncio
+import csv
+import io
+import json
+import math
+import queue
+import time
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+import changes
+import models
+import stats
+from circulation import bump_counters
+from starlette.concurrency import run_in_threadpool
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+MAX_COPIES_PER_ROW = 1000
+MAX_PRICE = 99999999  # DECIMAL(10, 2) 最大整数位是 8 位
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.books = 0
+        self.copies = 0
+        self.error_count = 0
+        self.errors = []  # 只保留前 MAX_REPORTED_ERRORS 条明细
+        self._started = time.perf_counter()
+
+    def error(self, line_no, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": message})
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self._started
+        return {
+            "rows": self.rows,
+            "books_inserted": self.books,
+            "copies_inserted": self.copies,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def read_records(stream, fmt):
+    """从文本流里逐条产出 (行号, 记录)，不会把整个文件读进内存。解析失败的记录为 None。"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_no, record if isinstance(record, dict) else None
+
+
+def _text(record, field, max_len):
+    value = str(record.get(field) or "").strip()
+    if not value:
+        raise RowError(f"{field} 不能为空")
+    if len(value) > max_len:
+        raise RowError(f"{field} 超过 {max_len} 个字符")
+    return value
+
+
+def _copies(record, default):
+    raw = record.get("copies")
+    try:
+        copies = int(raw) if raw not in (None, "") else default
+    except (TypeError, ValueError):
+        raise RowError("copies 必须是整数")
+    if not 0 <= copies <= MAX_COPIES_PER_ROW:
+        raise RowError(f"copies 必须在 0 到 {MAX_COPIES_PER_ROW} 之间")
+    return copies
+
+
+def _parse_book(record, publisher_ids):
+    isbn = _text(record, "isbn", 20)
+    title = _text(record, "title", 100)
+    author = _text(record, "author", 100)
+    try:
+        publisher_id = int(record.get("publisher_id"))
+    except (TypeError, ValueError):
+        raise RowError("publisher_id 必须是整数")
+    if publisher_id not in publisher_ids:
+        raise RowError("出版社不存在")
+    raw_price = record.get("price")
+    price = None  # 没填价格存 NULL (不是 0)：损坏赔偿按 damage_fine 算，不会按 0 元赔
+    if raw_price not in (None, ""):
+        try:
+            price = float(raw_price)
+        except (TypeError, ValueError):
+            raise RowError("price 必须是数字")
+        if not math.isfinite(price):
+            raise RowError("price 必须是数字")
+        if price < 0:
+            raise RowError("价格不能是负数")
+        if price > MAX_PRICE:
+            raise RowError("价格数值过大 (最大允许 99999999)")
+    book = {"isbn": isbn, "title": title, "author": author,
+            "publisher_id": publisher_id, "price": price, "stock_qty": 0}
+    return book, _copies(record, 0)
+
+
+def _parse_inventory(record):
+    return _text(record, "isbn", 20), _copies(record, 1)
+
+
+class _Importer:
+    def __init__(self, db, kind, report):
+        self.db = db
+        self.kind = kind
+        self.report = report
+        # 出版社表很小，开头一次性加载，逐行校验不用再查库
+        self.publisher_ids = set(db.scalars(select(models.Publisher.id))) if kind == "books" else None
+
+    def parse(self, record):
+        if record is None:
+            raise RowError("无法解析该行")
+        if self.kind == "books":
+            return _parse_book(record, self.publisher_ids)
+        return _parse_inventory(record)
+
+    def flush(self, rows):
+        """rows: [(行号, 解析结果)]，整块一个事务写入；整块失败时退回逐行写入，定位出错的行。"""
+        if not rows:
+            return
+        try:
+            books, copies, rejected = self._write(rows)
+            self.db.commit()
+        except SQLAlchemyError:
+            self.db.rollback()
+            books, copies, rejected = 0, 0, []
+            for line_no, parsed in rows:
+                try:
+                    with self.db.begin_nested():
+                        b, c, r = self._write([(line_no, parsed)])
+                    books, copies, rejected = books + b, copies + c, rejected + r
+                except SQLAlchemyError as e:
+                    rejected.append((line_no, f"写入失败: {e.__class__.__name__}"))
+            self.db.commit()
+        changes.publish(self.db)
+        for line_no, message in rejected:
+            self.report.error(line_no, message)
+        self.report.books += books
+        self.report.copies += copies
+
+    def _write(self, rows):
+        """写入一块数据，返回 (新增图书数, 新增馆藏数, [(行号, 拒绝原因)])。"""
+        isbns = {(p[0]["isbn"] if self.kind == "books" else p[0]) for _, p in rows}
+        existing = set(self.db.scalars(select(models.Book.isbn).where(models.Book.isbn.in_(isbns))))
+
+        new_books, copies_by_isbn, rejected = [], {}, []
+        for line_no, parsed in rows:
+            if self.kind == "books":
+                book, copies = parsed
+                if book["isbn"] in existing:
+                    rejected.append((line_no, "ISBN 号不可相同"))
+                    continue
+                existing.add(book["isbn"])  # 同一块里重复的 ISBN 也拦下
+                new_books.append(book)
+                isbn = book["isbn"]
+            else:
+                isbn, copies = parsed
+                if isbn not in existing:
+                    rejected.append((line_no, "图书ISBN不存在"))
+                    continue
+            if copies:
+                copies_by_isbn[isbn] = copies_by_isbn.get(isbn, 0) + copies
+
+        if new_books:
+            self.db.execute(insert(models.Book), new_books)
+        if copies_by_isbn:
+            self.db.execute(
+                insert(models.Inventory),
+                [{"isbn": isbn, "status": 1} for isbn, n in copies_by_isbn.items() for _ in range(n)]
+            )
+            # 库存按 ISBN 聚合，一次 executemany 更新
+            bump_counters(self.db, models.Book.__table__, "isbn", "stock_qty", copies_by_isbn)
+            # 看板统计：新馆藏都是在馆状态
+            if self.kind == "books":
+                publishers = {b["isbn"]: b["publisher_id"] for b in new_books}
+            else:
+                publishers = stats.publishers_of(self.db, copies_by_isbn)
+            deltas = {}
+            for isbn, n in copies_by_isbn.items():
+                stats.add_deltas(deltas, publishers.get(isbn), n, n)
+            stats.record_publishers(self.db, deltas)
+        if new_books or copies_by_isbn:
+            # 增量同步：新书和库存变了的书都登记到这一块的改动批次里。批量插入拿不到新馆藏的主键，
+            # 按 ISBN 把还没有登记过 (version=0) 的馆藏一起标上批次号
+            batch = changes.record(self.db, books=[b["isbn"] for b in new_books] + list(copies_by_isbn))
+            if copies_by_isbn:
+                self.db.execute(
+                    update(models.Inventory)
+                    .where(models.Inventory.isbn.in_(sorted(copies_by_isbn)), models.Inventory.version == 0)
+                    .values(version=batch, updated_at=datetime.now())
+                    .execution_options(synchronize_session=False)
+                )
+        return len(new_books), sum(copies_by_isbn.values()), rejected
+
+
+def run_import(db, kind, stream, fmt="csv", chunk_size=CHUNK_SIZE):
+    """kind: books / inventory；fmt: csv / ndjson；stream: 文本流 (按行迭代)。返回 ImportReport。"""
+    report = ImportReport()
+    importer = _Importer(db, kind, report)
+    chunk = []
+    for line_no, record in read_records(stream, fmt):
+        report.rows += 1
+        try:
+            chunk.append((line_no, importer.parse(record)))
+        except RowError as e:
+            report.error(line_no, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            importer.flush(chunk)
+            chunk = []
+    importer.flush(chunk)
+    return report
+
+
+class _BodyReader(io.RawIOBase):
+    """把异步收到的请求体分片交给工作线程按行读取。队列有上限：数据库写得慢时，上传也会被限速。"""
+
+    def __init__(self, maxsize=16):
+        self._queue = queue.Queue(maxsize)
+        self._buffer = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def feed(self, chunk):
+        self._queue.put(chunk)  # None 表示结束
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def drain(self):
+        # 工作线程提前退出 (比如出错) 时把剩下的分片读完，避免上传端一直阻塞
+        while not self._eof:
+            if self._queue.get() is None:
+                self._eof = True
+
+
+async def import_request_body(request, session_factory, kind, fmt, chunk_size=CHUNK_SIZE):
+    """边接收请求体边导入：解析和写库在线程池里跑，不阻塞事件循环。返回报告字典。"""
+    body = _BodyReader()
+
+    def work():
+        db = session_factory()
+        try:
+            stream = io.TextIOWrapper(io.BufferedReader(body), encoding="utf-8-sig", newline="")
+            return run_import(db, kind, stream, fmt, chunk_size).as_dict()
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="文件编码必须是 UTF-8")
+        finally:
+            body.drain()
+            db.close()
+
+    task = asyncio.ensure_future(run_in_threadpool(work))
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(body.feed, chunk)
+    finally:
+        await run_in_threadpool(body.feed, None)
+    return await task
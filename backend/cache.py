@@ -0,0 +1,149 @@
+# 作用：目录类只读接口 (/publishers/、/books/) 的进程内缓存 + ETag / 304 协商缓存
+#
+# - 缓存的是已经序列化好的 JSON 字节 (serialize.dumps_rows)，命中时既不查库也不重新序列化
+# - 304 只按 ETag (响应内容的哈希) 判断
+# - 按「标签」失效：图书 / 出版社 / 馆藏 / 借还书等写操作提交后调用 invalidate("books") 之类，
+#   标签的代数 +1，旧代数的 key 不会再被命中，由 LRU 自然淘汰
+# - 配了只读副本时，标签刚失效的 READ_AFTER_WRITE_SECONDS 秒内从副本读到的结果不放进缓存
+#   (副本可能还没同步到这次修改，放进去会让旧数据一直被命中到 TTL 过期)
+# - 每个 uvicorn worker 各有一份缓存，其他 worker 的写操作最多延迟 TTL 秒才会生效；
+#   需要跨进程共享时，换一个实现了 get / set 的后端 (比如 Redis) 传给 CatalogCache 即可
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from fastapi import Response
+
+import config
+from pagination import PAGE_HEADERS
+from serialize import dumps_rows
+
+
+class TTLCache:
+    """线程安全的 LRU 缓存，每个条目 ttl 秒后过期。"""
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CachedPage:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body, etag, headers):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+
+
+# lookup 时记下的标签代数和缓存 key，查完库交给 store
+CacheTicket = namedtuple("CacheTicket", "tag generation key")
+
+
+class CatalogCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._generation = {}
+        self._invalidated_at = {}  # 标签最近一次失效的 monotonic 时间
+
+    def invalidate(self, *tags):
+        invalidated_at = time.monotonic()
+        with self._lock:
+            for tag in tags:
+                self._generation[tag] = self._generation.get(tag, 0) + 1
+                self._invalidated_at[tag] = invalidated_at
+
+    def _generation_of(self, tag):
+        with self._lock:
+            return self._generation.get(tag, 0)
+
+    def lookup(self, tag, request):
+        """命中时返回 (响应 (200 或 304), None)；没命中返回 (None, ticket)，查完库把 ticket 传给 store。
+
+        代数要在查库之前取：查库期间有写操作提交并 invalidate 时，store 能发现代数变了。
+        """
+        generation = self._generation_of(tag)
+        key = f"{tag}:{generation}:{request.url.path}?{sorted(request.query_params.multi_items())}"
+        page = self.backend.get(key)
+        if page is None:
+            return None, CacheTicket(tag, generation, key)
+        return _respond(page, request), None
+
+    def _settled(self, tag):
+        with self._lock:
+            invalidated_at = self._invalidated_at.get(tag)
+        return invalidated_at is None or time.monotonic() - invalidated_at >= config.READ_AFTER_WRITE_SECONDS
+
+    def store(self, ticket, request, response, rows, from_replica=False):
+        """把查询结果 (serialize.columns 查出的 Row) 序列化后放进缓存，并返回带 ETag 的响应。
+
+        查库期间标签失效过 (代数和 ticket 不一致) 时只返回、不缓存：查到的可能是失效之前的数据，
+        放进新代数的 key 下会一直被命中到 TTL 过期。
+        from_replica: 结果是从只读副本读的，标签刚失效不久时同样只返回、不缓存。
+        """
+        body = dumps_rows(rows)
+        page = CachedPage(
+            body=body,
+            etag='"' + hashlib.sha1(body).hexdigest()[:20] + '"',
+            headers={h: response.headers[h] for h in PAGE_HEADERS if h in response.headers},
+        )
+        if self._generation_of(ticket.tag) == ticket.generation and (not from_replica or self._settled(ticket.tag)):
+            self.backend.set(ticket.key, page)
+        return _respond(page, request)
+
+
+def _not_modified(page, request):
+    # 只认 If-None-Match：ETag 是响应内容的哈希，内容一变就不同。
+    # 不发 Last-Modified / 不认 If-Modified-Since —— 它只精确到秒，同一秒里失效两次会错回 304
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or page.etag in tags
+
+
+def _respond(page, request):
+    headers = {
+        "ETag": page.etag,
+        # 浏览器每次都带 If-None-Match 回来验证，数据没变就拿到 304
+        "Cache-Control": "no-cache",
+        **page.headers,
+    }
+    if _not_modified(page, request):
+        return Response(status_code=304, headers=headers)
+    return Response(content=page.body, media_type="application/json", headers=headers)
+
+
+catalog_cache = CatalogCache(TTLCache(maxsize=config.CATALOG_CACHE_SIZE, ttl=config.CATALOG_CACHE_TTL))
@@ -0,0 +1,218 @@
+# 作用：目录类表 (出版社 / 图书 / 馆藏) 的增量同步 —— GET /changes?since=<版本号> 只返回变过的行
+#
+# 分两步，写事务之间不抢同一行锁：
+# - 修改这三张表的事务在 commit 之前调用 record()：往 change_batches 插一行 (自增 id 是这次改动的批次号)，
+#   把改过的行的 version / updated_at 设成批次号；删除的行写一条 tombstone (change_tombstones)
+# - commit 之后调用 publish()：在一个很短的单独事务里把 change_versions 的计数器 +1，
+#   写到本会话已提交的批次 (以及别的进程已提交、还没分配的批次) 的 change_batches.version 上
+# - 对客户端的版本号就是这个计数器：只有已经提交的批次才会分到版本号，分版本号和计数器 +1 在同一个事务里，
+#   所以读到计数器 N 时 <= N 的批次都已提交，下次从 N 往后取不会漏；不依赖超时和各台机器的时钟
+# - publish() 没执行到 (进程在 commit 之后挂了) 的批次，下一个 publish() 会一起分配版本号，只是晚一点可见
+# - 计数器那一行只在 publish() 的小事务里锁住 (几条按主键的语句)，不会被业务事务拿着等锁、等提交
+# - tombstone 可以定期清理 (python changes.py prune)，比清理点还旧的客户端会收到 reset，自己重新全量加载
+#
+# 用法 (在 backend 目录下)：
+#   python changes.py status            # 当前版本号、tombstone 数量
+#   python changes.py prune --days 30   # 清理 30 天前的删除记录和改动批次
+
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+import models
+import schemas
+import serialize
+
+logger = logging.getLogger("library.changes")
+
+ChangeVersion = models.ChangeVersion.__table__
+ChangeBatch = models.ChangeBatch.__table__
+ChangeTombstone = models.ChangeTombstone.__table__
+
+# 表名 -> (ORM 模型, 返回给客户端的 Response 模型)
+TRACKED = {
+    "publishers": (models.Publisher, schemas.PublisherResponse),
+    "books": (models.Book, schemas.BookResponse),
+    "inventory": (models.Inventory, schemas.InventoryResponse),
+}
+
+# Session.info 里记本会话登记过、还没 publish 的批次号
+_PENDING = "change_batches"
+
+
+def _key_column(model):
+    return model.__table__.primary_key.columns[0]
+
+
+def ensure_counter(conn):
+    """建库 / 迁移后调用：保证版本号计数器那一行存在。"""
+    if conn.execute(select(ChangeVersion.c.id).where(ChangeVersion.c.id == 1)).first() is None:
+        conn.execute(insert(ChangeVersion).values(id=1, version=0, pruned_before=0))
+
+
+def committed_version(db):
+    """当前版本号 (对客户端的版本号)：<= 它的改动都已提交。"""
+    return db.execute(select(ChangeVersion.c.version).where(ChangeVersion.c.id == 1)).scalar_one()
+
+
+def batches_since(since, until=None):
+    """版本号在 (since, until] 里的批次号子查询 (行的 version 列存的是批次号)；until 为空时不设上限。"""
+    query = select(ChangeBatch.c.id).where(ChangeBatch.c.version > since)
+    if until is not None:
+        query = query.where(ChangeBatch.c.version <= until)
+    return query
+
+
+def record(db, deleted=None, **upserted):
+    """登记本事务改过的行，例如 record(db, inventory=[id], books=[isbn])、record(db, deleted={"books": [isbn]})。
+
+    新增的行要先 flush 拿到主键再登记。返回批次号 (只在库内部用，对外的版本号由 commit 之后的 publish() 给出)。
+    """
+    batch = db.execute(insert(ChangeBatch).values(created_at=datetime.now())).inserted_primary_key[0]
+    db.info.setdefault(_PENDING, []).append(batch)
+    now = datetime.now()
+    for name, keys in upserted.items():
+        model, _ = TRACKED[name]
+        keys = sorted(set(keys))
+        if keys:
+            db.execute(
+                update(model.__table__)
+                .where(_key_column(model).in_(keys))
+                .values(version=batch, updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+    rows = [
+        {"version": batch, "table_name": name, "row_key": str(key), "deleted_at": now}
+        for name, keys in (deleted or {}).items() for key in set(keys)
+    ]
+    if rows:
+        db.execute(insert(ChangeTombstone), rows)
+    return batch
+
+
+def publish(db):
+    """commit 之后调用：给已提交的批次分配对外的版本号 (单独的短事务)，返回版本号。
+
+    本会话没有登记过改动时返回 None。出错只记日志、返回 None：数据已经提交了，
+    没分到版本号的批次由之后任何一次 publish() 补上。
+    """
+    pending = db.info.pop(_PENDING, None)
+    if not pending:
+        return None
+    try:
+        # 普通读只能看到已提交的批次：本会话刚提交的，加上别的进程提交后没来得及 publish 的
+        # (回滚掉的批次不存在，也就不会被分配版本号)
+        batches = db.execute(
+            select(ChangeBatch.c.id).where(ChangeBatch.c.version == None).order_by(ChangeBatch.c.id)
+        ).scalars().all()
+        if not batches:
+            db.rollback()
+            return committed_version(db)  # 都被别的 publish() 分配过了
+        db.execute(update(ChangeVersion).where(ChangeVersion.c.id == 1).values(version=ChangeVersion.c.version + 1))
+        version = committed_version(db)
+        # 带 version IS NULL 条件：同时执行的 publish() 已经分配过的不会被改掉
+        db.execute(
+            update(ChangeBatch).where(ChangeBatch.c.id.in_(batches), ChangeBatch.c.version == None)
+            .values(version=version)
+        )
+        db.commit()
+        return version
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("分配增量同步版本号失败，批次 %s 留给下一次 publish()", pending)
+        return None
+
+
+def changes_since(db, since=None, limit=1000):
+    """since 之后的改动。since 不传时只返回当前版本号 (客户端全量加载前先记下它)。
+
+    某张表的改动超过 limit 行、或者 since 已经早于清理点 / 晚于当前版本 (库被重建过) 时返回 reset=True，
+    客户端应该重新全量加载。
+    """
+    current, pruned_before = db.execute(
+        select(ChangeVersion.c.version, ChangeVersion.c.pruned_before).where(ChangeVersion.c.id == 1)
+    ).one()
+    result = {"version": current, "reset": False}
+    result.update({name: {"upserted": [], "deleted": []} for name in TRACKED})
+    if since is None or since == current:
+        return result
+    if since > current or since < pruned_before:
+        result["reset"] = True
+        return result
+
+    # 行后来又被还没分配版本号的批次改过时这次不返回，等那个批次分到更大的版本号时再带上最新的数据
+    batches = batches_since(since, current)
+    for name, (model, schema) in TRACKED.items():
+        upserted = db.execute(
+            select(*serialize.columns(schema, model))
+            .where(model.version.in_(batches))
+            .order_by(model.version)
+            .limit(limit + 1)
+        ).all()
+        tombstones = db.execute(
+            select(ChangeTombstone.c.row_key)
+            .where(ChangeTombstone.c.version.in_(batches), ChangeTombstone.c.table_name == name)
+            .limit(limit + 1)
+        ).scalars().all()
+        if len(upserted) > limit or len(tombstones) > limit:
+            result["reset"] = True
+            return result
+        # 删了又重建 (比如同一个 ISBN) 的行现在还在，以现在的数据为准
+        key = _key_column(model)
+        python_type = key.type.python_type
+        present = {getattr(row, key.key) for row in upserted}
+        deleted = {python_type(k) for k in tombstones} - present
+        result[name] = {"upserted": [row._asdict() for row in upserted], "deleted": sorted(deleted)}
+    return result
+
+
+def prune(db, days=30):
+    """清理 days 天前的 tombstone 和改动批次，返回清理的 tombstone 条数。"""
+    cutoff = datetime.now() - timedelta(days=days)
+    newest = db.execute(
+        select(func.max(ChangeBatch.c.version)).where(ChangeBatch.c.created_at < cutoff)
+    ).scalar()
+    if newest is None:
+        return 0
+    # 还没分配版本号 (version 为空) 和版本号更新的批次都留着；迁移之前写的 tombstone 没有批次，一起清掉
+    removed = db.execute(
+        delete(ChangeTombstone).where(ChangeTombstone.c.version.not_in(
+            select(ChangeBatch.c.id).where(or_(ChangeBatch.c.version > newest, ChangeBatch.c.version == None))
+        ))
+    ).rowcount
+    # 最后一批留一行：MySQL 5.7 重启后自增值从表里现有的最大 id 往后排，表清空了批次号会从头开始
+    db.execute(delete(ChangeBatch).where(ChangeBatch.c.version < newest))
+    db.execute(
+        update(ChangeVersion).where(ChangeVersion.c.id == 1, ChangeVersion.c.pruned_before < newest)
+        .values(pruned_before=newest)
+    )
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量同步版本号 / 删除记录")
+    parser.add_argument("command", choices=["status", "prune"])
+    parser.add_argument("--days", type=int, default=30, help="prune: 保留最近多少天的删除记录")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if args.command == "prune":
+            removed = prune(db, args.days)
+            db.commit()
+            print(f"已清理 {removed} 条删除记录")
+        version, pruned_before = db.execute(
+            select(ChangeVersion.c.version, ChangeVersion.c.pruned_before).where(ChangeVersion.c.id == 1)
+        ).one()
+        tombstones = db.execute(select(func.count()).select_from(ChangeTombstone)).scalar()
+        print(f"当前版本: {version}，已清理到: {pruned_before}，删除记录: {tombstones} 条")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# 作用：借还书的公共业务规则 (单本接口和批量接口共用，保证算法完全一致)
+
+from collections import namedtuple
+
+from sqlalchemy import bindparam
+
+# 默认规则 (fine_rules 表里没有对应读者类别、也没有默认行时使用)：借阅期限 30 天，超期每天 5 毛
+LOAN_DAYS = 30
+DAILY_FINE = 0.5
+# 图书没有录入价格时的默认损坏赔偿
+DEFAULT_DAMAGE_FINE = 50.0
+
+# 一种读者类别的罚款规则 (见 fine_rules.py)
+# max_overdue_fine: 单次借阅超期费上限，None 表示不封顶
+# damage_policy: "price" 按图书价格赔偿 (没有价格时按 damage_fine)；"fixed" 固定按 damage_fine
+FineRule = namedtuple("FineRule", "loan_days daily_fine max_overdue_fine damage_policy damage_fine")
+DEFAULT_RULE = FineRule(LOAN_DAYS, DAILY_FINE, None, "price", DEFAULT_DAMAGE_FINE)
+
+
+def overdue_fine(overdue_days, rule):
+    """超期 overdue_days 天的超期费 (已按上限封顶)。"""
+    fine = overdue_days * rule.daily_fine
+    if rule.max_overdue_fine is not None:
+        fine = min(fine, rule.max_overdue_fine)
+    return fine
+
+
+def calculate_fine(borrow_date, return_date, price, is_damaged, rule=DEFAULT_RULE):
+    """按读者类别的规则计算还书罚款，返回 (总金额, 备注列表)。没有罚款时总金额为 0。"""
+    total_fine = 0.0
+    remark_list = []
+
+    # 1. 计算超期费
+    days_borrowed = (return_date - borrow_date).days
+    overdue_days = days_borrowed - rule.loan_days
+    if overdue_days > 0:
+        fine = overdue_fine(overdue_days, rule)
+        total_fine += fine
+        capped = "，已封顶" if fine < overdue_days * rule.daily_fine else ""
+        remark_list.append(f"超期{overdue_days}天(￥{fine}{capped})")
+
+    # 2. 计算损坏赔偿
+    if is_damaged:
+        if rule.damage_policy == "price" and price:
+            damage_fine = float(price)
+        else:
+            damage_fine = rule.damage_fine
+        total_fine += damage_fine
+        remark_list.append(f"图书损坏赔偿(￥{damage_fine})")
+
+    return total_fine, remark_list
+
+
+def bump_counters(db, table, key_column, value_column, deltas):
+    """批量执行 value_column += delta (executemany)，按主键排序保证加锁顺序一致。"""
+    if not deltas:
+        return
+    db.execute(
+        table.update()
+        .where(table.c[key_column] == bindparam("_key"))
+        .values({value_column: table.c[value_column] + bindparam("_delta")}),
+        [{"_key": key, "_delta": delta} for key, delta in sorted(deltas.items())]
+    )
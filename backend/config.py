@@ -0,0 +1,79 @@
+# 作用：集中读取配置。优先用环境变量，其次是 backend/.env 文件 (参考 .env.example)，最后是这里的默认值
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _bool(name, default):
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# --- 数据库连接 ---
+# 格式: mysql+pymysql://用户名:密码@localhost:3306/数据库名；本地压测可以用 sqlite:///library_bench.db
+# 含密码，没有默认值：必须在 backend/.env 或环境变量里配置
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    raise RuntimeError("没有配置 DATABASE_URL：把 backend/.env.example 复制为 backend/.env 并填写数据库连接，或者设置同名环境变量")
+# 运行模式: sync (默认，PyMySQL + 线程池) / async (异步驱动，接口不占线程池)
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+# 不填则由 DATABASE_URL 换成对应的异步驱动
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+
+# --- 只读副本 (可选)：列表 / 报表类 GET 接口走副本，写操作和刚写完的读仍走主库 (见 replica.py) ---
+# 不填则全部走主库；本地可以用另一个 SQLite 文件或另一个 MySQL 实例测试
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_READ_DATABASE_URL")  # async 模式用，不填则由 READ_DATABASE_URL 换驱动
+REPLICA_MAX_LAG = _float("REPLICA_MAX_LAG", 5)          # 副本落后超过这么多秒就改读主库
+REPLICA_CHECK_INTERVAL = _float("REPLICA_CHECK_INTERVAL", 1)  # 多久检查一次副本延迟 (秒)
+# 写请求之后这么多秒内，同一个客户端的读请求走主库 (读到自己刚写的数据)，应该 >= REPLICA_MAX_LAG
+READ_AFTER_WRITE_SECONDS = _float("READ_AFTER_WRITE_SECONDS", 5)
+
+# --- 连接池 (每个 uvicorn worker 进程各有一个池) ---
+DB_POOL_SIZE = _int("DB_POOL_SIZE", 5)          # 常驻连接数
+DB_MAX_OVERFLOW = _int("DB_MAX_OVERFLOW", 10)   # 高峰时最多再临时开多少个
+DB_POOL_TIMEOUT = _float("DB_POOL_TIMEOUT", 30) # 池满时最多等多少秒，超时报 QueuePool limit 错误
+# 连接用多久后重建，要小于 MySQL 的 wait_timeout (默认 8 小时)，否则会拿到被服务端断开的连接
+DB_POOL_RECYCLE = _int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = _bool("DB_POOL_PRE_PING", True)  # 取连接前先 ping，自动丢弃失效连接
+DB_CONNECT_TIMEOUT = _int("DB_CONNECT_TIMEOUT", 10)  # 建立新连接的超时 (秒)
+
+# --- 目录缓存 (/publishers/、/books/)，每个 worker 一份 ---
+CATALOG_CACHE_SIZE = _int("CATALOG_CACHE_SIZE", 256)  # 最多缓存多少个不同的查询 (筛选条件/分页)
+CATALOG_CACHE_TTL = _float("CATALOG_CACHE_TTL", 60)    # 秒；多 worker 时其他进程的修改最多延迟这么久可见
+
+# --- 监控 (GET /metrics，Prometheus 格式) ---
+METRICS_ENABLED = _bool("METRICS_ENABLED", True)
+SLOW_REQUEST_MS = _float("SLOW_REQUEST_MS", 1000)  # 超过这么多毫秒的请求记慢日志 (附带 SQL)，0 = 关闭
+SLOW_REQUEST_MAX_STATEMENTS = _int("SLOW_REQUEST_MAX_STATEMENTS", 50)  # 慢日志里每个请求最多记多少条 SQL
+
+# --- 登录 / 鉴权 (见 auth.py) ---
+# token 签名密钥：多个 worker / 重启后要保持一致，生产环境一定要配置；不配则每个进程随机生成一个
+AUTH_SECRET = os.getenv("AUTH_SECRET", "")
+AUTH_TOKEN_HOURS = _float("AUTH_TOKEN_HOURS", 12)          # 登录一次 token 有效多久
+AUTH_PBKDF2_ITERATIONS = _int("AUTH_PBKDF2_ITERATIONS", 600000)  # 密码哈希迭代次数 (调高后旧密码下次登录时自动重新哈希)
+AUTH_CACHE_SIZE = _int("AUTH_CACHE_SIZE", 10000)           # 每个 worker 缓存多少个已验证的会话
+AUTH_CACHE_TTL = _float("AUTH_CACHE_TTL", 60)              # 秒；其他 worker 吊销的会话最多这么久后失效
+
+# --- 幂等键 (借书 / 还书 / 缴罚款的 Idempotency-Key，见 idempotency.py) ---
+# memory：每个 worker 一份 (单 worker 够用)；database：存 idempotency_keys 表，多 worker 之间共享
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+IDEMPOTENCY_TTL = _float("IDEMPOTENCY_TTL", 86400)         # 记住第一次的响应多少秒
+IDEMPOTENCY_CACHE_SIZE = _int("IDEMPOTENCY_CACHE_SIZE", 10000)  # 每个 worker 内存里最多记多少个
+
+# --- 罚款规则 (fine_rules 表，见 fine_rules.py)，每个 worker 缓存一份 ---
+FINE_RULES_CACHE_TTL = _float("FINE_RULES_CACHE_TTL", 60)  # 秒；其他 worker 改的规则最多这么久后生效
+
+# --- 看板统计 (stats_daily，见 stats.py) ---
+# 每天的计数分成几行累加：借还书随机挑一行，并发的事务很少抢同一行锁；看板读的时候再按天求和
+STATS_DAILY_SHARDS = _int("STATS_DAILY_SHARDS", 16)
@@ -0,0 +1,128 @@
+# 作用：流通事件推送 —— 借书 / 还书 / 馆藏增删 / 缴罚款 之后广播一条事件，各个流通台通过 WebSocket 实时收到，
+# 不用再反复轮询整张表。
+#
+# - 接口在 commit 成功之后调用 publish("borrow", inventory_id=..., ...)，没提交的修改不会被推出去
+# - LocalBroker 是进程内的发布 / 订阅：每个 WebSocket 连接一个有界队列，事件只编码一次再分发。
+#   接口跑在线程池里，所以投递用 loop.call_soon_threadsafe 交回连接所在的事件循环
+# - 多个 uvicorn worker 时每个进程各有一份订阅者，只能收到本进程处理的事件；
+#   需要跨进程时换一个实现了 publish / subscribe 的 broker (比如 Redis pub/sub) 赋给 events.broker 即可
+# - 客户端处理不过来 (队列满) 时发一条 overflow 并断开，客户端重连后用 GET /changes 补齐
+#
+# 事件格式 (JSON 文本帧)：{"type": "borrow", "at": "2024-01-01T08:00:00", "version": 123, ...}
+#   borrow / return:                     inventory_id, isbn, card_id (return 另有 fine)
+#   inventory_created / inventory_deleted: inventory_id, isbn
+#   fine_paid:                           fine_id, card_id, amount
+#   version 是这次修改在 /changes 里的版本号 (有的话)
+
+import asyncio
+import contextlib
+import json
+import threading
+from datetime import datetime
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+EVENT_TYPES = ("borrow", "return", "inventory_created", "inventory_deleted", "fine_paid")
+QUEUE_SIZE = 1000
+
+_OVERFLOW = object()
+
+
+class _Subscriber:
+    __slots__ = ("loop", "queue")
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, item):
+        # 在订阅者自己的事件循环里执行
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            item = _OVERFLOW
+        self.queue.put_nowait(item)
+
+
+class LocalBroker:
+    """进程内 broker：publish 可以在任意线程调用，subscribe 在事件循环里使用。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def publish(self, message):
+        """message: (事件类型, 已编码好的 JSON 文本)"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(sub.deliver, message)
+            except RuntimeError:  # 事件循环已经关了
+                self._discard(sub)
+
+    @contextlib.contextmanager
+    def subscribe(self):
+        sub = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(sub)
+        try:
+            yield sub.queue
+        finally:
+            self._discard(sub)
+
+    def _discard(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+broker = LocalBroker()
+
+
+def publish(event_type, **payload):
+    """接口 commit 之后调用。没有订阅者时几乎没有开销。"""
+    if not broker.subscriber_count:
+        return
+    event = {"type": event_type, "at": datetime.now().isoformat(timespec="seconds"), **payload}
+    broker.publish((event_type, json.dumps(event, ensure_ascii=False, default=str)))
+
+
+async def serve(websocket: WebSocket, types=None):
+    """WebSocket 连接的收发循环：把订阅到的事件推给客户端，直到客户端断开。
+
+    types: 只要这些类型的事件 (None 表示全部)。客户端发来的消息都忽略，只用来发现断开。
+    """
+    await websocket.accept()
+    with broker.subscribe() as queue:
+        receiver = asyncio.ensure_future(_wait_disconnect(websocket))
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver in done:
+                    getter.cancel()
+                    return
+                item = getter.result()
+                if item is _OVERFLOW:
+                    await websocket.send_text(json.dumps({"type": "overflow"}))
+                    await websocket.close(code=1013)  # Try Again Later
+                    return
+                event_type, text = item
+                if types is None or event_type in types:
+                    await websocket.send_text(text)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+
+
+async def _wait_disconnect(websocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
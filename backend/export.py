@@ -0,0 +1,78 @@
+# 作用：罚款 / 借阅记录全量导出 (CSV 或 NDJSON，边查边发)
+#
+# - 单独占用一个连接，用服务端游标 (stream_results) 按 yield_per 行分批取数据，
+#   只查需要的列，不构造 ORM 对象，所以内存占用和表的大小无关
+# - 表头 / 第一批数据一查出来就开始发送，客户端不用等整个查询结束
+# - 导出期间这个连接一直被占用，导出很大的表时注意连接池余量
+
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import select
+
+import models
+
+YIELD_PER = 5000
+
+# 导出的表 -> (列, 排序)
+EXPORTS = {
+    "fines": (
+        [models.Fine.id, models.Fine.card_id, models.Fine.amount, models.Fine.is_paid, models.Fine.remark],
+        models.Fine.id,
+    ),
+    "borrow_records": (
+        [models.BorrowRecord.id, models.BorrowRecord.card_id, models.BorrowRecord.inventory_id,
+         models.BorrowRecord.borrow_date, models.BorrowRecord.return_date],
+        models.BorrowRecord.id,
+    ),
+}
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def export_statement(kind, card_id=None):
+    columns, order_by = EXPORTS[kind]
+    stmt = select(*columns).order_by(order_by)
+    if card_id is not None:
+        stmt = stmt.where(columns[0].table.c.card_id == card_id)
+    return stmt
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} 无法序列化")
+
+
+def _csv_value(value):
+    return value.isoformat(sep=" ") if isinstance(value, datetime) else value
+
+
+def stream_export(bind, kind, fmt="csv", card_id=None, yield_per=YIELD_PER):
+    """生成器：逐批产出编码好的字节。客户端断开时生成器被关闭，连接随之归还连接池。"""
+    stmt = export_statement(kind, card_id)
+    with bind.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=yield_per).execute(stmt)
+        keys = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            buffer.write("﻿")  # BOM，Excel 打开中文不乱码
+            writer.writerow(keys)
+            yield buffer.getvalue().encode("utf-8")
+
+        for rows in result.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            if fmt == "csv":
+                writer.writerows([_csv_value(v) for v in row] for row in rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(keys, row)), default=_json_default, ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue().encode("utf-8")
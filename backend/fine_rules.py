@@ -0,0 +1,113 @@
+# 作用：按读者类别 (readers.category) 配置的罚款规则 —— 借阅期限、超期每天罚款、超期费上限、损坏赔偿方式
+#
+# - 规则存 fine_rules 表，category="*" 那一行是默认规则，没有单独配置的类别都用它
+# - 还书 / 批量还书 / 超期统计每次都要用：整张表 (一般只有几行) 一次读出来放进进程内缓存，命中时不查库。
+#   PUT / DELETE /fine-rules/{category} 提交后本进程立即失效，其他 worker 最多 FINE_RULES_CACHE_TTL 秒后生效
+# - 从只读副本读到的规则不放进缓存 (副本可能还没同步到刚改的规则)，缓存只由主库的读取填充
+# - 改规则只影响之后的还书和超期统计，已经生成的罚款不会重算
+
+import threading
+
+from sqlalchemy import select
+
+import config
+import models
+import replica
+from cache import TTLCache
+from circulation import DEFAULT_RULE, FineRule
+
+DEFAULT_CATEGORY = "*"
+# 建库时按原来写死的规则给这几类读者各建一行，方便管理员直接修改
+SEED_CATEGORIES = ("学生", "教师", "校外人员")
+
+FineRuleTable = models.FineRule.__table__
+
+_cache = TTLCache(maxsize=1, ttl=config.FINE_RULES_CACHE_TTL)
+# 每次 invalidate 加 1；读库前记下，读完发现变了 (读的过程中规则被改) 就不放进缓存
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+class FineRules:
+    """所有类别的规则。for_category 找不到时返回默认规则。"""
+
+    def __init__(self, by_category):
+        self.by_category = by_category
+        self.default = by_category.get(DEFAULT_CATEGORY, DEFAULT_RULE)
+
+    def for_category(self, category):
+        return self.by_category.get(category, self.default)
+
+    def all(self):
+        return [*self.by_category.values(), self.default]
+
+
+def _to_rule(row):
+    return FineRule(
+        loan_days=row.loan_days,
+        daily_fine=float(row.daily_fine),
+        max_overdue_fine=None if row.max_overdue_fine is None else float(row.max_overdue_fine),
+        damage_policy=row.damage_policy,
+        damage_fine=float(row.damage_fine),
+    )
+
+
+def current(db):
+    """当前生效的规则 (缓存命中时不查库)。"""
+    rules = _cache.get("rules")
+    if rules is None:
+        generation = _generation
+        rows = db.execute(select(FineRuleTable)).all()
+        rules = FineRules({row.category: _to_rule(row) for row in rows})
+        if not replica.is_replica(db):
+            with _generation_lock:
+                if generation == _generation:
+                    _cache.set("rules", rules)
+    return rules
+
+
+def invalidate():
+    """规则改过之后 (commit 之后) 调用。"""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        _cache.clear()
+
+
+def ensure_defaults(conn):
+    """建库 / 迁移后调用：表是空的时候按 circulation.DEFAULT_RULE 建默认规则和几类常见读者的规则。"""
+    if conn.execute(select(FineRuleTable.c.category).limit(1)).first() is not None:
+        return
+    conn.execute(FineRuleTable.insert(), [
+        {"category": category, **DEFAULT_RULE._asdict()}
+        for category in (DEFAULT_CATEGORY, *SEED_CATEGORIES)
+    ])
+
+
+def list_rules(db):
+    return db.query(models.FineRule).order_by(models.FineRule.category).all()
+
+
+def save(db, category, rule):
+    """新建或修改一个类别的规则 (rule 是 schemas.FineRuleBase)，提交后让缓存失效。"""
+    db_rule = db.get(models.FineRule, category)
+    if db_rule is None:
+        db_rule = models.FineRule(category=category)
+        db.add(db_rule)
+    for name, value in rule.dict().items():
+        setattr(db_rule, name, value)
+    db.commit()
+    invalidate()
+    db.refresh(db_rule)
+    return db_rule
+
+
+def delete(db, category):
+    """删除一个类别的规则 (之后这类读者用默认规则)。不存在时返回 False。"""
+    db_rule = db.get(models.FineRule, category)
+    if db_rule is None:
+        return False
+    db.delete(db_rule)
+    db.commit()
+    invalidate()
+    return True
@@ -0,0 +1,251 @@
+# 作用：借书 / 还书 / 缴罚款 接口的幂等键 (请求头 Idempotency-Key)
+#
+# 前端请求超时后用户再点一次，其实第一次已经成功了：还书会报「未找到该书的在借记录」，缴费又白走一遍事务。
+# 客户端给同一次操作带上同一个 Idempotency-Key，这里记住第一次的响应，重试时原样返回
+# (响应头带 Idempotency-Replayed: true)，只查一次缓存，不再开事务。
+#
+# - key 按 当前用户 + 请求路径 区分；同一个 key 换了请求内容返回 422
+# - 第一次请求还没处理完时，重试会等它 (最多 WAIT_SECONDS 秒) 再返回它的结果
+# - 2xx 和 4xx (比如「该书已被借出」) 的结果都记住；500 / 异常不记，重试会真正重新执行
+# - 存储：IDEMPOTENCY_BACKEND=memory (默认，每个 worker 一份 TTL 缓存)；
+#   database 存 idempotency_keys 表，多 worker 共享，已完成的结果也先查本进程缓存
+# - 业务事务和「记住响应」不是同一个事务：进程恰好在两者之间退出时，重试会真正再执行一次
+#   (借还书的条件 UPDATE 保证不会重复借出 / 重复还书，只是返回的是业务错误)
+#
+# 用法 (在 backend 目录下)：
+#   python idempotency.py prune     # 清理 idempotency_keys 表里过期的记录 (database 模式)
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import Header, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+import config
+import models
+from cache import TTLCache
+
+HEADER = "Idempotency-Key"
+WAIT_SECONDS = 10   # 重试等第一次请求处理完最多等多久
+LOCK_SECONDS = 60   # 处理中的 key 超过这么久还没完成，认为第一次请求已经中途退出，可以重新执行
+
+IdempotencyKey = models.IdempotencyKey.__table__
+
+
+class Record:
+    __slots__ = ("fingerprint", "status_code", "body", "locked_until")
+
+    def __init__(self, fingerprint, status_code=None, body=None):
+        self.fingerprint = fingerprint
+        self.status_code = status_code  # None：第一次请求还在处理
+        self.body = body
+        self.locked_until = time.monotonic() + LOCK_SECONDS
+
+    @property
+    def done(self):
+        return self.status_code is not None
+
+
+class MemoryStore:
+    """每个 worker 一份，全是内存操作。"""
+    blocking = False
+
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def cached(self, key):
+        return self._cache.get(key)
+
+    get = cached
+
+    def claim(self, key, fingerprint):
+        """key 没被用过时占住它并返回 None；已有记录 (处理中 / 已完成) 时返回那条记录。"""
+        with self._lock:
+            record = self._cache.get(key)
+            if record is not None and (record.done or record.locked_until > time.monotonic()):
+                return record
+            self._cache.set(key, Record(fingerprint))
+            return None
+
+    def complete(self, key, record):
+        self._cache.set(key, record)
+
+    def release(self, key):
+        self._cache.pop(key)
+
+
+class DatabaseStore:
+    """存 idempotency_keys 表 (多 worker 共享)，已完成的记录在本进程再缓存一份。方法会查库，要在线程池里调用。"""
+    blocking = True
+
+    def __init__(self, bind, maxsize, ttl):
+        self.bind = bind
+        self.ttl = ttl
+        self._done = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def cached(self, key):
+        return self._done.get(key)
+
+    def get(self, key):
+        record = self._done.get(key)
+        if record is not None:
+            return record
+        with self.bind.connect() as conn:
+            row = conn.execute(select(IdempotencyKey).where(IdempotencyKey.c.key == key)).first()
+        return _from_row(row) if row is not None else None
+
+    def claim(self, key, fingerprint):
+        for _ in range(3):
+            now = datetime.now()
+            try:
+                with self.bind.begin() as conn:
+                    conn.execute(insert(IdempotencyKey).values(
+                        key=key, request_hash=fingerprint, created_at=now,
+                        expires_at=now + timedelta(seconds=LOCK_SECONDS)
+                    ))
+                return None
+            except IntegrityError:
+                pass  # 已经有这个 key
+            with self.bind.begin() as conn:
+                row = conn.execute(select(IdempotencyKey).where(IdempotencyKey.c.key == key)).first()
+                if row is not None and row.expires_at > now:
+                    return _from_row(row)
+                # 已过期，或者处理中途退出留下的：删掉重新占
+                conn.execute(delete(IdempotencyKey).where(IdempotencyKey.c.key == key,
+                                                          IdempotencyKey.c.expires_at <= now))
+        raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的请求正在处理，请稍后重试")
+
+    def complete(self, key, record):
+        with self.bind.begin() as conn:
+            conn.execute(
+                update(IdempotencyKey).where(IdempotencyKey.c.key == key).values(
+                    status_code=record.status_code,
+                    response_body=json.dumps(record.body, ensure_ascii=False),
+                    expires_at=datetime.now() + timedelta(seconds=self.ttl),
+                )
+            )
+        self._done.set(key, record)
+
+    def release(self, key):
+        with self.bind.begin() as conn:
+            conn.execute(delete(IdempotencyKey).where(IdempotencyKey.c.key == key))
+
+
+def _from_row(row):
+    record = Record(row.request_hash, row.status_code)
+    if row.response_body is not None:
+        record.body = json.loads(row.response_body)
+    return record
+
+
+if config.IDEMPOTENCY_BACKEND == "database":
+    from database import engine
+    store = DatabaseStore(engine, config.IDEMPOTENCY_CACHE_SIZE, config.IDEMPOTENCY_TTL)
+else:
+    store = MemoryStore(config.IDEMPOTENCY_CACHE_SIZE, config.IDEMPOTENCY_TTL)
+
+
+async def _call(fn, *args):
+    if store.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+
+def _fingerprint(kwargs):
+    content = jsonable_encoder({k: v for k, v in kwargs.items() if k != "db"})
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+async def _replay(key, record, fingerprint):
+    if record.fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="该 Idempotency-Key 已用于内容不同的请求")
+    deadline = time.monotonic() + WAIT_SECONDS
+    while not record.done:
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的请求正在处理，请稍后重试")
+        await asyncio.sleep(0.05)
+        record = await _call(store.get, key)
+        if record is None:  # 第一次请求出错，key 已经释放
+            raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的请求处理失败，请重试")
+    return JSONResponse(status_code=record.status_code, content=record.body,
+                        headers={"Idempotency-Replayed": "true"})
+
+
+_EXTRA_PARAMETERS = [
+    inspect.Parameter("idempotency_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+    inspect.Parameter(
+        "idempotency_key", inspect.Parameter.KEYWORD_ONLY, annotation=Optional[str],
+        default=Header(None, alias=HEADER, max_length=255),
+    ),
+]
+
+
+def idempotent(endpoint):
+    """接口装饰器 (放在 @app.post 和 @with_db 之间)：带了 Idempotency-Key 的重试直接返回第一次的响应。
+
+    没带这个请求头时和原来完全一样。接口函数的返回值要能被 jsonable_encoder 编码 (dict / Pydantic 模型)。
+    """
+    signature = inspect.signature(endpoint)
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, idempotency_request: Request, idempotency_key: Optional[str] = None, **kwargs):
+        if not idempotency_key:
+            return await endpoint(*args, **kwargs)
+        user = getattr(idempotency_request.state, "user", None)
+        scope = f"{user.user_id if user else '-'}:{idempotency_request.url.path}:{idempotency_key}"
+        key = hashlib.sha256(scope.encode("utf-8")).hexdigest()
+        fingerprint = _fingerprint(kwargs)
+
+        # 已完成的重试：只查一次本进程缓存
+        record = store.cached(key) or await _call(store.claim, key, fingerprint)
+        if record is not None:
+            return await _replay(key, record, fingerprint)
+        try:
+            result = await endpoint(*args, **kwargs)
+        except HTTPException as e:
+            if e.status_code >= 500:
+                await _call(store.release, key)
+            else:
+                await _call(store.complete, key, Record(fingerprint, e.status_code, {"detail": e.detail}))
+            raise
+        except BaseException:
+            await _call(store.release, key)
+            raise
+        await _call(store.complete, key, Record(fingerprint, 200, jsonable_encoder(result)))
+        return result
+
+    # FastAPI 按签名注入参数：在原接口的参数后面加上 Request 和 Idempotency-Key 请求头
+    wrapper.__signature__ = signature.replace(parameters=[*signature.parameters.values(), *_EXTRA_PARAMETERS])
+    return wrapper
+
+
+def prune(bind):
+    """删除 idempotency_keys 表里过期的记录，返回删除条数。"""
+    with bind.begin() as conn:
+        return conn.execute(delete(IdempotencyKey).where(IdempotencyKey.c.expires_at <= datetime.now())).rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="幂等键记录")
+    parser.add_argument("command", choices=["prune"])
+    parser.parse_args()
+
+    from database import engine
+    print(f"已清理 {prune(engine)} 条过期记录")
+
+
+if __name__ == "__main__":
+    main()
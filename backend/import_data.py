@@ -0,0 +1,39 @@
+# 作用：命令行批量导入图书 / 馆藏 (和 POST /import/{kind} 接口逻辑相同)
+# 用法:
+#   python import_data.py books new_books.csv
+#   python import_data.py inventory copies.ndjson --chunk-size 5000
+
+import argparse
+
+from database import SessionLocal
+from bulk_import import CHUNK_SIZE, run_import
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导入图书 / 馆藏 (CSV 或 NDJSON)")
+    parser.add_argument("kind", choices=["books", "inventory"])
+    parser.add_argument("path", help="CSV 或 NDJSON 文件路径")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="默认按扩展名判断")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+
+    db = SessionLocal()
+    try:
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            report = run_import(db, args.kind, f, fmt, args.chunk_size).as_dict()
+    finally:
+        db.close()
+
+    print(f"✅ 共 {report['rows']} 行，新增图书 {report['books_inserted']} 本，"
+          f"入库 {report['copies_inserted']} 册，错误 {report['error_count']} 行")
+    print(f"   耗时 {report['elapsed_seconds']} 秒，{report['rows_per_second']} 行/秒")
+    for err in report["errors"][:20]:
+        print(f"   ❌ 第 {err['line']} 行: {err['error']}")
+    if report["error_count"] > 20:
+        print(f"   ... 另有 {report['error_count'] - 20} 行错误未显示")
+
+
+if __name__ == "__main__":
+    main()
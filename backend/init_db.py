@@ -1,25 +1,44 @@
-import models
-from database import engine, SessionLocal
+import argparse
+import random
+import time
+from array import array
 from datetime import datetime, timedelta
 
-# ❌ 删除了 passlib 相关的引用，不再进行加密
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
 
-def init_db():
-    db = SessionLocal()
-    
+import models, search, migrate, stats, changes, auth, reconcile, fine_rules
+from database import engine
+from circulation import calculate_fine
+
+# 管理员密码用 auth.hash_password 存哈希 (标准库 PBKDF2，不依赖 passlib)
+
+def reset_schema(bind):
     print("🔥 [1/6] 正在清空旧数据库...")
-    models.Base.metadata.drop_all(bind=engine)
-    
+    models.Base.metadata.drop_all(bind=bind)
+
     print("🏗️ [2/6] 正在重建表结构...")
-    models.Base.metadata.create_all(bind=engine)
+    models.Base.metadata.create_all(bind=bind)
+    migrate.upgrade(bind)
+    # schema_version 不随 drop_all 清空，迁移不会重跑；版本号那一行在这里补上
+    with bind.begin() as conn:
+        changes.ensure_counter(conn)
+        reconcile.ensure_state(conn)
+        fine_rules.ensure_defaults(conn)
+    search.ensure_search_index(bind, rebuild=True)
+
+
+def init_db(bind=engine):
+    db = Session(bind=bind)
+    reset_schema(bind)
     
-    print("👮 [3/6] 正在创建管理员账号 (明文密码)...")
+    print("👮 [3/6] 正在创建管理员账号...")
     
-    # ✅ 修改点：直接存储明文字符串 "123456"
+    # 密码存 PBKDF2 哈希 (见 auth.py)，登录时输入 123456
     admins = [
-        models.User(username="admin1", password="123456"),
-        models.User(username="admin2", password="123456"),
-        models.User(username="admin3", password="123456"),
+        models.User(username="admin1", password=auth.hash_password("123456")),
+        models.User(username="admin2", password=auth.hash_password("123456")),
+        models.User(username="admin3", password=auth.hash_password("123456")),
     ]
     db.add_all(admins)
     db.commit()
@@ -38,8 +57,8 @@ def init_db():
 
     # --- 2. 图书 ---
     books = [
-        models.Book(isbn="978-7-302", title="深入理解计算机系统", author="Randal E.Bryant", publisher_id=1, price=139.00, stock_qty=3),
-        models.Book(isbn="978-7-111", title="算法导论", author="Thomas H.Cormen", publisher_id=2, price=128.00, stock_qty=2),
+        models.Book(isbn="978-7-302", title="深入理解计算机系统", author="Randal E.Bryant", publisher_id=1, price=139.00, stock_qty=2),
+        models.Book(isbn="978-7-111", title="算法导论", author="Thomas H.Cormen", publisher_id=2, price=128.00, stock_qty=1),
         models.Book(isbn="978-7-020", title="百年孤独", author="马尔克斯", publisher_id=3, price=55.00, stock_qty=1),
         models.Book(isbn="978-0-596", title="Learning Python", author="Mark Lutz", publisher_id=4, price=350.00, stock_qty=2),
     ]
@@ -98,10 +117,201 @@ def init_db():
     db.add_all([b1, b2])
     db.commit()
 
+    # 首页看板的统计汇总表
+    stats.rebuild(db)
+    db.commit()
+
     print("✅ [6/6] 数据库初始化完成！")
-    print("   管理员账号: admin1 / 123456 (明文)")
+    print("   管理员账号: admin1 / 123456")
     
     db.close()
 
+# ===========================
+# 大数据量模式：生成可复现的模拟数据，用于性能测试
+# python init_db.py --readers 200000 --books 500000 --copies 2000000 --loans 5000000
+# python init_db.py --url sqlite:///library_bench.db --books 100000 ...   (离线复现用本地 SQLite 文件)
+# ===========================
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+GIVEN_CHARS = "伟芳娜秀敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉萍红娥玲芬燕彩春菊兰凤洁梅琳素云莲真环雪荣爱妹香月莺媛瑞凡佳嘉琼勤珍贞莉桂娣叶璧璐娅琦晶妍茜秋珊莎锦黛青倩婷姣婉娴瑾颖露瑶怡婵雁蓓纨仪荷丹蓉眉君琴蕊薇菁梦岚苑婕馨瑗琰韵融园艺咏卿聪澜纯毓悦昭冰爽琬茗羽希宁欣飘育滢馥筠柔竹霭凝晓欢霄枫芸菲寒伊亚宜可姬舒影荔枝思丽"
+TITLE_WORDS = [
+    "数据库", "系统", "原理", "算法", "设计", "分析", "导论", "实践", "编程", "网络", "操作系统", "编译",
+    "机器学习", "人工智能", "历史", "文学", "哲学", "经济学", "管理", "心理学", "艺术", "物理", "化学", "数学",
+    "中国", "世界", "现代", "古代", "简明", "高级", "基础", "教程", "手册", "研究", "概论", "通史",
+    "Python", "Java", "Linux", "Data", "Learning", "Systems", "Design", "Patterns", "Introduction", "Modern",
+]
+CATEGORIES = [("学生", 80), ("教师", 15), ("校外人员", 5)]
+
+LOST_RATIO = 0.01           # 1% 的馆藏丢失/损毁 (status=-1)
+OPEN_LOAN_RATIO = 0.10      # 借阅记录里约 10% 还没还
+MAX_OPEN_COPY_RATIO = 0.30  # 同一时刻最多 30% 的在馆书被借出
+OVERDUE_RETURN_RATIO = 0.15 # 已还的书里 15% 超期归还
+DAMAGED_RATIO = 0.01        # 1% 损坏归还
+FINE_PAID_RATIO = 0.85      # 85% 的罚款已缴
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _bulk_insert(bind, table, rows, chunk_size):
+    count = 0
+    with bind.begin() as conn:
+        for chunk in _chunks(rows, chunk_size):
+            conn.execute(table.insert(), chunk)
+            count += len(chunk)
+    return count
+
+
+def seed_scale(bind, readers, books, copies, loans, seed=42, chunk_size=10000):
+    rnd = random.Random(seed)
+    started = time.perf_counter()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    publishers = max(4, books // 5000)
+    copies = max(copies, books) if books else 0  # 每本书至少一册
+
+    reset_schema(bind)
+
+    print("👮 [3/6] 正在创建管理员账号...")
+    _bulk_insert(bind, models.User.__table__,
+                 ({"username": f"admin{i}", "password": auth.hash_password("123456")} for i in range(1, 4)), chunk_size)
+
+    # --- 先在内存里算好馆藏状态和在借记录，保证各个计数字段一致 ---
+    copy_book = array("i", (i if i < books else rnd.randrange(books) for i in range(copies)))
+    status = array("b", (-1 if rnd.random() < LOST_RATIO else 1 for _ in range(copies)))
+
+    open_target = min(loans // 10 if loans else 0, int(copies * MAX_OPEN_COPY_RATIO))
+    open_loans = []  # (copy_index, reader_index, borrow_date)
+    reader_open = array("i", bytes(4 * readers)) if readers else array("i")
+    if readers:
+        for c in rnd.sample(range(copies), min(copies, int(open_target / (1 - LOST_RATIO)) + 1)):
+            if len(open_loans) >= open_target:
+                break
+            if status[c] != 1:
+                continue
+            status[c] = 0
+            r = rnd.randrange(readers)
+            reader_open[r] += 1
+            # 借出 0~60 天，借阅期限 30 天，所以大约一半已超期
+            open_loans.append((c, r, today - timedelta(days=rnd.randint(0, 60), minutes=rnd.randint(0, 1439))))
+
+    stock = array("i", bytes(4 * books))
+    for c in range(copies):
+        if status[c] == 1:
+            stock[copy_book[c]] += 1
+    prices = [round(rnd.uniform(20, 200), 2) for _ in range(books)]
+
+    print(f"📚 [4/6] 正在录入基础数据 ({publishers} 家出版社 / {books} 种图书 / {readers} 位读者)...")
+    _bulk_insert(bind, models.Publisher.__table__, (
+        {"id": p + 1, "name": f"模拟出版社{p + 1:05d}", "address": "北京"} for p in range(publishers)
+    ), chunk_size)
+    _bulk_insert(bind, models.Book.__table__, (
+        {
+            "isbn": f"978-{b:010d}",
+            "title": "".join(rnd.sample(TITLE_WORDS, rnd.randint(2, 4))) + f"({b})",
+            "author": rnd.choice(SURNAMES) + "".join(rnd.choices(GIVEN_CHARS, k=rnd.randint(1, 2))),
+            "publisher_id": rnd.randrange(publishers) + 1,
+            "price": prices[b],
+            "stock_qty": stock[b],
+        } for b in range(books)
+    ), chunk_size)
+    cat_names = [c for c, _ in CATEGORIES]
+    cat_weights = [w for _, w in CATEGORIES]
+    _bulk_insert(bind, models.Reader.__table__, (
+        {
+            "card_id": r + 1,
+            "name": rnd.choice(SURNAMES) + "".join(rnd.choices(GIVEN_CHARS, k=rnd.randint(1, 2))),
+            "category": rnd.choices(cat_names, cat_weights)[0],
+            "borrowed_count": reader_open[r],
+        } for r in range(readers)
+    ), chunk_size)
+
+    print(f"📦 [5/6] 正在录入 {copies} 册馆藏与 {loans} 条借阅记录...")
+    _bulk_insert(bind, models.Inventory.__table__, (
+        {"id": c + 1, "isbn": f"978-{copy_book[c]:010d}", "status": status[c]} for c in range(copies)
+    ), chunk_size)
+    _bulk_insert(bind, models.BorrowRecord.__table__, (
+        {"card_id": r + 1, "inventory_id": c + 1, "borrow_date": d, "return_date": None}
+        for c, r, d in open_loans
+    ), chunk_size)
+
+    # 已归还的历史记录：近 3 年内，大部分按期归还，部分超期 / 损坏，按真实规则生成罚款
+    fines = []
+    closed = 0
+    if readers and loans > len(open_loans):
+        with bind.begin() as conn:
+            for chunk in _chunks(range(loans - len(open_loans)), chunk_size):
+                records = []
+                for _ in chunk:
+                    c = rnd.randrange(copies)
+                    r = rnd.randrange(readers)
+                    if rnd.random() < OVERDUE_RETURN_RATIO:
+                        kept = rnd.randint(31, 120)
+                    else:
+                        kept = rnd.randint(1, 30)
+                    # 借出时间至少在 kept + 1 天前，保证归还时间不会晚于今天
+                    borrow_date = today - timedelta(days=rnd.randint(max(61, kept + 1), 3 * 365),
+                                                    minutes=rnd.randint(0, 1439))
+                    return_date = borrow_date + timedelta(days=kept, minutes=rnd.randint(0, 600))
+                    records.append({"card_id": r + 1, "inventory_id": c + 1,
+                                    "borrow_date": borrow_date, "return_date": return_date})
+                    total_fine, remark_list = calculate_fine(
+                        borrow_date, return_date, prices[copy_book[c]], rnd.random() < DAMAGED_RATIO
+                    )
+                    if total_fine > 0:
+                        paid = rnd.random() < FINE_PAID_RATIO
+                        fines.append({"card_id": r + 1, "amount": total_fine, "remark": "，".join(remark_list),
+                                      "is_paid": 1 if paid else 0, "created_at": return_date,
+                                      "paid_at": return_date + timedelta(
+                                          days=rnd.randint(0, min(14, (today - return_date).days))
+                                      ) if paid else None})
+                conn.execute(models.BorrowRecord.__table__.insert(), records)
+                closed += len(records)
+                if len(fines) >= chunk_size:
+                    conn.execute(models.Fine.__table__.insert(), fines)
+                    fines = []
+            if fines:
+                conn.execute(models.Fine.__table__.insert(), fines)
+
+    with bind.begin() as conn:
+        stats.rebuild(conn)
+
+    print(f"✅ [6/6] 模拟数据生成完成！在借 {len(open_loans)} 条，已还 {closed} 条，"
+          f"耗时 {time.perf_counter() - started:.1f} 秒")
+    print("   管理员账号: admin1 / 123456")
+
+
+def _fast_sqlite(dbapi_conn, _record):
+    # 只用于生成数据：本地 SQLite 关掉同步写盘，批量插入快很多
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.close()
+
+
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="初始化数据库；带数量参数时生成大规模模拟数据")
+    parser.add_argument("--url", help="数据库连接串，默认使用 database.py 里的配置，例如 sqlite:///library_bench.db")
+    parser.add_argument("--readers", type=int, default=0)
+    parser.add_argument("--books", type=int, default=0)
+    parser.add_argument("--copies", type=int, default=0)
+    parser.add_argument("--loans", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，相同参数生成相同数据")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    bind = create_engine(args.url) if args.url else engine
+    if bind.dialect.name == "sqlite":
+        event.listen(bind, "connect", _fast_sqlite)
+
+    if args.readers or args.books or args.copies or args.loans:
+        seed_scale(bind, args.readers, args.books, args.copies, args.loans, args.seed, args.chunk_size)
+    else:
+        init_db(bind)
\ No newline at end of file
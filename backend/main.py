@@ -1,17 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException
-from typing import List
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket
+from typing import List, Literal, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import datetime, timedelta
-from database import SessionLocal, engine
-from sqlalchemy.exc import IntegrityError
-import models, schemas
+from sqlalchemy import case, func, insert, or_, select, update
+from datetime import datetime
+from database import (
+    AsyncReadSessionLocal, AsyncSessionLocal, ReadSessionLocal, SessionLocal,
+    async_engine, async_read_engine, engine, engine_pool_status, read_engine
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+import contextlib
+import functools
+import os
+from sqlalchemy.exc import DBAPIError, IntegrityError
+import models, schemas, search, bulk_import, migrate, overdue, export, stats, metrics, serialize, changes, events, replica, auth, idempotency, reconcile, fine_rules
+from pagination import keyset_page, MAX_PAGE_SIZE, PAGE_HEADERS
+from circulation import bump_counters, calculate_fine
+from cache import catalog_cache
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 # 创建表 (确保表存在)
 models.Base.metadata.create_all(bind=engine)
+# 已有的表补上新加的索引等 (create_all 不会修改已存在的表)
+migrate.upgrade(engine)
+# 全文检索索引 (已有的表 create_all 不会补建，这里检查一下)
+search.ensure_search_index(engine)
 
-app = FastAPI()
+# 除了 auth.PUBLIC_PATHS (登录、监控)，所有接口都要先登录：token 验签 + 进程内会话缓存，命中时不查库
+app = FastAPI(dependencies=[Depends(auth.require_user)])
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,30 +36,133 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],      # 允许所有方法 (GET, POST, PUT, DELETE...)
     allow_headers=["*"],      # 允许所有 Header
+    # 分页信息、写后读的主库时间都放在响应头里，前端要能读到
+    expose_headers=[*PAGE_HEADERS, replica.PIN_HEADER],
 )
+# 按接口统计耗时 / SQL 条数，见 metrics.py
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument(engine, "primary")
+if async_engine is not None:
+    metrics.instrument(async_engine.sync_engine, "primary_async")
+# 只读副本 (配置了 READ_DATABASE_URL 才有)：写请求的响应带上 X-Read-Primary-Until，见 replica.py
+if read_engine is not None:
+    app.add_middleware(replica.PinPrimaryMiddleware)
+    metrics.instrument(read_engine, "replica")
+if async_read_engine is not None:
+    metrics.instrument(async_read_engine.sync_engine, "replica_async")
+
+@contextlib.asynccontextmanager
+async def _session(session_factory, async_session_factory):
+    if async_session_factory is not None:
+        async with async_session_factory() as db:
+            yield db
+    else:
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            await run_in_threadpool(db.close)
 
 # 数据库依赖
-def get_db():
-    db = SessionLocal()
-    try:
+# sync 模式给出普通 Session；async 模式 (DB_MODE=async) 给出 AsyncSession
+async def get_db():
+    async with _session(SessionLocal, AsyncSessionLocal) as db:
         yield db
-    finally:
-        db.close()
+
+# 只读接口 (列表 / 报表) 用：副本可用时给副本的会话，刚写过数据 / 副本延迟太大 / 没配副本时给主库的 (见 replica.py)
+# 用它的接口只能读，不能写
+async def get_read_db(request: Request):
+    if await replica.choose(request) == "replica":
+        factories = ReadSessionLocal, AsyncReadSessionLocal
+    else:
+        factories = SessionLocal, AsyncSessionLocal
+    async with _session(*factories) as db:
+        yield db
+
+def with_db(func):
+    """让接口在两种模式下都不阻塞事件循环。
+
+    接口函数本身还是普通的同步 SQLAlchemy 写法 (参数里的 db 是同步 Session)：
+    - sync 模式：放进线程池执行
+    - async 模式：通过 AsyncSession.run_sync 执行，底层走异步驱动，不占用线程池
+    """
+    async def call(args, kwargs, db):
+        if isinstance(db, AsyncSession):
+            return await db.run_sync(lambda session: func(*args, **{**kwargs, "db": session}))
+        return await run_in_threadpool(func, *args, **{**kwargs, "db": db})
+
+    @functools.wraps(func)
+    async def endpoint(*args, **kwargs):
+        db = kwargs["db"]
+        try:
+            return await call(args, kwargs, db)
+        except DBAPIError:
+            # 只读副本在两次延迟检测之间挂了：标记不可用，这个请求换主库重新查一次 (只读接口，重查没有副作用)
+            if not replica.is_replica(db):
+                raise
+            replica.mark_unavailable()
+            async with _session(SessionLocal, AsyncSessionLocal) as primary:
+                return await call(args, kwargs, primary)
+    return endpoint
+
+# ===========================
+# 0. 运维监控
+# ===========================
+
+# 连接池状态：每个 uvicorn worker 进程各有一个池，pid 用来区分是哪个 worker 回答的
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    return {"pid": os.getpid(), "engines": engine_pool_status()}
+
+# Prometheus 抓取用：各接口的请求数、耗时分布、SQL 条数、数据库耗时，以及连接池状态
+# 每个 worker 进程单独统计，多 worker 时 Prometheus 会随机抓到其中一个，建议按 worker 分别暴露或用单 worker
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.REGISTRY.render(engine_pool_status(), replica.status()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+# 首页看板：只读汇总表 (stats.py)，不扫描明细表
+@app.get("/stats", response_model=schemas.StatsResponse)
+@with_db
+def get_stats(
+    days: int = Query(30, ge=1, le=366),
+    top: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    return stats.dashboard(db, days, top)
+
+# 库存 / 已借数量计数器对账 (reconcile.py)：默认只检查上次修正之后改过的行，repair=true 时按差值修正
+# 定时任务用命令行版本：python reconcile.py repair
+@app.post("/reconcile", response_model=schemas.ReconcileResponse)
+@with_db
+def reconcile_counters(repair: bool = False, full: bool = False, db: Session = Depends(get_db)):
+    try:
+        result = reconcile.reconcile(db, repair=repair, full=full)
+    except reconcile.ReconcileConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if repair and result["stock_drift"]:
+        catalog_cache.invalidate("books")
+    return result
 
 # ===========================
 # 1. 登录模块 
 # ===========================
-@app.post("/login/")
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    # 简单的明文匹配，实际项目应加密
-    db_user = db.query(models.User).filter(
-        models.User.username == user.username, 
-        models.User.password == user.password
-    ).first()
-    
-    if not db_user:
+# 登录成功返回 token，之后的请求带 Authorization: Bearer <token> (见 auth.py)
+# 密码哈希很耗 CPU，整个登录放在线程池里做 (async 模式也一样，不占事件循环)
+@app.post("/login/", response_model=schemas.LoginResponse)
+async def login(user: schemas.UserLogin):
+    result = await run_in_threadpool(auth.login, SessionLocal, user.username, user.password)
+    if result is None:
         raise HTTPException(status_code=400, detail="用户名或密码错误") # [cite: 7]
-    return {"message": "登录成功", "user_id": db_user.id} # [cite: 8]
+    return result # [cite: 8]
+
+# 退出登录：吊销当前 token
+@app.post("/logout/")
+async def logout(current: auth.AuthUser = Depends(auth.require_user)):
+    await run_in_threadpool(auth.revoke, SessionLocal, current.session_id)
+    return {"message": "已退出登录"}
 
 # ===========================
 # 2. 基础信息管理 (CRUD)
@@ -50,6 +170,7 @@ def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
 
 # --- 读者管理 [cite: 11-15] ---
 @app.post("/readers/", response_model=schemas.ReaderResponse)
+@with_db
 def create_reader(reader: schemas.ReaderCreate, db: Session = Depends(get_db)):
     db_reader = models.Reader(**reader.dict())
     db.add(db_reader)
@@ -58,27 +179,36 @@ def create_reader(reader: schemas.ReaderCreate, db: Session = Depends(get_db)):
     return db_reader
 
 @app.get("/readers/", response_model=List[schemas.ReaderResponse])
-def get_readers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-# 1. 查出所有读者
-    readers = db.query(models.Reader).offset(skip).limit(limit).all()
-    
-    results = []
-    for r in readers:
-        # 2. 针对每个读者，去罚款表查一下：card_id是他 且 is_paid=0 (未缴) 的数量
-        count = db.query(models.Fine).filter(
-            models.Fine.card_id == r.card_id, 
+@with_db
+def get_readers(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
+    # 未缴罚款数量用关联子查询一次性带出，避免每个读者再单独查一次罚款表 (N+1)
+    unpaid_count = (
+        db.query(func.count(models.Fine.id))
+        .filter(
+            models.Fine.card_id == models.Reader.card_id,
             models.Fine.is_paid == 0
-        ).count()
-        
-        # 3. 把这个数量塞进响应数据里
-        # (因为 SQLAlchemy 对象默认不能直接赋值新属性，所以我们转成字典或者利用 setattr)
-        # 这里用一种简单的方法：利用 Pydantic 的兼容性
-        r.unpaid_fine_count = count 
+        )
+        .correlate(models.Reader)
+        .scalar_subquery()
+    )
+    rows = (
+        db.query(models.Reader, unpaid_count)
+        .order_by(models.Reader.card_id)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+
+    results = []
+    for r, count in rows:
+        # SQLAlchemy 对象可以直接挂一个临时属性，Pydantic (from_attributes) 会读到它
+        r.unpaid_fine_count = count
         results.append(r)
-        
+
     return results
 
 @app.delete("/readers/{card_id}")
+@with_db
 def delete_reader(card_id: int, db: Session = Depends(get_db)):
     # 1. 先查人是否存在
     db_reader = db.query(models.Reader).filter(models.Reader.card_id == card_id).first()
@@ -99,6 +229,7 @@ def delete_reader(card_id: int, db: Session = Depends(get_db)):
     return {"message": "删除成功"}
 
 @app.put("/readers/{card_id}", response_model=schemas.ReaderResponse)
+@with_db
 def update_reader(card_id: int, reader: schemas.ReaderCreate, db: Session = Depends(get_db)):
     db_reader = db.query(models.Reader).filter(models.Reader.card_id == card_id).first()
     if not db_reader:
@@ -112,6 +243,7 @@ def update_reader(card_id: int, reader: schemas.ReaderCreate, db: Session = Depe
 
 # --- 出版社管理 [cite: 16] ---
 @app.post("/publishers/", response_model=schemas.PublisherResponse)
+@with_db
 def create_publisher(pub: schemas.PublisherCreate, db: Session = Depends(get_db)):
     # 1. 先去库里查一下，有没有同名的
     existing = db.query(models.Publisher).filter(models.Publisher.name == pub.name).first()
@@ -121,17 +253,51 @@ def create_publisher(pub: schemas.PublisherCreate, db: Session = Depends(get_db)
 
     db_pub = models.Publisher(**pub.dict())
     db.add(db_pub)
+    db.flush()
+    changes.record(db, publishers=[db_pub.id])
     db.commit()
+    changes.publish(db)
+    catalog_cache.invalidate("publishers")
     db.refresh(db_pub)
     return db_pub
 
+PUBLISHER_SORT_COLUMNS = {"id": models.Publisher.id, "name": models.Publisher.name}
+# 列表接口只查 Response 模型需要的列，直接编码成 JSON (见 serialize.py)
+PUBLISHER_COLUMNS = serialize.columns(schemas.PublisherResponse, models.Publisher)
+
 @app.get("/publishers/", response_model=List[schemas.PublisherResponse])
-def get_publishers(db: Session = Depends(get_db)):
-    return db.query(models.Publisher).all()
+@with_db
+def get_publishers(
+    request: Request,
+    response: Response,
+    q: Optional[str] = None,
+    sort: Literal["id", "name"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_read_db)
+):
+    # 命中缓存时直接返回 (客户端带了相同 ETag 就回 304)，不查库
+    cached, ticket = catalog_cache.lookup("publishers", request)
+    if cached is not None:
+        return cached
+    query = db.query(*PUBLISHER_COLUMNS)
+    if q:
+        query = query.filter(or_(
+            models.Publisher.name.contains(q, autoescape=True),
+            models.Publisher.address.contains(q, autoescape=True)
+        ))
+    rows = keyset_page(
+        query, response,
+        sort_column=PUBLISHER_SORT_COLUMNS[sort], key_column=models.Publisher.id,
+        descending=(order == "desc"), cursor=cursor, limit=limit
+    )
+    return catalog_cache.store(ticket, request, response, rows, from_replica=replica.is_replica(db))
 
 from sqlalchemy.exc import IntegrityError # 👈 确保文件顶部已经导入了这个
 
 @app.put("/publishers/{publisher_id}", response_model=schemas.PublisherResponse)
+@with_db
 def update_publisher(publisher_id: int, pub: schemas.PublisherCreate, db: Session = Depends(get_db)):
     # 1. 查找目标出版社
     db_pub = db.query(models.Publisher).filter(models.Publisher.id == publisher_id).first()
@@ -142,7 +308,10 @@ def update_publisher(publisher_id: int, pub: schemas.PublisherCreate, db: Sessio
     try:
         db_pub.name = pub.name
         db_pub.address = pub.address
-        db.commit() # 💥 这里是可能触发唯一性约束报错的地方
+        changes.record(db, publishers=[publisher_id]) # 💥 先 flush，这里可能触发唯一性约束报错
+        db.commit()
+        changes.publish(db)
+        catalog_cache.invalidate("publishers")
         db.refresh(db_pub)
         return db_pub
     except IntegrityError:
@@ -154,6 +323,7 @@ def update_publisher(publisher_id: int, pub: schemas.PublisherCreate, db: Sessio
         )
 
 @app.delete("/publishers/{publisher_id}")
+@with_db
 def delete_publisher(publisher_id: int, db: Session = Depends(get_db)):
     db_pub = db.query(models.Publisher).filter(models.Publisher.id == publisher_id).first()
     if not db_pub:
@@ -162,13 +332,17 @@ def delete_publisher(publisher_id: int, db: Session = Depends(get_db)):
     # 为了作业简单，这里直接删。如果不让删，会抛出 500 错误，也算一种保护。
     try:
         db.delete(db_pub)
+        changes.record(db, deleted={"publishers": [publisher_id]})
         db.commit()
+        changes.publish(db)
     except Exception:
         raise HTTPException(status_code=400, detail="无法删除：该出版社下仍有图书")
+    catalog_cache.invalidate("publishers")
     return {"message": "删除成功"}
 
 # --- 图书基本信息管理 [cite: 18] ---
 @app.post("/books/", response_model=schemas.BookResponse)
+@with_db
 def create_book(book: schemas.BookCreate, db: Session = Depends(get_db)):
     # 0. 检查 ISBN 唯一性
     if db.query(models.Book).filter(models.Book.isbn == book.isbn).first():
@@ -185,16 +359,81 @@ def create_book(book: schemas.BookCreate, db: Session = Depends(get_db)):
 
     db_book = models.Book(**book.dict())
     db.add(db_book)
+    db.flush()
+    changes.record(db, books=[book.isbn])
     db.commit()
+    changes.publish(db)
+    catalog_cache.invalidate("books")
     db.refresh(db_book)
     return db_book
 
+BOOK_SORT_COLUMNS = {"isbn": models.Book.isbn, "title": models.Book.title, "author": models.Book.author}
+BOOK_COLUMNS = serialize.columns(schemas.BookResponse, models.Book)
+
 @app.get("/books/", response_model=List[schemas.BookResponse])
-def get_books(db: Session = Depends(get_db)):
-    return db.query(models.Book).all()
+@with_db
+def get_books(
+    request: Request,
+    response: Response,
+    isbn: Optional[List[str]] = Query(None),     # 可传多个：?isbn=a&isbn=b
+    q: Optional[str] = None,                      # 书名 / 作者 关键词 (全文索引)，或 ISBN 前缀
+    publisher_id: Optional[int] = None,
+    sort: Literal["isbn", "title", "author"] = "isbn",
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    total: bool = True,                           # false 时不算总数 (前端翻页时沿用第一页的总数)
+    db: Session = Depends(get_read_db)
+):
+    cached, ticket = catalog_cache.lookup("books", request)
+    if cached is not None:
+        return cached
+    query = db.query(*BOOK_COLUMNS)
+    if isbn:
+        query = query.filter(models.Book.isbn.in_(isbn))
+    if q and q.strip():
+        query = query.filter(models.Book.isbn.in_(search.matching_isbns(db, q)))
+    if publisher_id is not None:
+        query = query.filter(models.Book.publisher_id == publisher_id)
+    rows = keyset_page(
+        query, response,
+        sort_column=BOOK_SORT_COLUMNS[sort], key_column=models.Book.isbn,
+        descending=(order == "desc"), cursor=cursor, limit=limit, with_total=total
+    )
+    return catalog_cache.store(ticket, request, response, rows, from_replica=replica.is_replica(db))
+
+# 某种书的 在馆 / 借出 / 丢失 册数：一条 GROUP BY，只扫 (isbn, status) 索引
+@app.get("/books/{isbn}/availability", response_model=schemas.BookAvailability)
+@with_db
+def get_book_availability(isbn: str, db: Session = Depends(get_db)):
+    counts = dict(db.execute(
+        select(models.Inventory.status, func.count())
+        .where(models.Inventory.isbn == isbn)
+        .group_by(models.Inventory.status)
+    ).all())
+    if not counts and db.get(models.Book, isbn) is None:
+        raise HTTPException(status_code=404, detail="图书不存在")
+    return {
+        "isbn": isbn,
+        "total": sum(counts.values()),
+        "available": counts.get(1, 0),
+        "on_loan": counts.get(0, 0),
+        "lost": counts.get(-1, 0),
+    }
+
+# 书名/作者检索 (全文索引，按相关度排序，只返回前 limit 条)
+@app.get("/books/search", response_model=List[schemas.BookResponse])
+@with_db
+def search_books(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    return search.search_books(db, q, limit)
 
 # 修改/删除图书
 @app.put("/books/{isbn}", response_model=schemas.BookResponse)
+@with_db
 def update_book(isbn: str, book: schemas.BookCreate, db: Session = Depends(get_db)):
     db_book = db.query(models.Book).filter(models.Book.isbn == isbn).first()
     if not db_book:
@@ -208,28 +447,47 @@ def update_book(isbn: str, book: schemas.BookCreate, db: Session = Depends(get_d
     if not db.query(models.Publisher).filter(models.Publisher.id == book.publisher_id).first():
          raise HTTPException(status_code=404, detail="出版社不存在")
     
+    if db_book.publisher_id != book.publisher_id:
+        # 换了出版社：这本书的馆藏统计跟着挪过去
+        copies, available = db.execute(
+            select(func.count(), func.coalesce(func.sum(case((models.Inventory.status == 1, 1), else_=0)), 0))
+            .where(models.Inventory.isbn == isbn)
+        ).one()
+        stats.record_publishers(db, {
+            db_book.publisher_id: (-copies, -available),
+            book.publisher_id: (copies, available)
+        })
+
     db_book.title = book.title
     db_book.author = book.author
     db_book.publisher_id = book.publisher_id
     db_book.price = book.price
+    changes.record(db, books=[isbn])
     db.commit()
+    changes.publish(db)
+    catalog_cache.invalidate("books")
     db.refresh(db_book)
     return db_book
 
 @app.delete("/books/{isbn}")
+@with_db
 def delete_book(isbn: str, db: Session = Depends(get_db)):
     db_book = db.query(models.Book).filter(models.Book.isbn == isbn).first()
     if not db_book:
         raise HTTPException(status_code=404, detail="图书不存在")
     try:
         db.delete(db_book)
+        changes.record(db, deleted={"books": [isbn]})
         db.commit()
+        changes.publish(db)
     except Exception:
         raise HTTPException(status_code=400, detail="无法删除：该书可能有馆藏或借阅记录")
+    catalog_cache.invalidate("books")
     return {"message": "删除成功"}
 
 # --- 馆藏管理 [cite: 20] ---
 @app.post("/inventory/", response_model=schemas.InventoryResponse)
+@with_db
 def create_inventory(item: schemas.InventoryCreate, db: Session = Depends(get_db)):
     # 1. 检查ISBN是否存在
     db_book = db.query(models.Book).filter(models.Book.isbn == item.isbn).first()
@@ -242,28 +500,137 @@ def create_inventory(item: schemas.InventoryCreate, db: Session = Depends(get_db
     
     # 3. 联动: 图书总库存 +1 (可选，方便查询)
     db_book.stock_qty += 1
-    
+    stats.record_publishers(db, {db_book.publisher_id: (1, 1)})
+    db.flush()
+    changes.record(db, inventory=[db_item.id], books=[item.isbn])
+
     db.commit()
+    version = changes.publish(db)
+    catalog_cache.invalidate("books")  # 库存变了
     db.refresh(db_item)
+    events.publish("inventory_created", inventory_id=db_item.id, isbn=item.isbn, version=version)
     return db_item
 
+INVENTORY_SORT_COLUMNS = {"id": models.Inventory.id, "isbn": models.Inventory.isbn}
+INVENTORY_COLUMNS = serialize.columns(schemas.InventoryResponse, models.Inventory)
+
 @app.get("/inventory/", response_model=List[schemas.InventoryResponse])
-def get_inventory(db: Session = Depends(get_db)):
-    return db.query(models.Inventory).all()
+@with_db
+def get_inventory(
+    response: Response,
+    isbn: Optional[str] = None,
+    status: Optional[int] = None,                 # 1=在馆, 0=已借出, -1=丢失/损毁
+    q: Optional[str] = None,                      # 条码号，或 书名 / 作者 关键词 (全文索引)、ISBN 前缀
+    publisher_id: Optional[int] = None,
+    sort: Literal["id", "isbn"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    total: bool = True,                           # false 时不算总数
+    db: Session = Depends(get_read_db)
+):
+    query = db.query(*INVENTORY_COLUMNS)
+    if isbn:
+        query = query.filter(models.Inventory.isbn == isbn)
+    if status is not None:
+        query = query.filter(models.Inventory.status == status)
+    if q and q.strip():
+        # 书名/作者/ISBN 先在 books 上用索引找出 ISBN，再走馆藏的 isbn 索引
+        conditions = [models.Inventory.isbn.in_(search.matching_isbns(db, q))]
+        if q.strip().isdigit():
+            conditions.append(models.Inventory.id == int(q))
+        query = query.filter(or_(*conditions))
+    if publisher_id is not None:
+        # 按出版社筛选时才需要连 books 表
+        query = query.join(models.Book, models.Book.isbn == models.Inventory.isbn)
+        query = query.filter(models.Book.publisher_id == publisher_id)
+    rows = keyset_page(
+        query, response,
+        sort_column=INVENTORY_SORT_COLUMNS[sort], key_column=models.Inventory.id,
+        descending=(order == "desc"), cursor=cursor, limit=limit, with_total=total
+    )
+    return serialize.json_response(rows, response)
+
+AVAILABLE_COLUMNS = (
+    models.Inventory.id, models.Inventory.isbn, models.Book.title, models.Book.author,
+    models.Publisher.name.label("publisher_name")
+)
+AVAILABLE_MATCH_LIMIT = 100
+
+# 借书台用：只查在馆副本，按 ISBN / 书名或 ISBN 前缀 / 条码号过滤，边输入边查；不算总数
+@app.get("/inventory/available", response_model=List[schemas.AvailableCopyResponse])
+@with_db
+def get_available_inventory(
+    response: Response,
+    isbn: Optional[str] = None,
+    q: Optional[str] = None,                      # 书名前缀 / ISBN 前缀 / 条码号
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    query = (
+        db.query(*AVAILABLE_COLUMNS)
+        .join(models.Book, models.Book.isbn == models.Inventory.isbn)
+        .outerjoin(models.Publisher, models.Publisher.id == models.Book.publisher_id)
+        .filter(models.Inventory.status == 1)
+    )
+    if isbn:
+        query = query.filter(models.Inventory.isbn == isbn)
+    if q:
+        # 先在 books 里找出前缀匹配的 ISBN (按 ISBN 排序的前 AVAILABLE_MATCH_LIMIT 种)，再按 (isbn, status) 索引取在馆副本。
+        # 前缀写成范围条件 (search.prefix_range)，books.title 和主键索引都能直接用；
+        # 前缀很短、匹配的书很多时只看前面这些 (响应头 X-Matches-Truncated: 1)，继续输入就会缩小范围，每次查询的代价有上限。
+        # 按 ISBN 排序：翻页时每一页重新查到的是同一批 ISBN，按馆藏 id 的游标不会跳过或重复
+        matched = [isbn for (isbn,) in db.execute(
+            select(models.Book.isbn)
+            .where(or_(search.prefix_range(models.Book.title, q), search.prefix_range(models.Book.isbn, q)))
+            .order_by(models.Book.isbn)
+            .limit(AVAILABLE_MATCH_LIMIT + 1)
+        )]
+        if len(matched) > AVAILABLE_MATCH_LIMIT:
+            matched = matched[:AVAILABLE_MATCH_LIMIT]
+            response.headers[PAGE_HEADERS[2]] = "1"
+        conditions = [models.Inventory.isbn.in_(matched)]
+        if q.isdigit():
+            conditions.append(models.Inventory.id == int(q))
+        query = query.filter(or_(*conditions))
+    rows = keyset_page(
+        query, response,
+        sort_column=models.Inventory.id, key_column=models.Inventory.id,
+        cursor=cursor, limit=limit, with_total=False
+    )
+    return serialize.json_response(rows, response)
 
 @app.put("/inventory/{id}", response_model=schemas.InventoryResponse)
+@with_db
 def update_inventory(id: int, item: schemas.InventoryCreate, db: Session = Depends(get_db)):
     db_item = db.query(models.Inventory).filter(models.Inventory.id == id).first()
     if not db_item:
         raise HTTPException(status_code=404, detail="馆藏不存在")
     
     # 这里一般只修改 ISBN (比如录入错了)，状态通常由借还书接口管理
+    old_isbn = db_item.isbn
     db_item.isbn = item.isbn
+    db.flush()
+    if item.isbn != old_isbn:
+        available = 1 if db_item.status == 1 else 0
+        # 在馆的书：库存从原来的书挪到新的书
+        if available:
+            bump_counters(db, models.Book.__table__, "isbn", "stock_qty", {old_isbn: -1, item.isbn: 1})
+        publishers = stats.publishers_of(db, [old_isbn, item.isbn])
+        deltas = {}
+        stats.add_deltas(deltas, publishers.get(old_isbn), -1, -available)
+        stats.add_deltas(deltas, publishers.get(item.isbn), 1, available)
+        stats.record_publishers(db, deltas)
+    changes.record(db, inventory=[id], books=[old_isbn, item.isbn])
     db.commit()
+    changes.publish(db)
+    catalog_cache.invalidate("books")
     db.refresh(db_item)
     return db_item
 
 @app.delete("/inventory/{id}")
+@with_db
 def delete_inventory(id: int, db: Session = Depends(get_db)):
     db_item = db.query(models.Inventory).filter(models.Inventory.id == id).first()
     if not db_item:
@@ -273,152 +640,548 @@ def delete_inventory(id: int, db: Session = Depends(get_db)):
     if db_item.status == 0:
          raise HTTPException(status_code=400, detail="该书已借出，无法删除")
          
-    # 删除同时要记得把书的库存 -1
+    # 删除在馆的书同时要记得把书的库存 -1 (丢失/损毁的本来就不计入库存)
     db_book = db.query(models.Book).filter(models.Book.isbn == db_item.isbn).first()
-    if db_book and db_book.stock_qty > 0:
+    if db_book and db_item.status == 1 and db_book.stock_qty > 0:
         db_book.stock_qty -= 1
+    if db_book:
+        stats.record_publishers(db, {db_book.publisher_id: (-1, -1 if db_item.status == 1 else 0)})
         
     db.delete(db_item)
+    isbn = db_item.isbn
+    changes.record(db, books=[isbn], deleted={"inventory": [id]})
     db.commit()
+    version = changes.publish(db)
+    catalog_cache.invalidate("books")
+    events.publish("inventory_deleted", inventory_id=id, isbn=isbn, version=version)
     return {"message": "删除成功"}
 
+# --- 流通事件推送：借还书 / 馆藏增删 / 缴罚款 提交后实时推给各个流通台 (见 events.py) ---
+# ws://host/ws/events?types=borrow,return 只订阅部分事件
+@app.websocket("/ws/events")
+async def events_ws(websocket: WebSocket, types: Optional[str] = None):
+    wanted = set(types.split(",")) if types else None
+    if wanted and not wanted <= set(events.EVENT_TYPES):
+        await websocket.close(code=1008)  # 不认识的事件类型
+        return
+    await events.serve(websocket, wanted)
+
+# --- 增量同步：客户端记下上次的 version，改完数据后只拉变过的行 (见 changes.py) ---
+@app.get("/changes", response_model=schemas.ChangesResponse)
+@with_db
+def get_changes(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE),   # 每张表最多返回多少行，超过就让客户端全量加载
+    db: Session = Depends(get_db)
+):
+    return changes.changes_since(db, since, limit)
+
+# --- 批量导入 (新书到馆时一次导入整批图书 / 馆藏) ---
+# 请求体直接是 CSV 或 NDJSON 文件内容，边上传边分块写库，坏行只记录不中断。
+# 命令行版本见 import_data.py
+@app.post("/import/{kind}")
+async def import_catalog(
+    kind: Literal["books", "inventory"],
+    request: Request,
+    format: Literal["csv", "ndjson"] = "csv",
+    chunk_size: int = Query(bulk_import.CHUNK_SIZE, ge=1, le=10000)
+):
+    try:
+        return await bulk_import.import_request_body(request, SessionLocal, kind, format, chunk_size)
+    finally:
+        # 导入是分块提交的，中途出错前面的块也已经写进去了
+        catalog_cache.invalidate("books")
+
+# --- 全量导出 (审计用，罚款 / 借阅记录可能有上千万行) ---
+# 边查边发，不会把整张表读进内存；card_id 可以只导出某个读者的
+@app.get("/export/{kind}")
+def export_table(
+    request: Request,
+    kind: Literal["fines", "borrow_records"],
+    format: Literal["csv", "ndjson"] = "csv",
+    card_id: Optional[int] = None
+):
+    filename = f"{kind}-{datetime.now():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        export.stream_export(replica.choose_engine(request), kind, format, card_id),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # ===========================
 # 3. 核心业务: 借阅与归还 (难点)
 # ===========================
 
+# 借书 / 还书 / 缴罚款都支持 Idempotency-Key 请求头：客户端超时重试时直接返回第一次的结果 (见 idempotency.py)
+# 借还书都用「带条件的 UPDATE」来抢占行：谁的 UPDATE 影响到 1 行谁就成功，
+# 数据库的行锁保证两个柜台同时扫同一本书时只有一个能借出/归还。
+# 加锁顺序统一为 inventory -> readers -> books，避免借书和还书互相死锁。
+
+def _abort(db: Session, status_code: int, detail: str):
+    db.rollback()
+    raise HTTPException(status_code=status_code, detail=detail)
+
 # --- 借书 [cite: 22-25] ---
 @app.post("/borrow/")
+@idempotency.idempotent
+@with_db
 def borrow_book(req: schemas.BorrowRequest, db: Session = Depends(get_db)):
-    # 1. 检查读者
-    reader = db.query(models.Reader).filter(models.Reader.card_id == req.card_id).first()
-    if not reader:
-        raise HTTPException(status_code=404, detail="读者不存在")
+    try:
+        # 1. 抢占馆藏：只有在馆 (status=1) 的书才能改成借出 (0)
+        taken = db.execute(
+            update(models.Inventory)
+            .where(models.Inventory.id == req.inventory_id, models.Inventory.status == 1)
+            .values(status=0)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if taken == 0:
+            _abort(db, 400, "该书已被借出或不存在")
 
-    # 如果读者有未缴罚款，不允许借阅
-    unpaid_count = db.query(models.Fine).filter(
-        models.Fine.card_id == req.card_id,
-        models.Fine.is_paid == 0
-    ).count()
-    if unpaid_count > 0:
-        raise HTTPException(status_code=400, detail="该读者有未缴罚款，无法借阅")
-        
-    # 2. 检查书籍状态 (必须在馆 status=1)
-    item = db.query(models.Inventory).filter(models.Inventory.id == req.inventory_id).first()
-    if not item or item.status != 1:
-        raise HTTPException(status_code=400, detail="该书已被借出或不存在")
+        # 2. 读者已借数量 +1，条件里顺带检查「没有未缴罚款」
+        has_unpaid = (
+            select(models.Fine.id)
+            .where(models.Fine.card_id == req.card_id, models.Fine.is_paid == 0)
+            .exists()
+        )
+        counted = db.execute(
+            update(models.Reader)
+            .where(models.Reader.card_id == req.card_id, ~has_unpaid)
+            .values(borrowed_count=models.Reader.borrowed_count + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if counted == 0:
+            # 只有失败时才多查一次，区分是「读者不存在」还是「有未缴罚款」
+            if db.get(models.Reader, req.card_id) is None:
+                _abort(db, 404, "读者不存在")
+            _abort(db, 400, "该读者有未缴罚款，无法借阅")
 
-    # 3. 开启事务，执行一系列更新
-    try:
-        # A. 创建借阅记录 [cite: 24]
-        record = models.BorrowRecord(card_id=req.card_id, inventory_id=req.inventory_id)
-        db.add(record)
-        
-        # B. 更新馆藏状态 -> 借出(0) [cite: 24]
-        item.status = 0
-        
-        # C. 更新读者已借数量 [cite: 25]
-        reader.borrowed_count += 1
-        
-        # D. 更新图书基本信息(库存 -1) [cite: 24]
-        book = db.query(models.Book).filter(models.Book.isbn == item.isbn).first()
-        book.stock_qty -= 1
-        
+        # 3. 图书库存 -1
+        book = db.execute(
+            select(models.Book.isbn, models.Book.publisher_id)
+            .join(models.Inventory, models.Inventory.isbn == models.Book.isbn)
+            .where(models.Inventory.id == req.inventory_id)
+        ).first()
+        db.execute(
+            update(models.Book)
+            .where(models.Book.isbn == book.isbn)
+            .values(stock_qty=models.Book.stock_qty - 1)
+            .execution_options(synchronize_session=False)
+        )
+
+        # 4. 创建借阅记录
+        db.add(models.BorrowRecord(card_id=req.card_id, inventory_id=req.inventory_id))
+
+        # 5. 看板统计
+        stats.record_book_loans(db, {book.isbn: 1})
+        stats.record_publishers(db, {book.publisher_id: (0, -1)})
+        stats.record_day(db, loans=1)
+        changes.record(db, inventory=[req.inventory_id], books=[book.isbn])
         db.commit()
+        version = changes.publish(db)
+        catalog_cache.invalidate("books")  # 借还书都会改 stock_qty
+        events.publish("borrow", inventory_id=req.inventory_id, isbn=book.isbn, card_id=req.card_id,
+                       version=version)
         return {"message": "借阅成功"}
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- 还书 [cite: 26-30] ---
 @app.post("/return/")
+@idempotency.idempotent
+@with_db
 def return_book(req: schemas.ReturnRequest, db: Session = Depends(get_db)):
-    # 1. 找到该书当前未归还的借阅记录
-    record = db.query(models.BorrowRecord).filter(
-        models.BorrowRecord.inventory_id == req.inventory_id,
-        models.BorrowRecord.return_date == None
+    # 1. 一次查出在借记录 + 计算罚款要用的图书价格
+    row = db.execute(
+        select(
+            models.BorrowRecord.id,
+            models.BorrowRecord.card_id,
+            models.BorrowRecord.borrow_date,
+            models.Inventory.isbn,
+            models.Book.price,
+            models.Book.publisher_id,
+            models.Reader.category
+        )
+        .join(models.Inventory, models.Inventory.id == models.BorrowRecord.inventory_id)
+        .join(models.Book, models.Book.isbn == models.Inventory.isbn)
+        .join(models.Reader, models.Reader.card_id == models.BorrowRecord.card_id)
+        .where(
+            models.BorrowRecord.inventory_id == req.inventory_id,
+            models.BorrowRecord.return_date == None
+        )
+        .limit(1)
     ).first()
-    
-    if not record:
+
+    if not row:
         raise HTTPException(status_code=404, detail="未找到该书的在借记录")
 
     try:
-        # 2. 准备数据对象
-        # A. 借阅记录
-        record.return_date = datetime.now()
-        
-        # B. 馆藏信息
-        item = db.query(models.Inventory).filter(models.Inventory.id == req.inventory_id).first()
-        # 如果损坏，状态可以设为 2 (假设 2 代表损坏/维修中)，或者为了测试方便还是设为 1 (在馆)
-        # 这里为了作业流程顺畅，我们设为 1，但备注里会写损坏
-        item.status = 1 
-        
-        # C. 读者信息
-        reader = db.query(models.Reader).filter(models.Reader.card_id == record.card_id).first()
-        reader.borrowed_count -= 1
-        
-        # D. 图书基本信息 (获取价格用于赔偿)
-        book = db.query(models.Book).filter(models.Book.isbn == item.isbn).first()
-        book.stock_qty += 1
-        
-        # ===========================
-        # E. 核心逻辑: 罚款计算
-        # ===========================
-        total_fine = 0.0
-        remark_list = []
-
-        # 1. 计算超期费
-        # 假设借阅期限是 30 天
-        days_borrowed = (record.return_date - record.borrow_date).days
-        overdue_days = days_borrowed - 30
-        if overdue_days > 0:
-            overdue_fine = overdue_days * 0.5 # 每天 5 毛
-            total_fine += overdue_fine
-            remark_list.append(f"超期{overdue_days}天(￥{overdue_fine})")
-        
-        # 2. 计算损坏赔偿
-        if req.is_damaged:
-            # 如果书没有录入价格，默认赔 50 块 (防止报错)
-            damage_fine = float(book.price) if book.price else 50.0
-            total_fine += damage_fine
-            remark_list.append(f"图书损坏赔偿(￥{damage_fine})")
-
-        # 3. 如果有罚款，生成记录
+        return_date = datetime.now()
+
+        # 2. 关闭借阅记录 (带 return_date IS NULL 条件，同一本书并发还书只有一个能成功)
+        closed = db.execute(
+            update(models.BorrowRecord)
+            .where(models.BorrowRecord.id == row.id, models.BorrowRecord.return_date == None)
+            .values(return_date=return_date)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if closed == 0:
+            _abort(db, 404, "未找到该书的在借记录")
+
+        # 3. 馆藏回到在馆 (损坏的书这里也先设为 1，备注里会写损坏)
+        db.execute(
+            update(models.Inventory)
+            .where(models.Inventory.id == req.inventory_id)
+            .values(status=1)
+            .execution_options(synchronize_session=False)
+        )
+        # 4. 读者已借数量 -1
+        db.execute(
+            update(models.Reader)
+            .where(models.Reader.card_id == row.card_id)
+            .values(borrowed_count=models.Reader.borrowed_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+        # 5. 图书库存 +1
+        db.execute(
+            update(models.Book)
+            .where(models.Book.isbn == row.isbn)
+            .values(stock_qty=models.Book.stock_qty + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+        # 6. 核心逻辑: 罚款计算 (超期 + 损坏)，按读者类别的规则 (fine_rules.py，有缓存)
+        rule = fine_rules.current(db).for_category(row.category)
+        total_fine, remark_list = calculate_fine(row.borrow_date, return_date, row.price, req.is_damaged, rule)
+
+        # 如果有罚款，生成记录
         msg = "归还成功"
         if total_fine > 0:
             final_remark = "，".join(remark_list)
-            fine = models.Fine(
-                card_id=reader.card_id, 
-                amount=total_fine, 
-                remark=final_remark
-            )
-            db.add(fine)
+            db.add(models.Fine(card_id=row.card_id, amount=total_fine, remark=final_remark, created_at=return_date))
             msg = f"归还成功，产生罚款：{final_remark}，总计 {total_fine} 元"
 
+        # 7. 看板统计
+        stats.record_publishers(db, {row.publisher_id: (0, 1)})
+        stats.record_day(
+            db, returns=1,
+            fines_issued=1 if total_fine > 0 else 0, fines_issued_amount=total_fine
+        )
+        changes.record(db, inventory=[req.inventory_id], books=[row.isbn])
         db.commit()
+        version = changes.publish(db)
+        catalog_cache.invalidate("books")
+        events.publish("return", inventory_id=req.inventory_id, isbn=row.isbn, card_id=row.card_id,
+                       fine=total_fine, version=version)
         return {"message": msg}
-        
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- 批量借书 / 还书 ---
+# 整车书在一个事务里处理：一次查出所有馆藏 / 在借记录，计数器按 ISBN、读者聚合后批量更新，
+# 罚款批量插入。每本书单独给出结果，某一本失败不影响其他书。
+
+MAX_BATCH_SIZE = 200
+
+def _batch_response(results):
+    succeeded = sum(1 for r in results if r.success)
+    return schemas.BatchResponse(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
+def _dedupe(ids):
+    seen, unique, duplicated = set(), [], []
+    for i in ids:
+        (duplicated if i in seen else unique).append(i)
+        seen.add(i)
+    return unique, duplicated
+
+@app.post("/borrow/batch", response_model=schemas.BatchResponse)
+@with_db
+def borrow_books_batch(req: schemas.BatchBorrowRequest, db: Session = Depends(get_db)):
+    if len(req.inventory_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"一次最多办理 {MAX_BATCH_SIZE} 本")
+    ids, duplicated = _dedupe(req.inventory_ids)
+
+    try:
+        # 1. 一次查出并锁住所有馆藏
+        items = {
+            row.id: row for row in db.execute(
+                select(models.Inventory.id, models.Inventory.isbn, models.Inventory.status)
+                .where(models.Inventory.id.in_(ids))
+                .order_by(models.Inventory.id)
+                .with_for_update()
+            )
+        }
+        available = [i for i in ids if i in items and items[i].status == 1]
+
+        # 2. 读者已借数量 += 本数，同时检查没有未缴罚款 (和单本借书一样)
+        has_unpaid = (
+            select(models.Fine.id)
+            .where(models.Fine.card_id == req.card_id, models.Fine.is_paid == 0)
+            .exists()
+        )
+        counted = db.execute(
+            update(models.Reader)
+            .where(models.Reader.card_id == req.card_id, ~has_unpaid)
+            .values(borrowed_count=models.Reader.borrowed_count + len(available))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if counted == 0:
+            if db.get(models.Reader, req.card_id) is None:
+                _abort(db, 404, "读者不存在")
+            _abort(db, 400, "该读者有未缴罚款，无法借阅")
+
+        if available:
+            # 3. 馆藏批量改为借出；行数对不上说明有人抢先借走了，整车重试
+            taken = db.execute(
+                update(models.Inventory)
+                .where(models.Inventory.id.in_(available), models.Inventory.status == 1)
+                .values(status=0)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if taken != len(available):
+                _abort(db, 409, "部分图书状态已变化，请重新提交")
+
+            # 4. 按 ISBN 聚合扣库存
+            stock_deltas = {}
+            for i in available:
+                stock_deltas[items[i].isbn] = stock_deltas.get(items[i].isbn, 0) - 1
+            bump_counters(db, models.Book.__table__, "isbn", "stock_qty", stock_deltas)
+
+            # 5. 批量插入借阅记录
+            db.execute(
+                insert(models.BorrowRecord),
+                [{"card_id": req.card_id, "inventory_id": i} for i in available]
+            )
+
+            # 6. 看板统计
+            loans_by_isbn = {isbn: -delta for isbn, delta in stock_deltas.items()}
+            publishers = stats.publishers_of(db, loans_by_isbn)
+            publisher_deltas = {}
+            for isbn, n in loans_by_isbn.items():
+                stats.add_deltas(publisher_deltas, publishers.get(isbn), available=-n)
+            stats.record_book_loans(db, loans_by_isbn)
+            stats.record_publishers(db, publisher_deltas)
+            stats.record_day(db, loans=len(available))
+            changes.record(db, inventory=available, books=stock_deltas)
+        db.commit()
+        version = changes.publish(db)
+        catalog_cache.invalidate("books")
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    for i in available:
+        events.publish("borrow", inventory_id=i, isbn=items[i].isbn, card_id=req.card_id, version=version)
+    available_set = set(available)
+    results = [
+        schemas.BatchItemResult(inventory_id=i, success=True, message="借阅成功") if i in available_set
+        else schemas.BatchItemResult(inventory_id=i, success=False, message="该书已被借出或不存在")
+        for i in ids
+    ]
+    results += [schemas.BatchItemResult(inventory_id=i, success=False, message="重复扫描") for i in duplicated]
+    return _batch_response(results)
+
+@app.post("/return/batch", response_model=schemas.BatchResponse)
+@with_db
+def return_books_batch(req: schemas.BatchReturnRequest, db: Session = Depends(get_db)):
+    if len(req.inventory_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"一次最多办理 {MAX_BATCH_SIZE} 本")
+    ids, duplicated = _dedupe(req.inventory_ids)
+    damaged = set(req.damaged_ids)
+
+    try:
+        # 1. 一次查出所有在借记录 (连带图书价格)，并锁住这些借阅记录
+        records = {
+            row.inventory_id: row for row in db.execute(
+                select(
+                    models.BorrowRecord.id,
+                    models.BorrowRecord.card_id,
+                    models.BorrowRecord.inventory_id,
+                    models.BorrowRecord.borrow_date,
+                    models.Inventory.isbn,
+                    models.Book.price,
+                    models.Book.publisher_id,
+                    models.Reader.category
+                )
+                .join(models.Inventory, models.Inventory.id == models.BorrowRecord.inventory_id)
+                .join(models.Book, models.Book.isbn == models.Inventory.isbn)
+                .join(models.Reader, models.Reader.card_id == models.BorrowRecord.card_id)
+                .where(
+                    models.BorrowRecord.inventory_id.in_(ids),
+                    models.BorrowRecord.return_date == None
+                )
+                .order_by(models.BorrowRecord.id)
+                .with_for_update(of=models.BorrowRecord)
+            )
+        }
+        found = [i for i in ids if i in records]
+        return_date = datetime.now()
+        messages, fines_by_copy = {}, {}
+
+        if found:
+            # 2. 批量关闭借阅记录，行数对不上说明有人抢先还了，整车重试
+            closed = db.execute(
+                update(models.BorrowRecord)
+                .where(
+                    models.BorrowRecord.id.in_([records[i].id for i in found]),
+                    models.BorrowRecord.return_date == None
+                )
+                .values(return_date=return_date)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if closed != len(found):
+                _abort(db, 409, "部分图书状态已变化，请重新提交")
+
+            # 3. 馆藏批量回到在馆
+            db.execute(
+                update(models.Inventory)
+                .where(models.Inventory.id.in_(found))
+                .values(status=1)
+                .execution_options(synchronize_session=False)
+            )
+
+            # 4. 读者已借数量、图书库存按 key 聚合后批量更新
+            reader_deltas, stock_deltas = {}, {}
+            for i in found:
+                r = records[i]
+                reader_deltas[r.card_id] = reader_deltas.get(r.card_id, 0) - 1
+                stock_deltas[r.isbn] = stock_deltas.get(r.isbn, 0) + 1
+            bump_counters(db, models.Reader.__table__, "card_id", "borrowed_count", reader_deltas)
+            bump_counters(db, models.Book.__table__, "isbn", "stock_qty", stock_deltas)
+
+            # 5. 罚款：每本书用和单本还书完全相同的规则计算，最后批量插入
+            fines = []
+            rules = fine_rules.current(db)
+            for i in found:
+                r = records[i]
+                total_fine, remark_list = calculate_fine(
+                    r.borrow_date, return_date, r.price, i in damaged, rules.for_category(r.category)
+                )
+                if total_fine > 0:
+                    final_remark = "，".join(remark_list)
+                    fines.append({"card_id": r.card_id, "amount": total_fine, "remark": final_remark,
+                                  "created_at": return_date})
+                    messages[i] = f"归还成功，产生罚款：{final_remark}，总计 {total_fine} 元"
+                    fines_by_copy[i] = total_fine
+                else:
+                    messages[i] = "归还成功"
+            if fines:
+                db.execute(insert(models.Fine), fines)
+
+            # 6. 看板统计
+            publisher_deltas = {}
+            for i in found:
+                stats.add_deltas(publisher_deltas, records[i].publisher_id, available=1)
+            stats.record_publishers(db, publisher_deltas)
+            stats.record_day(
+                db, returns=len(found),
+                fines_issued=len(fines), fines_issued_amount=sum(f["amount"] for f in fines)
+            )
+            changes.record(db, inventory=found, books=stock_deltas)
+        db.commit()
+        version = changes.publish(db)
+        catalog_cache.invalidate("books")
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    for i in found:
+        events.publish("return", inventory_id=i, isbn=records[i].isbn, card_id=records[i].card_id,
+                       fine=fines_by_copy.get(i, 0), version=version)
+
+    results = [
+        schemas.BatchItemResult(inventory_id=i, success=True, message=messages[i]) if i in messages
+        else schemas.BatchItemResult(inventory_id=i, success=False, message="未找到该书的在借记录")
+        for i in ids
+    ]
+    results += [schemas.BatchItemResult(inventory_id=i, success=False, message="重复扫描") for i in duplicated]
+    return _batch_response(results)
+
+# --- 超期未还 (按借出时间从早到晚，即超期最久的在前) ---
+@app.get("/borrow/overdue", response_model=List[schemas.OverdueLoanResponse])
+@with_db
+def get_overdue_loans(
+    response: Response,
+    card_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_read_db)
+):
+    return keyset_page(
+        overdue.overdue_query(db, datetime.now(), card_id), response,
+        sort_column=models.BorrowRecord.borrow_date, key_column=models.BorrowRecord.id,
+        cursor=cursor, limit=limit
+    )
+
+@app.get("/borrow/overdue/summary", response_model=schemas.OverdueSummary)
+@with_db
+def get_overdue_summary(db: Session = Depends(get_read_db)):
+    return overdue.summarize(db, datetime.now())
+
 # --- 获取某人的借阅记录 ---
 @app.get("/borrow_records/{card_id}")
-def get_borrow_records(card_id: int, db: Session = Depends(get_db)):
+@with_db
+def get_borrow_records(card_id: int, db: Session = Depends(get_read_db)):
     return db.query(models.BorrowRecord).filter(models.BorrowRecord.card_id == card_id).all()
 
+FINE_COLUMNS = serialize.columns(schemas.FineResponse, models.Fine)
+
 # 新增接口：获取所有罚款记录 (用于管理员总览)
 @app.get("/fines/all", response_model=List[schemas.FineResponse])
-def read_all_fines(skip: int = 0, limit: int = 1000, db: Session = Depends(get_db)):
+@with_db
+def read_all_fines(skip: int = 0, limit: int = 1000, db: Session = Depends(get_read_db)):
     # 按时间倒序，最新的罚款在最前面
-    fines = db.query(models.Fine).order_by(models.Fine.id.desc()).offset(skip).limit(limit).all()
-    return fines
+    fines = db.query(*FINE_COLUMNS).order_by(models.Fine.id.desc()).offset(skip).limit(limit).all()
+    return serialize.json_response(fines)
+
+# 罚款预测：所有在借记录如果到 at 还没还，超期费一共多少 (按读者类别分组，NumPy 整列计算，见 overdue.py)
+# 要放在 /fines/{card_id} 前面，否则 "forecast" 会被当成 card_id
+@app.get("/fines/forecast", response_model=schemas.FineForecast)
+@with_db
+def get_fine_forecast(at: Optional[datetime] = None, db: Session = Depends(get_read_db)):
+    if at is not None and at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)  # 库里存的都是本地时间
+    return overdue.forecast(db, at or datetime.now())
 
 @app.get("/fines/{card_id}", response_model=List[schemas.FineResponse])
-def get_fines(card_id: int, db: Session = Depends(get_db)):
+@with_db
+def get_fines(card_id: int, db: Session = Depends(get_read_db)):
     return db.query(models.Fine).filter(models.Fine.card_id == card_id).all()
 
+# --- 罚款规则 (按读者类别，"*" 是默认规则，见 fine_rules.py) ---
+@app.get("/fine-rules/", response_model=List[schemas.FineRuleResponse])
+@with_db
+def get_fine_rules(db: Session = Depends(get_db)):
+    return fine_rules.list_rules(db)
+
+@app.put("/fine-rules/{category}", response_model=schemas.FineRuleResponse)
+@with_db
+def save_fine_rule(category: str, rule: schemas.FineRuleBase, db: Session = Depends(get_db)):
+    # 只影响之后的还书，已经生成的罚款不变
+    return fine_rules.save(db, category, rule)
+
+@app.delete("/fine-rules/{category}")
+@with_db
+def delete_fine_rule(category: str, db: Session = Depends(get_db)):
+    if category == fine_rules.DEFAULT_CATEGORY:
+        raise HTTPException(status_code=400, detail="默认规则不能删除")
+    if not fine_rules.delete(db, category):
+        raise HTTPException(status_code=404, detail="该类别没有单独的罚款规则")
+    return {"message": "删除成功，该类别读者改用默认规则"}
+
 #  缴纳罚款
 @app.post("/fines/pay/{fine_id}")
+@idempotency.idempotent
+@with_db
 def pay_fine(fine_id: int, db: Session = Depends(get_db)):
     fine = db.query(models.Fine).filter(models.Fine.id == fine_id).first()
     if not fine:
@@ -427,6 +1190,18 @@ def pay_fine(fine_id: int, db: Session = Depends(get_db)):
     if fine.is_paid == 1:
         return {"message": "该罚款已缴纳，无需重复缴费"}
     
-    fine.is_paid = 1
+    # 带 is_paid = 0 条件更新，两个窗口同时点缴费只会记一次
+    paid = db.execute(
+        update(models.Fine)
+        .where(models.Fine.id == fine_id, models.Fine.is_paid == 0)
+        .values(is_paid=1, paid_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if paid == 0:
+        db.rollback()
+        return {"message": "该罚款已缴纳，无需重复缴费"}
+    stats.record_day(db, fines_collected=1, fines_collected_amount=fine.amount)
+    card_id, amount = fine.card_id, float(fine.amount)  # commit 之后 ORM 对象会过期，先取出来
     db.commit()
+    events.publish("fine_paid", fine_id=fine_id, card_id=card_id, amount=amount)
     return {"message": "缴费成功"}
\ No newline at end of file
@@ -0,0 +1,254 @@
+# 作用：按接口统计 延迟分布 / SQL 条数 / 数据库耗时 / 影响行数，GET /metrics 以 Prometheus 文本格式输出
+#
+# - MetricsMiddleware：纯 ASGI 中间件，每个请求开始时放一个 RequestStats 到 contextvar 里
+#   (线程池、AsyncSession.run_sync 里都能拿到同一个对象)，请求结束后汇总到全局的 REGISTRY
+# - instrument(engine, name)：挂 before/after_cursor_execute 事件，每条 SQL 记一次条数和耗时，
+#   另外按引擎 (primary / replica ...) 分别累计，能看出读请求有多少落到了只读副本上
+# - count_read(target, reason)：GET 接口选了主库还是副本、为什么 (见 replica.py)
+# - 慢请求日志：超过 SLOW_REQUEST_MS 的请求打一条 WARNING，附带它执行过的 SQL (最多 SLOW_REQUEST_MAX_STATEMENTS 条)
+#
+# 开销：每条 SQL 两次 perf_counter 和几次加法，每个请求加一次锁更新汇总，可以常开。
+# 行数说明：用的是驱动给出的 cursor.rowcount —— MySQL (PyMySQL) 的 SELECT 是返回行数，
+# 增删改是影响行数；SQLite 的 SELECT 不报行数，只统计增删改。
+
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+import config
+
+logger = logging.getLogger("library.slow_requests")
+
+# 请求耗时分桶 (秒) 和每个请求 SQL 条数的分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "rows", "log", "engines")
+
+    def __init__(self, keep_statements):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.engines = {}  # 引擎名 -> [SQL 条数, 耗时秒]
+        self.log = [] if keep_statements else None  # [(耗时秒, SQL)]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # 每个桶自己的计数，输出时再累加
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class RouteMetrics:
+    __slots__ = ("latency", "statements", "db_seconds", "rows", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.statuses = {}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.engines = {}  # 引擎名 -> [SQL 条数, 耗时秒]
+        self.reads = {}    # (target, reason) -> 次数
+
+    def observe(self, method, route, status, seconds, stats):
+        with self._lock:
+            m = self.routes.get((method, route))
+            if m is None:
+                m = self.routes[(method, route)] = RouteMetrics()
+            m.latency.observe(seconds)
+            m.statements.observe(stats.statements)
+            m.db_seconds += stats.db_seconds
+            m.rows += stats.rows
+            m.statuses[status] = m.statuses.get(status, 0) + 1
+            for name, (n, seconds) in stats.engines.items():
+                total = self.engines.setdefault(name, [0, 0.0])
+                total[0] += n
+                total[1] += seconds
+
+    def count_read(self, target, reason):
+        with self._lock:
+            self.reads[(target, reason)] = self.reads.get((target, reason), 0) + 1
+
+    def render(self, pool_status=None, replica_status=None):
+        """Prometheus 文本格式 (text/plain; version=0.0.4)。"""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, labels, h):
+            cumulative = 0
+            for bound, n in zip(h.buckets, h.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f"{name}_sum{{{labels}}} {h.total}")
+            lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+        with self._lock:
+            routes = sorted(self.routes.items())
+            header("http_requests_total", "counter", "请求数")
+            for (method, route), m in routes:
+                for status, n in sorted(m.statuses.items()):
+                    lines.append(f'http_requests_total{{{_labels(method, route)},status="{status}"}} {n}')
+            header("http_request_duration_seconds", "histogram", "请求耗时")
+            for (method, route), m in routes:
+                histogram("http_request_duration_seconds", _labels(method, route), m.latency)
+            header("http_request_sql_statements", "histogram", "每个请求执行的 SQL 条数")
+            for (method, route), m in routes:
+                histogram("http_request_sql_statements", _labels(method, route), m.statements)
+            header("http_request_db_seconds_total", "counter", "SQL 执行总耗时")
+            for (method, route), m in routes:
+                lines.append(f"http_request_db_seconds_total{{{_labels(method, route)}}} {m.db_seconds}")
+            header("http_request_db_rows_total", "counter", "SQL 返回 / 影响的行数 (驱动报告的 rowcount)")
+            for (method, route), m in routes:
+                lines.append(f"http_request_db_rows_total{{{_labels(method, route)}}} {m.rows}")
+            header("db_statements_total", "counter", "各引擎执行的 SQL 条数")
+            for name, (n, _) in sorted(self.engines.items()):
+                lines.append(f'db_statements_total{{engine="{name}"}} {n}')
+            header("db_statement_seconds_total", "counter", "各引擎 SQL 执行总耗时")
+            for name, (_, seconds) in sorted(self.engines.items()):
+                lines.append(f'db_statement_seconds_total{{engine="{name}"}} {seconds}')
+            if self.reads:
+                header("db_read_routing_total", "counter", "只读接口选择主库 / 副本的次数")
+                for (target, reason), n in sorted(self.reads.items()):
+                    lines.append(f'db_read_routing_total{{target="{target}",reason="{reason}"}} {n}')
+
+        if replica_status:
+            header("db_replica_lag_seconds", "gauge", "只读副本最近一次测到的延迟 (测不到时为 -1)")
+            lag = replica_status["lag_seconds"]
+            lines.append(f"db_replica_lag_seconds {-1 if lag is None else lag}")
+            header("db_replica_healthy", "gauge", "副本是否可读 (1 = 延迟在 REPLICA_MAX_LAG 以内)")
+            lines.append(f"db_replica_healthy {int(replica_status['healthy'])}")
+
+        if pool_status:
+            for key, kind, help_text in (
+                ("checked_out", "gauge", "已借出的连接数"),
+                ("overflow", "gauge", "超出 pool_size 的连接数"),
+                ("checkouts", "counter", "取连接次数"),
+                ("timeouts", "counter", "取连接超时次数"),
+                ("wait_total_ms", "counter", "取连接累计等待毫秒"),
+            ):
+                name = f"db_pool_{key}"
+                header(name, kind, help_text)
+                for engine_name, status in sorted(pool_status.items()):
+                    if key in status:
+                        lines.append(f'{name}{{engine="{engine_name}"}} {status[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def _labels(method, route):
+    return f'method="{method}",route="{route}"'
+
+
+REGISTRY = Registry()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 开始时间挂在这条语句自己的执行上下文上：语句报错时 after 事件不会触发，
+    # 上下文随语句一起丢弃，不会留下一个错位的开始时间
+    if context is not None and _current.get() is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(name, cursor, statement, context):
+    stats = _current.get()
+    if stats is None:
+        return
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    per_engine = stats.engines.get(name)
+    if per_engine is None:
+        per_engine = stats.engines[name] = [0, 0.0]
+    per_engine[0] += 1
+    per_engine[1] += elapsed
+    rowcount = getattr(cursor, "rowcount", -1)
+    if rowcount and rowcount > 0:
+        stats.rows += rowcount
+    if stats.log is not None and len(stats.log) < config.SLOW_REQUEST_MAX_STATEMENTS:
+        stats.log.append((elapsed, statement))
+
+
+def instrument(engine, name="primary"):
+    """给引擎挂上 SQL 统计事件 (异步引擎传 async_engine.sync_engine)，name 是 /metrics 里的 engine 标签。"""
+    def after(conn, cursor, statement, parameters, context, executemany):
+        _after_cursor_execute(name, cursor, statement, context)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(keep_statements=config.SLOW_REQUEST_MS > 0)
+        token = _current.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            # 用路由模板 (/readers/{card_id}) 而不是实际路径，避免标签无限增长
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            REGISTRY.observe(scope["method"], path, status, elapsed, stats)
+            if config.SLOW_REQUEST_MS > 0 and elapsed * 1000 >= config.SLOW_REQUEST_MS:
+                _log_slow(scope, path, status, elapsed, stats)
+
+
+def _log_slow(scope, path, status, elapsed, stats):
+    query = scope.get("query_string", b"").decode("latin-1")
+    lines = [
+        f"慢请求 {scope['method']} {scope['path']}{'?' + query if query else ''} (路由 {path}) -> {status}，"
+        f"耗时 {elapsed * 1000:.1f} ms，SQL {stats.statements} 条 / {stats.db_seconds * 1000:.1f} ms"
+    ]
+    for seconds, statement in stats.log or []:
+        lines.append(f"  [{seconds * 1000:.1f} ms] {' '.join(statement.split())}")
+    if stats.log is not None and stats.statements > len(stats.log):
+        lines.append(f"  ... 另外 {stats.statements - len(stats.log)} 条未记录")
+    logger.warning("\n".join(lines))
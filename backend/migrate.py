@@ -0,0 +1,203 @@
+# 作用：轻量的数据库结构迁移 (版本号记在 schema_version 表里)
+#
+# create_all 只会建不存在的表，不会给已有的表加索引 / 加列，所以对已有数据库的结构调整都写成这里的迁移。
+# 新建的库 create_all 已经按 models.py 建好了全部索引，迁移里用 checkfirst 跳过，最后只是记一下版本号。
+#
+# 用法 (在 backend 目录下)：
+#   python migrate.py            # 升级到最新版本 (后端启动时也会自动执行)
+#   python migrate.py --status   # 查看当前版本
+
+import argparse
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select
+from sqlalchemy.exc import SQLAlchemyError
+
+import auth
+import changes
+import fine_rules
+import models
+import reconcile
+import stats
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200)),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+
+def _index(table, name):
+    return next(ix for ix in table.indexes if ix.name == name)
+
+
+def _create_indexes(conn, table, *names):
+    for name in names:
+        _index(table, name).create(conn, checkfirst=True)
+
+
+def _drop_index(conn, table_name, name):
+    if name in {ix["name"] for ix in inspect(conn).get_indexes(table_name)}:
+        conn.exec_driver_sql(
+            f"DROP INDEX {name} ON {table_name}" if conn.dialect.name == "mysql" else f"DROP INDEX {name}"
+        )
+
+
+def _add_column(conn, table, name):
+    # 只支持 可为空且没有默认值 或者 NOT NULL 带 server_default 的列 (两种数据库语法一致)
+    if name not in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        column = table.c[name]
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(conn.dialect)}"
+        if column.server_default is not None:
+            ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+        conn.exec_driver_sql(ddl)
+
+
+def _v1_hot_query_indexes(conn):
+    _create_indexes(conn, models.Book.__table__, "ix_books_title", "ix_books_author", "ix_books_publisher_id")
+    # 先建复合索引再删旧的单列索引：MySQL 的外键要求 isbn 上始终有索引
+    _create_indexes(conn, models.Inventory.__table__, "ix_inventory_isbn_status")
+    _drop_index(conn, "inventory", "ix_inventory_isbn")
+    _create_indexes(
+        conn, models.BorrowRecord.__table__,
+        "ix_borrow_records_inventory_return", "ix_borrow_records_card_id"
+    )
+    _create_indexes(conn, models.Fine.__table__, "ix_fines_card_id_is_paid")
+
+
+def _v2_overdue(conn):
+    _create_indexes(conn, models.BorrowRecord.__table__, "ix_borrow_records_open_since")
+    models.OverdueLoan.__table__.create(conn, checkfirst=True)
+
+
+def _v3_stats(conn):
+    _add_column(conn, models.Fine.__table__, "created_at")
+    _add_column(conn, models.Fine.__table__, "paid_at")
+    for model in (models.DailyStats, models.BookLoanStats, models.PublisherStats):
+        model.__table__.create(conn, checkfirst=True)
+    stats.rebuild(conn)  # 用已有数据回填
+
+
+def _v4_change_feed(conn):
+    # 已有的行版本号都是 0：客户端第一次总是全量加载，之后才按版本号增量同步
+    for model in (models.Publisher, models.Book, models.Inventory):
+        table = model.__table__
+        _add_column(conn, table, "version")
+        _add_column(conn, table, "updated_at")
+        _create_indexes(conn, table, f"ix_{table.name}_version")
+    for model in (models.ChangeVersion, models.ChangeTombstone):
+        model.__table__.create(conn, checkfirst=True)
+    changes.ensure_counter(conn)
+
+
+def _v5_auth(conn):
+    models.UserSession.__table__.create(conn, checkfirst=True)
+    # 原来的密码是明文，原地换成哈希
+    users = models.User.__table__
+    for user_id, password in conn.execute(select(users.c.id, users.c.password)).all():
+        if not (password or "").startswith(auth.ALGORITHM + "$"):
+            conn.execute(users.update().where(users.c.id == user_id).values(password=auth.hash_password(password or "")))
+
+
+def _v6_idempotency(conn):
+    models.IdempotencyKey.__table__.create(conn, checkfirst=True)
+
+
+def _v7_reconcile(conn):
+    models.ReconcileState.__table__.create(conn, checkfirst=True)
+    reconcile.ensure_state(conn)
+
+
+def _v8_fine_rules(conn):
+    models.FineRule.__table__.create(conn, checkfirst=True)
+    fine_rules.ensure_defaults(conn)  # 和原来写死的规则一样，升级后罚款金额不变
+
+
+def _v9_sharded_daily_stats(conn):
+    # 主键从 day 改成 (day, shard)：两种数据库改主键的写法不一样，汇总表可以从明细表重算，直接重建
+    DailyStats = models.DailyStats.__table__
+    DailyStats.drop(conn, checkfirst=True)
+    DailyStats.create(conn)
+    stats.rebuild(conn)
+
+
+def _v10_change_batches(conn):
+    models.ChangeBatch.__table__.create(conn, checkfirst=True)
+    # 原来的计数器接着当对外的版本号用。已有的行和 tombstone 的 version 是旧版本号，没有对应的批次：
+    # 把清理点挪到当前版本，落在它之前的客户端重新全量加载，对账下次也全量核对；
+    # 插一行 id = 当前版本号的批次，之后的批次号从它往后排，不会和旧版本号重复
+    counter = conn.execute(select(models.ChangeVersion.version).where(models.ChangeVersion.id == 1)).scalar()
+    if counter and conn.execute(select(func.max(models.ChangeBatch.id))).scalar() is None:
+        conn.execute(models.ChangeBatch.__table__.insert().values(
+            id=counter, version=counter, created_at=datetime(1970, 1, 1)))
+        conn.execute(models.ChangeVersion.__table__.update().where(models.ChangeVersion.id == 1)
+                     .values(pruned_before=counter))
+        conn.execute(models.ReconcileState.__table__.update().values(version=None))
+
+
+# (版本号, 说明, 函数)，只能往后追加，已发布的迁移不要再改
+MIGRATIONS = [
+    (1, "借还书 / 罚款 / 列表筛选的常用查询索引", _v1_hot_query_indexes),
+    (2, "超期统计索引和 overdue_loans 快照表", _v2_overdue),
+    (3, "罚款产生/缴纳时间，流通统计汇总表", _v3_stats),
+    (4, "目录表行版本号和删除记录 (增量同步)", _v4_change_feed),
+    (5, "登录会话表，管理员密码改存哈希", _v5_auth),
+    (6, "借还书 / 缴费的幂等键表", _v6_idempotency),
+    (7, "库存 / 已借数量对账的增量版本号", _v7_reconcile),
+    (8, "按读者类别配置的罚款规则表", _v8_fine_rules),
+    (9, "每日统计按 (day, shard) 分行累加", _v9_sharded_daily_stats),
+    (10, "增量同步的改动批次表，版本号在事务提交之后分配", _v10_change_batches),
+]
+
+
+def current_version(bind):
+    with bind.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return 0
+        return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(bind):
+    """把数据库升级到最新版本，返回本次执行了的迁移版本号列表。可重复执行。"""
+    _metadata.create_all(bind=bind)
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version(bind):
+            continue
+        try:
+            with bind.begin() as conn:
+                migration(conn)
+                conn.execute(schema_version.insert().values(version=version, description=description))
+        except SQLAlchemyError:
+            # 多个 worker 同时启动时可能被别的进程抢先执行完，这种情况直接跳过
+            if current_version(bind) >= version:
+                continue
+            raise
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库结构迁移")
+    parser.add_argument("--url", help="数据库连接串，默认使用 database.py 里的配置")
+    parser.add_argument("--status", action="store_true", help="只查看当前版本，不执行迁移")
+    args = parser.parse_args()
+
+    if args.url:
+        from sqlalchemy import create_engine
+        bind = create_engine(args.url)
+    else:
+        from database import engine as bind
+
+    if args.status:
+        print(f"当前版本: {current_version(bind)}，最新版本: {MIGRATIONS[-1][0]}")
+        return
+    applied = upgrade(bind)
+    print(f"已执行迁移: {applied}" if applied else "已经是最新版本")
+    print(f"当前版本: {current_version(bind)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, DECIMAL, Text
+from sqlalchemy import BigInteger, Boolean, Column, Date, ForeignKey, Index, Integer, String, DateTime, DECIMAL, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -9,7 +9,7 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True)
-    password = Column(String(100)) # 存储明文或哈希
+    password = Column(String(100)) # PBKDF2 哈希 (见 auth.py)，不存明文
 
 # 2. 读者表
 class Reader(Base):
@@ -27,17 +27,30 @@ class Publisher(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), unique=True)
     address = Column(String(200))
+    # 增量同步用 (见 changes.py)：最后一次修改时分配的全局版本号
+    version = Column(BigInteger, default=0, server_default="0", nullable=False, index=True)
+    updated_at = Column(DateTime)
 
 # 4. 图书基本信息表
 class Book(Base):
     __tablename__ = "books"
 
     isbn = Column(String(20), primary_key=True, index=True)
-    title = Column(String(100))
-    author = Column(String(100))
-    publisher_id = Column(Integer, ForeignKey("publishers.id"))
+    title = Column(String(100), index=True)
+    author = Column(String(100), index=True)
+    publisher_id = Column(Integer, ForeignKey("publishers.id"), index=True)
     price = Column(DECIMAL(10, 2))
     stock_qty = Column(Integer, default=0) # 逻辑库存数量
+    version = Column(BigInteger, default=0, server_default="0", nullable=False, index=True)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        # 书名/作者全文检索 (ngram 分词支持中文)，只有 MySQL 建；SQLite 用 FTS5 虚拟表，见 search.py
+        Index(
+            "ft_books_title_author", "title", "author",
+            mysql_prefix="FULLTEXT", mysql_with_parser="ngram"
+        ).ddl_if(dialect="mysql"),
+    )
 
 # 5. 馆藏表 (具体的每一本书)
 class Inventory(Base):
@@ -47,6 +60,13 @@ class Inventory(Base):
     isbn = Column(String(20), ForeignKey("books.isbn"))
     status = Column(Integer, default=1) 
     # 1=在馆, 0=已借出, -1=丢失/损毁
+    version = Column(BigInteger, default=0, server_default="0", nullable=False, index=True)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        # 按 ISBN 查在馆副本；只按 ISBN 查时也能用 (最左前缀)
+        Index("ix_inventory_isbn_status", "isbn", "status"),
+    )
 
 # 6. 借阅记录表 (这就是你报错缺失的那个！)
 class BorrowRecord(Base):
@@ -58,6 +78,15 @@ class BorrowRecord(Base):
     borrow_date = Column(DateTime, default=func.now()) # 借出时间
     return_date = Column(DateTime, nullable=True)      # 归还时间 (空表示未还)
 
+    __table_args__ = (
+        # 还书：按馆藏找 return_date IS NULL 的在借记录
+        Index("ix_borrow_records_inventory_return", "inventory_id", "return_date"),
+        # 按读者查借阅记录
+        Index("ix_borrow_records_card_id", "card_id"),
+        # 超期统计：在借 (return_date IS NULL) 且借出时间早于某个时间点，见 overdue.py
+        Index("ix_borrow_records_open_since", "return_date", "borrow_date"),
+    )
+
 # 7. 罚款记录表
 class Fine(Base):
     __tablename__ = "fines"
@@ -66,4 +95,116 @@ class Fine(Base):
     card_id = Column(Integer, ForeignKey("readers.card_id"))
     amount = Column(DECIMAL(10, 2)) # 罚款金额
     remark = Column(String(255))    # 罚款原因
-    is_paid = Column(Integer, default=0) # 0=未缴, 1=已缴
\ No newline at end of file
+    is_paid = Column(Integer, default=0) # 0=未缴, 1=已缴
+    created_at = Column(DateTime, default=func.now()) # 产生时间 (还书时间)
+    paid_at = Column(DateTime, nullable=True)         # 缴纳时间
+
+    __table_args__ = (
+        # 借书前检查「有没有未缴罚款」、读者列表统计未缴罚款数
+        Index("ix_fines_card_id_is_paid", "card_id", "is_paid"),
+    )
+
+# 8. 超期记录快照表 (每晚由 overdue.py sweep 整体重算，只用于查询统计，不设外键)
+class OverdueLoan(Base):
+    __tablename__ = "overdue_loans"
+
+    borrow_record_id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, index=True)
+    inventory_id = Column(Integer)
+    borrow_date = Column(DateTime)
+    overdue_days = Column(Integer)
+    accrued_fine = Column(DECIMAL(10, 2)) # 截至 swept_at 的应计罚款
+    swept_at = Column(DateTime)
+
+# 9. 统计汇总表 (借还书 / 缴费时增量更新，首页看板直接读；python stats.py rebuild 可全量重算)
+class DailyStats(Base):
+    __tablename__ = "stats_daily"
+
+    day = Column(Date, primary_key=True)
+    # 同一天分成几行累加 (stats.record_day 随机挑一行)，避免所有借还书都抢同一行的锁；读的时候按 day 求和
+    shard = Column(Integer, primary_key=True, default=0)
+    loans = Column(Integer, default=0, nullable=False)
+    returns = Column(Integer, default=0, nullable=False)
+    fines_issued = Column(Integer, default=0, nullable=False)
+    fines_issued_amount = Column(DECIMAL(12, 2), default=0, nullable=False)
+    fines_collected = Column(Integer, default=0, nullable=False)
+    fines_collected_amount = Column(DECIMAL(12, 2), default=0, nullable=False)
+
+class BookLoanStats(Base):
+    __tablename__ = "stats_book_loans"
+
+    isbn = Column(String(20), primary_key=True)
+    loans = Column(Integer, default=0, nullable=False, index=True) # 累计借出次数，排行榜按它倒序
+
+class PublisherStats(Base):
+    __tablename__ = "stats_publishers"
+
+    publisher_id = Column(Integer, primary_key=True)
+    copies = Column(Integer, default=0, nullable=False)    # 馆藏总册数
+    available = Column(Integer, default=0, nullable=False) # 在馆册数
+
+# 10. 增量同步 (见 changes.py)
+class ChangeVersion(Base):
+    __tablename__ = "change_versions"
+
+    id = Column(Integer, primary_key=True)  # 只有一行 id=1
+    version = Column(BigInteger, default=0, nullable=False)        # 最新分配出去的版本号 (只在提交之后分配)
+    pruned_before = Column(BigInteger, default=0, nullable=False)  # 不超过这个版本的删除记录已清理
+
+# 每个修改目录表的事务插一行 (改动批次)：目录表行的 version 和 tombstone 的 version 存的是批次号 id，
+# 事务提交之后才把对外的版本号写到这里的 version 上，没写之前为空
+class ChangeBatch(Base):
+    __tablename__ = "change_batches"
+    __table_args__ = {"sqlite_autoincrement": True}  # SQLite 也不复用回滚掉的 id
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    version = Column(BigInteger, nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False)
+
+class ChangeTombstone(Base):
+    __tablename__ = "change_tombstones"
+
+    version = Column(BigInteger, primary_key=True)
+    table_name = Column(String(30), primary_key=True)
+    row_key = Column(String(50), primary_key=True)  # 被删除行的主键 (统一存成字符串)
+    deleted_at = Column(DateTime, nullable=False)
+
+# 11. 登录会话 (见 auth.py)：token 里带的是会话 id，退出登录 / 吊销后 revoked_at 有值
+class UserSession(Base):
+    __tablename__ = "user_sessions"
+
+    id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)  # 清理过期会话用
+    revoked_at = Column(DateTime)
+
+# 12. 幂等键 (见 idempotency.py，IDEMPOTENCY_BACKEND=database 时使用)
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(64), primary_key=True)            # sha256(用户 + 请求路径 + Idempotency-Key)
+    request_hash = Column(String(64), nullable=False)     # 请求内容的 sha256，同一个 key 换了内容要拒绝
+    status_code = Column(Integer)                         # 为空表示第一次请求还在处理
+    response_body = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+# 13. 计数器对账 (见 reconcile.py)：上次修正时的全局版本号，之后只核对版本号更大的行
+class ReconcileState(Base):
+    __tablename__ = "reconcile_state"
+
+    id = Column(Integer, primary_key=True)  # 只有一行 id=1
+    version = Column(BigInteger)            # 为空表示还没修正过 (下次全量核对)
+    reconciled_at = Column(DateTime)
+
+# 14. 罚款规则 (见 fine_rules.py)：按读者类别配置，category="*" 是默认规则
+class FineRule(Base):
+    __tablename__ = "fine_rules"
+
+    category = Column(String(20), primary_key=True)                # 对应 readers.category
+    loan_days = Column(Integer, nullable=False)                    # 借阅期限 (天)
+    daily_fine = Column(DECIMAL(10, 2), nullable=False)            # 超期每天罚款
+    max_overdue_fine = Column(DECIMAL(10, 2))                      # 单次借阅超期费上限，为空表示不封顶
+    damage_policy = Column(String(10), nullable=False)             # price=按图书价格赔偿，fixed=固定金额
+    damage_fine = Column(DECIMAL(10, 2), nullable=False)           # 固定赔偿金额 / 图书没有价格时的赔偿
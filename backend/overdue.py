@@ -0,0 +1,216 @@
+# 作用：超期未还统计 —— 在数据库里一条 SQL 算出所有在借记录的超期天数和应计罚款
+#
+# - GET /borrow/overdue、/borrow/overdue/summary：实时查询 (main.py)
+# - python overdue.py sweep：每晚定时执行，把当时所有超期记录整体写进 overdue_loans 快照表
+#   (crontab 示例：0 2 * * * cd /path/to/backend && python overdue.py sweep)
+# - GET /fines/forecast?at=<将来某个时间>：所有在借记录如果到那时还没还，各自的超期费合计。
+#   只查出 (借出时间, 规则编号) 两列，用 NumPy 按列整体计算，不逐行循环
+#
+# 超期天数和 circulation.calculate_fine 的算法一致：借出到现在的「整天数」减去借阅期限，
+# 借阅期限 / 每天罚款 / 上限按读者类别取 fine_rules 里的规则 (SQL 里是 CASE readers.category)。
+# 筛选条件先写成 borrow_date <= 截止时间 (按最短的借阅期限算)，能直接走 (return_date, borrow_date) 索引。
+
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import DateTime, Integer, bindparam, case, delete, distinct, func, insert, literal, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+import fine_rules
+import models
+
+# 预测时每次从游标取多少行
+FORECAST_CHUNK = 50000
+
+
+class days_between(FunctionElement):
+    """days_between(start, end)：两个时间相差的整天数 (不足一天舍去)，等同 Python 的 (end - start).days。"""
+    type = Integer()
+    name = "days_between"
+    inherit_cache = True
+
+
+@compiles(days_between)
+def _days_between_default(element, compiler, **kw):
+    start, end = (compiler.process(arg, **kw) for arg in element.clauses)
+    return f"TIMESTAMPDIFF(DAY, {start}, {end})"
+
+
+@compiles(days_between, "sqlite")
+def _days_between_sqlite(element, compiler, **kw):
+    start, end = (compiler.process(arg, **kw) for arg in element.clauses)
+    # 先换成整秒再整除，避免 julianday 浮点误差让正好 N 天变成 N-1 天
+    return f"(CAST(ROUND((julianday({end}) - julianday({start})) * 86400) AS INTEGER) / 86400)"
+
+
+def _rule_column(rules, field):
+    """CASE readers.category WHEN '学生' THEN ... ELSE <默认规则> END"""
+    default = getattr(rules.default, field)
+    whens = {category: getattr(rule, field) for category, rule in rules.by_category.items()
+             if category != fine_rules.DEFAULT_CATEGORY and getattr(rule, field) != default}
+    if not whens:
+        return literal(default)
+    return case(whens, value=models.Reader.category, else_=default)
+
+
+def overdue_columns(now, rules):
+    """(超期天数, 应计罚款, 筛选条件)，now 是计算的基准时间。用到 readers.category，查询里要连 readers 表。"""
+    BorrowRecord = models.BorrowRecord
+    days = (days_between(BorrowRecord.borrow_date, bindparam("now", now, type_=DateTime))
+            - _rule_column(rules, "loan_days"))
+    fine = days * _rule_column(rules, "daily_fine")
+    if any(rule.max_overdue_fine is not None for rule in rules.all()):
+        cap = _rule_column(rules, "max_overdue_fine")  # 不封顶的类别是 NULL，比较结果不成立
+        fine = case((cap < fine, cap), else_=fine)
+    # 整天数 > 借阅期限 等价于 借出时间 <= now - (借阅期限 + 1) 天；先按最短的期限走索引，再按各自的期限精确筛选
+    shortest = min(rule.loan_days for rule in rules.all())
+    cutoff = now - timedelta(days=shortest + 1)
+    condition = (BorrowRecord.return_date == None) & (BorrowRecord.borrow_date <= cutoff) & (days > 0)
+    return days.label("overdue_days"), fine.label("accrued_fine"), condition
+
+
+def overdue_query(db, now, card_id=None):
+    """超期在借记录明细 (连带读者姓名、书名)，给分页接口用。"""
+    overdue_days, accrued_fine, condition = overdue_columns(now, fine_rules.current(db))
+    query = (
+        db.query(
+            models.BorrowRecord.id,
+            models.BorrowRecord.card_id,
+            models.Reader.name.label("reader_name"),
+            models.BorrowRecord.inventory_id,
+            models.Inventory.isbn,
+            models.Book.title,
+            models.BorrowRecord.borrow_date,
+            overdue_days,
+            accrued_fine,
+        )
+        .join(models.Reader, models.Reader.card_id == models.BorrowRecord.card_id)
+        .join(models.Inventory, models.Inventory.id == models.BorrowRecord.inventory_id)
+        .join(models.Book, models.Book.isbn == models.Inventory.isbn)
+        .filter(condition)
+    )
+    if card_id is not None:
+        query = query.filter(models.BorrowRecord.card_id == card_id)
+    return query
+
+
+def summarize(db, now):
+    """超期记录数、涉及读者数、应计罚款总额 (一条聚合 SQL)。"""
+    _, accrued_fine, condition = overdue_columns(now, fine_rules.current(db))
+    row = db.execute(
+        select(
+            func.count(),
+            func.count(distinct(models.BorrowRecord.card_id)),
+            func.coalesce(func.sum(accrued_fine), 0),
+        )
+        .select_from(models.BorrowRecord)
+        .join(models.Reader, models.Reader.card_id == models.BorrowRecord.card_id)
+        .where(condition)
+    ).one()
+    last_sweep = db.execute(select(func.max(models.OverdueLoan.swept_at))).scalar()
+    return {
+        "as_of": now,
+        "overdue_loans": row[0],
+        "overdue_readers": row[1],
+        "accrued_fines": float(row[2]),
+        "last_sweep_at": last_sweep,
+    }
+
+
+def sweep(db, now=None):
+    """用当前时间重算超期记录，整体替换 overdue_loans 快照表 (INSERT ... SELECT，一个事务)。"""
+    now = now or datetime.now()
+    overdue_days, accrued_fine, condition = overdue_columns(now, fine_rules.current(db))
+    BorrowRecord = models.BorrowRecord
+    db.execute(delete(models.OverdueLoan))
+    db.execute(
+        insert(models.OverdueLoan).from_select(
+            ["borrow_record_id", "card_id", "inventory_id", "borrow_date", "overdue_days", "accrued_fine", "swept_at"],
+            select(
+                BorrowRecord.id, BorrowRecord.card_id, BorrowRecord.inventory_id, BorrowRecord.borrow_date,
+                overdue_days, accrued_fine, bindparam("swept_at", now, type_=DateTime)
+            )
+            .join(models.Reader, models.Reader.card_id == BorrowRecord.card_id)
+            .where(condition)
+        )
+    )
+    db.commit()
+    return summarize(db, now)
+
+
+def forecast(db, at):
+    """所有在借记录如果到 at 还没归还，各自的超期费 (按读者类别的规则，已封顶) 汇总，按读者类别分组。
+
+    不含损坏赔偿 (还书时才知道)。数据库只返回借出时间和规则编号两列，天数 / 罚款用 NumPy 整列计算。
+    """
+    rules = fine_rules.current(db)
+    # 规则编号：0..n-1 是单独配置的类别，n 是默认规则 (在 SQL 里用 CASE 换成编号，Python 里不用逐行查字典)
+    categories = [c for c in rules.by_category if c != fine_rules.DEFAULT_CATEGORY]
+    table = [rules.by_category[c] for c in categories] + [rules.default]
+    rule_index = (
+        case({c: i for i, c in enumerate(categories)}, value=models.Reader.category, else_=len(categories))
+        if categories else literal(0)
+    )
+    result = db.execute(
+        select(models.BorrowRecord.borrow_date, rule_index)
+        .join(models.Reader, models.Reader.card_id == models.BorrowRecord.card_id)
+        .where(models.BorrowRecord.return_date == None)
+        .execution_options(yield_per=FORECAST_CHUNK)
+    )
+    borrow_dates, indexes = [np.empty(0, dtype="datetime64[us]")], [np.empty(0, dtype=np.int64)]
+    for rows in result.partitions():
+        dates, index = zip(*rows)
+        borrow_dates.append(np.array(dates, dtype="datetime64[us]"))
+        indexes.append(np.fromiter(index, dtype=np.int64, count=len(index)))
+    borrow_date, index = np.concatenate(borrow_dates), np.concatenate(indexes)
+
+    loan_days = np.array([r.loan_days for r in table], dtype=np.int64)[index]
+    daily_fine = np.array([r.daily_fine for r in table])[index]
+    cap = np.array([np.inf if r.max_overdue_fine is None else r.max_overdue_fine for r in table])[index]
+
+    # 整天数向下取整，和 timedelta.days 一致
+    elapsed = (np.datetime64(at, "us") - borrow_date) // np.timedelta64(1, "D")
+    overdue_days = np.maximum(elapsed - loan_days, 0)
+    uncapped = overdue_days * daily_fine
+    fines = np.minimum(uncapped, cap)
+    overdue = overdue_days > 0
+
+    groups = len(table)
+    open_by_rule = np.bincount(index, minlength=groups)
+    overdue_by_rule = np.bincount(index[overdue], minlength=groups)
+    fines_by_rule = np.bincount(index, weights=fines, minlength=groups)
+    names = categories + [fine_rules.DEFAULT_CATEGORY]
+    return {
+        "as_of": at,
+        "open_loans": int(index.size),
+        "overdue_loans": int(overdue.sum()),
+        "capped_loans": int((uncapped > cap).sum()),
+        "projected_fines": round(float(fines.sum()), 2),
+        "by_category": [
+            {"category": names[i], "open_loans": int(open_by_rule[i]), "overdue_loans": int(overdue_by_rule[i]),
+             "projected_fines": round(float(fines_by_rule[i]), 2)}
+            for i in range(groups) if open_by_rule[i]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="超期未还统计")
+    parser.add_argument("command", choices=["sweep", "summary"],
+                        help="sweep: 重算并写入快照表；summary: 只查看实时统计")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        result = sweep(db) if args.command == "sweep" else summarize(db, datetime.now())
+    finally:
+        db.close()
+    print(f"超期记录 {result['overdue_loans']} 条，涉及读者 {result['overdue_readers']} 人，"
+          f"应计罚款 {result['accrued_fines']:.2f} 元")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# 作用：列表接口通用的游标 (keyset) 分页工具
+# 游标里保存的是「上一页最后一行的 排序字段值 + 主键」，下一页直接用 WHERE 条件接着往后找，
+# 不用 OFFSET，所以翻到第几页代价都一样，且排序字段都有索引支撑。
+
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from fastapi import HTTPException, Response
+from sqlalchemy import DateTime, Numeric, and_, or_
+
+MAX_PAGE_SIZE = 1000
+# keyset_page 写的分页响应头；直接返回 Response 的接口 (缓存、快速序列化) 要把它们带上
+# X-Matches-Truncated：关键词匹配的范围有上限的接口 (借书台查在馆副本)，超过上限时写 1
+PAGE_HEADERS = ("X-Total-Count", "X-Next-Cursor", "X-Matches-Truncated")
+
+
+def encode_cursor(sort_value, key_value):
+    raw = json.dumps([sort_value, key_value], default=str, ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, sort_column, key_column):
+    try:
+        sort_value, key_value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="分页游标无效")
+    # 价格等 DECIMAL 字段在游标里是字符串，比较前要转回来
+    if isinstance(sort_column.type, Numeric) and sort_value is not None:
+        sort_value = Decimal(sort_value)
+    # 时间字段同理，在游标里是 "2024-01-01 08:00:00" 这样的字符串
+    if isinstance(sort_column.type, DateTime) and sort_value is not None:
+        try:
+            sort_value = datetime.fromisoformat(sort_value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="分页游标无效")
+    return sort_value, key_value
+
+
+def keyset_page(query, response: Response, *, sort_column, key_column,
+                descending=False, cursor=None, limit=100, with_total=True):
+    """按 (sort_column, key_column) 做游标分页。
+
+    响应头里写 X-Total-Count (过滤后的总行数) 和 X-Next-Cursor (还有下一页时才有)。
+    with_total=False 时不算总数 (不写 X-Total-Count)：COUNT 要扫完所有匹配行，
+    只需要「下一页」的场景 (下拉框边输边查) 省掉它，每页的代价就和表有多大无关。
+    """
+    total = query.order_by(None).count() if with_total else None
+
+    if cursor:
+        sort_value, key_value = decode_cursor(cursor, sort_column, key_column)
+        if sort_column is key_column:
+            query = query.filter(key_column < key_value if descending else key_column > key_value)
+        elif descending:
+            query = query.filter(or_(
+                sort_column < sort_value,
+                and_(sort_column == sort_value, key_column < key_value)
+            ))
+        else:
+            query = query.filter(or_(
+                sort_column > sort_value,
+                and_(sort_column == sort_value, key_column > key_value)
+            ))
+
+    if sort_column is key_column:
+        ordering = [key_column.desc() if descending else key_column.asc()]
+    elif descending:
+        ordering = [sort_column.desc(), key_column.desc()]
+    else:
+        ordering = [sort_column.asc(), key_column.asc()]
+
+    # 多取一行，用来判断还有没有下一页
+    rows = query.order_by(*ordering).limit(limit + 1).all()
+
+    if total is not None:
+        response.headers[PAGE_HEADERS[0]] = str(total)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        response.headers[PAGE_HEADERS[1]] = encode_cursor(
+            getattr(last, sort_column.key), getattr(last, key_column.key)
+        )
+    return rows
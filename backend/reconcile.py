@@ -0,0 +1,163 @@
+# 作用：计数器对账 —— books.stock_qty、readers.borrowed_count 是冗余计数，由各接口手工加减，
+# 这里用明细表核对并 (可选) 修正：
+#   stock_qty      应等于 该 ISBN 在馆 (status=1) 的馆藏册数
+#   borrowed_count 应等于 该读者未归还 (return_date IS NULL) 的借阅记录数
+#
+# - 每种计数一条 LEFT JOIN + GROUP BY + HAVING 的 SQL 直接找出对不上的行，不逐行查
+# - 增量：reconcile_state 记下上次修正时的全局版本号 (changes.py 的 change_versions)，之后只核对
+#   版本号更大的图书 / 馆藏涉及的 ISBN，以及这些馆藏的借阅记录涉及的读者 (借还书、馆藏增删改都会登记版本号)。
+#   版本号在事务提交之后才分配，读到版本 N 时 <= N 的修改都已提交，下一次从 N 往后核对不会漏。
+#   直接改数据库造成的偏差不会登记版本号，要用 --full 全量核对 (第一次运行也是全量)
+# - 修正按差值加减 (stock_qty += 应有 - 现有)，不是直接覆盖：查询和修正之间有人借还书时，
+#   计数和明细同时变化，差值不变，不会把并发的修改覆盖掉
+# - 修正时先按上次的版本号条件更新 reconcile_state，两个修正任务同时执行时后一个直接放弃，差值不会被加两次
+#
+# 用法 (在 backend 目录下)：
+#   python reconcile.py check            # 只检查 (增量)，不修改
+#   python reconcile.py repair           # 检查并修正，记下新的版本号 (crontab: 0 * * * * ... repair)
+#   python reconcile.py repair --full    # 全量核对所有图书和读者
+
+import argparse
+from datetime import datetime
+
+from sqlalchemy import and_, func, select, union, update
+
+import changes
+import models
+from circulation import bump_counters
+
+# 接口返回的明细最多多少行 (偏差条数照常统计全部)
+SAMPLE_LIMIT = 100
+
+ReconcileState = models.ReconcileState.__table__
+
+
+class ReconcileConflict(Exception):
+    """另一个修正任务刚刚执行过，这次的检查结果已经过时。"""
+
+
+def ensure_state(conn):
+    """建库 / 迁移后调用：保证状态那一行存在 (version 为空表示还没修正过，下次全量核对)。"""
+    if conn.execute(select(ReconcileState.c.id).where(ReconcileState.c.id == 1)).first() is None:
+        conn.execute(ReconcileState.insert().values(id=1, version=None))
+
+
+def _watermark(db):
+    return db.execute(select(ReconcileState.c.version).where(ReconcileState.c.id == 1)).scalar()
+
+
+def stock_drift(db, since=None):
+    """(isbn, stock_qty, 应有值) 列表。since 为空时核对全部图书，否则只核对版本号 > since 的图书 / 馆藏涉及的 ISBN。"""
+    Book, Inventory = models.Book, models.Inventory
+    available = func.count(Inventory.id)
+    query = (
+        select(Book.isbn, Book.stock_qty, available.label("expected"))
+        .outerjoin(Inventory, and_(Inventory.isbn == Book.isbn, Inventory.status == 1))
+        .group_by(Book.isbn, Book.stock_qty)
+        .having(Book.stock_qty != available)
+        .order_by(Book.isbn)
+    )
+    if since is not None:
+        # 行的 version 存的是批次号，都能走 version 索引；馆藏改了 ISBN 时新旧两种书都会登记 books 的版本号
+        touched = union(
+            select(Book.isbn).where(Book.version.in_(changes.batches_since(since))),
+            select(Inventory.isbn).where(Inventory.version.in_(changes.batches_since(since))),
+        )
+        query = query.where(Book.isbn.in_(touched))
+    return db.execute(query).all()
+
+
+def borrowed_drift(db, since=None):
+    """(card_id, borrowed_count, 应有值) 列表。since 不为空时只核对版本号 > since 的馆藏的借阅者。"""
+    Reader, BorrowRecord, Inventory = models.Reader, models.BorrowRecord, models.Inventory
+    open_loans = func.count(BorrowRecord.id)
+    query = (
+        select(Reader.card_id, Reader.borrowed_count, open_loans.label("expected"))
+        .outerjoin(BorrowRecord, and_(BorrowRecord.card_id == Reader.card_id, BorrowRecord.return_date == None))
+        .group_by(Reader.card_id, Reader.borrowed_count)
+        .having(Reader.borrowed_count != open_loans)
+        .order_by(Reader.card_id)
+    )
+    if since is not None:
+        # 借书 / 还书都会登记馆藏的版本号，从馆藏找到借过它的读者
+        touched = (
+            select(BorrowRecord.card_id)
+            .join(Inventory, Inventory.id == BorrowRecord.inventory_id)
+            .where(Inventory.version.in_(changes.batches_since(since)))
+        )
+        query = query.where(Reader.card_id.in_(touched))
+    return db.execute(query).all()
+
+
+def reconcile(db, repair=False, full=False):
+    """核对两种计数，repair=True 时按差值修正并记下本次的版本号。返回结果汇总。
+
+    修正过的图书会登记增量同步的版本号；调用方负责让图书列表缓存失效 (result["stock_drift"] > 0 时)。
+    """
+    previous = _watermark(db)
+    since = None if full else previous
+    # 先读版本号再查明细：<= version 的修改都已提交，查询一定能看到
+    version = changes.committed_version(db)
+    stock = stock_drift(db, since)
+    borrowed = borrowed_drift(db, since)
+
+    if repair:
+        db.rollback()  # 结束只读事务，修正在新事务里做 (按差值加减，不依赖上面的快照)
+        claimed = db.execute(
+            update(ReconcileState)
+            .where(ReconcileState.c.id == 1, ReconcileState.c.version == previous)  # previous 为空时是 IS NULL
+            .values(version=version, reconciled_at=datetime.now())
+        ).rowcount
+        if claimed == 0:
+            db.rollback()
+            raise ReconcileConflict("另一个对账任务刚刚修正过，请重新检查")
+        # 加锁顺序和借还书一致：readers -> books
+        bump_counters(db, models.Reader.__table__, "card_id", "borrowed_count",
+                      {row.card_id: row.expected - row.borrowed_count for row in borrowed})
+        bump_counters(db, models.Book.__table__, "isbn", "stock_qty",
+                      {row.isbn: row.expected - row.stock_qty for row in stock})
+        if stock:
+            changes.record(db, books=[row.isbn for row in stock])  # stock_qty 会同步给客户端
+        db.commit()
+        changes.publish(db)
+
+    return {
+        "full": since is None,
+        "since_version": since,
+        "version": version,
+        "repaired": repair,
+        "stock_drift": len(stock),
+        "borrowed_drift": len(borrowed),
+        "stock": [row._asdict() for row in stock[:SAMPLE_LIMIT]],
+        "borrowed": [row._asdict() for row in borrowed[:SAMPLE_LIMIT]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="库存 / 已借数量计数器对账")
+    parser.add_argument("command", choices=["check", "repair"],
+                        help="check: 只检查；repair: 检查并修正，记下本次的版本号")
+    parser.add_argument("--full", action="store_true", help="全量核对 (默认只核对上次修正之后改过的)")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        result = reconcile(db, repair=args.command == "repair", full=args.full)
+    except ReconcileConflict as e:
+        raise SystemExit(str(e))
+    finally:
+        db.close()
+
+    scope = "全量" if result["full"] else f"版本 {result['since_version']} 之后"
+    print(f"核对范围：{scope} (当前版本 {result['version']})")
+    for row in result["stock"]:
+        print(f"  库存 {row['isbn']}: {row['stock_qty']} -> {row['expected']}")
+    for row in result["borrowed"]:
+        print(f"  已借 读者 {row['card_id']}: {row['borrowed_count']} -> {row['expected']}")
+    action = "已修正" if result["repaired"] else "发现"
+    print(f"{action}库存偏差 {result['stock_drift']} 种书，已借数量偏差 {result['borrowed_drift']} 位读者")
+
+
+if __name__ == "__main__":
+    main()
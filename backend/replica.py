@@ -0,0 +1,218 @@
+# 作用：读写分离 —— 列表 / 报表类 GET 接口读只读副本，写操作和「刚写完就读」的请求仍走主库
+#
+# - main.py 的 get_read_db 每个请求先调用 choose(request) 决定读哪个库：
+#   1. 没配置 READ_DATABASE_URL -> 主库
+#   2. 请求头带了 X-Read-Primary-Until 且还没到时间 (这个客户端刚写过数据) -> 主库 (reason=pinned)
+#   3. 副本延迟超过 REPLICA_MAX_LAG 秒，或者连不上 -> 主库 (reason=lagging / unreachable)
+#      (两次检测之间读副本出错时，with_db 会把这个请求换到主库重查一次，reason=replica_error)
+#   4. 否则 -> 副本
+# - 写后读：PinPrimaryMiddleware 给成功的写请求 (POST / PUT / PATCH / DELETE) 的响应加上
+#   X-Read-Primary-Until: <服务器时间戳 + READ_AFTER_WRITE_SECONDS>，前端 request.js 记下来，之后的请求原样带回。
+#   比较用的是服务器自己的时钟，客户端时间不准也没关系
+# - 延迟检测 (每 REPLICA_CHECK_INTERVAL 秒最多一次，后台线程测，请求不等它)：
+#   MySQL 复制优先用副本上 SHOW REPLICA STATUS 的 Seconds_Behind_Source；
+#   拿不到 (不是真正的复制 / 没有权限 / SQLite) 时比较两边 change_versions 的版本号：
+#   记下主库每个版本号第一次被看到的时间，副本停在哪个版本，就落后了从那以后的这么多秒
+#   (精度约一个检查间隔；只有目录类表的修改会推进版本号，没有写入时两边相等，延迟算 0)
+# - 副本的表结构由复制同步过来，这里不会对副本建表 / 迁移
+#
+# 本地测试：READ_DATABASE_URL 指向另一个 SQLite 文件 (拷贝一份主库) 或另一个 MySQL 实例，
+# 改主库之后副本版本号不动，延迟会一直增长，超过 REPLICA_MAX_LAG 后 GET 接口自动改读主库。
+
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+from sqlalchemy import exc, select, text
+from starlette.concurrency import run_in_threadpool
+
+import config
+import database
+import metrics
+import models
+
+logger = logging.getLogger("library.replica")
+
+PIN_HEADER = "X-Read-Primary-Until"
+WRITE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+ChangeVersion = models.ChangeVersion.__table__
+
+
+def is_replica(db):
+    """db 会话是不是连的只读副本。"""
+    return bool(db.info.get("replica"))
+
+
+def _current_version(conn):
+    return conn.execute(select(ChangeVersion.c.version).where(ChangeVersion.c.id == 1)).scalar_one()
+
+
+def _replication_delay(conn):
+    """MySQL 副本自己报告的延迟 (秒)。不是 MySQL 复制或者查不到时返回 None，复制线程停了返回 inf。"""
+    if conn.dialect.name != "mysql":
+        return None
+    for statement, column in (
+        ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),  # MySQL 8.0.22+
+        ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+    ):
+        try:
+            row = conn.execute(text(statement)).mappings().first()
+        except exc.DBAPIError:
+            continue  # 老版本不认识 / 没有 REPLICATION CLIENT 权限
+        if row is None:
+            return None  # 这个实例不是副本 (比如本地另起的一个实例)
+        value = row.get(column)
+        return float("inf") if value is None else float(value)
+    return None
+
+
+class ReplicaMonitor:
+    """记录副本最近一次测到的延迟。lag 为 None 表示连不上 / 表结构不对。"""
+
+    def __init__(self, primary, replica, max_lag, interval):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.interval = interval
+        self.lag = None
+        self.checked_at = None
+        self._refreshing = threading.Lock()
+        # 主库版本号第一次被看到的时间：[(monotonic 时间, 版本号)]，版本号递增
+        self._seen = collections.deque(maxlen=1000)
+
+    @property
+    def due(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at >= self.interval
+
+    @property
+    def refreshing(self):
+        return self._refreshing.locked()
+
+    @property
+    def healthy(self):
+        return self.lag is not None and self.lag <= self.max_lag
+
+    def refresh(self):
+        """测一次延迟 (会阻塞，async 代码里放线程池)。已经有线程在测时直接返回。"""
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            try:
+                lag = self._measure()
+            except Exception as e:  # 连不上 / 副本上没有 change_versions 等，都当作不可用
+                if self.lag is not None or self.checked_at is None:
+                    logger.warning("只读副本不可用，读请求改走主库: %s", e)
+                lag = None
+            self.lag = lag
+            self.checked_at = time.monotonic()
+        finally:
+            self._refreshing.release()
+
+    def _measure(self):
+        # 先读副本再读主库：副本的版本号不会超过随后读到的主库版本号
+        with self.replica.connect() as conn:
+            delay = _replication_delay(conn)
+            if delay is not None:
+                return delay
+            replica_version = _current_version(conn)
+        with self.primary.connect() as conn:
+            primary_version = _current_version(conn)
+        return self._version_lag(primary_version, replica_version, time.monotonic())
+
+    def _version_lag(self, primary_version, replica_version, now):
+        if self._seen and primary_version < self._seen[-1][1]:
+            self._seen.clear()  # 主库被重建过
+        if not self._seen or primary_version > self._seen[-1][1]:
+            self._seen.append((now, primary_version))
+        # 副本已经有的版本不用再记
+        while self._seen and self._seen[0][1] <= replica_version:
+            self._seen.popleft()
+        return now - self._seen[0][0] if self._seen else 0.0
+
+    def status(self):
+        return {"lag_seconds": self.lag, "healthy": self.healthy}
+
+
+monitor = None
+if database.read_engine is not None:
+    monitor = ReplicaMonitor(
+        database.engine, database.read_engine, config.REPLICA_MAX_LAG, config.REPLICA_CHECK_INTERVAL
+    )
+
+
+def pinned(request):
+    """客户端刚写过数据 (带回的 X-Read-Primary-Until 还没到期)。"""
+    value = request.headers.get(PIN_HEADER)
+    if not value:
+        return False
+    try:
+        return float(value) > time.time()
+    except ValueError:
+        return False
+
+
+def _decide(request):
+    if pinned(request):
+        target, reason = "primary", "pinned"
+    elif monitor.healthy:
+        target, reason = "replica", "ok"
+    else:
+        target, reason = "primary", "unreachable" if monitor.lag is None else "lagging"
+    metrics.REGISTRY.count_read(target, reason)
+    return target
+
+
+async def choose(request):
+    """返回 "replica" 或 "primary"。延迟数据过期时在后台线程刷新，只有第一次检测会让请求等结果。"""
+    if monitor is None:
+        return "primary"
+    if monitor.checked_at is None:
+        await run_in_threadpool(monitor.refresh)
+    elif monitor.due and not monitor.refreshing:
+        asyncio.get_running_loop().run_in_executor(None, monitor.refresh)
+    return _decide(request)
+
+
+def choose_engine(request):
+    """同步版本，给直接用引擎的接口 (比如 /export 流式导出) 用，本身要在线程池里调用。"""
+    if monitor is None:
+        return database.engine
+    if monitor.due:
+        monitor.refresh()
+    return database.read_engine if _decide(request) == "replica" else database.engine
+
+
+def mark_unavailable():
+    """读副本时出错 (连接断开等)：先当作不可用，等下次检测成功再恢复。"""
+    if monitor is not None and monitor.lag is not None:
+        logger.warning("读只读副本出错，改走主库直到下次检测恢复")
+        monitor.lag = None
+    metrics.REGISTRY.count_read("primary", "replica_error")
+
+
+def status():
+    """/metrics 用；没有配置副本时返回 None。"""
+    return monitor.status() if monitor is not None else None
+
+
+class PinPrimaryMiddleware:
+    """成功的写请求在响应头里带上 X-Read-Primary-Until，客户端带回来之前的读请求都走主库。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = f"{time.time() + config.READ_AFTER_WRITE_SECONDS:.3f}"
+                headers = [*message.get("headers", []), (PIN_HEADER.lower().encode(), until.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Literal, Optional, List
+from datetime import date, datetime
 
 # =======================
 # 1. 基础模型 (作为父类)
@@ -9,6 +9,13 @@ class UserLogin(BaseModel):
     username: str
     password: str
 
+class LoginResponse(BaseModel):
+    message: str
+    user_id: int
+    username: str
+    token: str             # 之后的请求放在 Authorization: Bearer <token>
+    expires_at: datetime
+
 # =======================
 # 2. 响应模型 (包含ID)
 # =======================
@@ -60,6 +67,41 @@ class InventoryResponse(InventoryCreate):
     class Config:
         from_attributes = True
 
+# 借书台下拉框：在馆副本 + 书名 / 出版社
+class AvailableCopyResponse(BaseModel):
+    id: int                # 条码号
+    isbn: str
+    title: str
+    author: str
+    publisher_name: Optional[str] = None
+
+class BookAvailability(BaseModel):
+    isbn: str
+    total: int
+    available: int         # 在馆
+    on_loan: int           # 已借出
+    lost: int              # 丢失/损毁
+
+# --- 增量同步 (GET /changes) ---
+class PublisherChanges(BaseModel):
+    upserted: List[PublisherResponse]
+    deleted: List[int]
+
+class BookChanges(BaseModel):
+    upserted: List[BookResponse]
+    deleted: List[str]
+
+class InventoryChanges(BaseModel):
+    upserted: List[InventoryResponse]
+    deleted: List[int]
+
+class ChangesResponse(BaseModel):
+    version: int           # 下次请求带上 since=version
+    reset: bool = False    # True 表示改动太多或版本太旧，客户端应重新全量加载
+    publishers: PublisherChanges
+    books: BookChanges
+    inventory: InventoryChanges
+
 # --- 借阅/归还 请求 ---
 class BorrowRequest(BaseModel):
     card_id: int
@@ -69,6 +111,67 @@ class ReturnRequest(BaseModel):
     inventory_id: int
     is_damaged: bool = False  # 默认没坏，前端可以传 true
 
+# --- 批量借阅/归还 (流通台一次扫一车书) ---
+class BatchBorrowRequest(BaseModel):
+    card_id: int
+    inventory_ids: List[int]
+
+class BatchReturnRequest(BaseModel):
+    inventory_ids: List[int]
+    damaged_ids: List[int] = []  # 其中哪些条码是损坏归还的
+
+class BatchItemResult(BaseModel):
+    inventory_id: int
+    success: bool
+    message: str
+
+class BatchResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+# --- 超期未还 ---
+class OverdueLoanResponse(BaseModel):
+    id: int                # 借阅记录 id
+    card_id: int
+    reader_name: Optional[str] = None
+    inventory_id: int
+    isbn: str
+    title: Optional[str] = None
+    borrow_date: datetime
+    overdue_days: int
+    accrued_fine: float    # 如果现在归还要交的超期罚款
+    class Config:
+        from_attributes = True
+
+class OverdueSummary(BaseModel):
+    as_of: datetime
+    overdue_loans: int
+    overdue_readers: int
+    accrued_fines: float
+    last_sweep_at: Optional[datetime] = None  # 最近一次 overdue.py sweep 的时间
+
+# --- 计数器对账 (POST /reconcile) ---
+class StockDrift(BaseModel):
+    isbn: str
+    stock_qty: int
+    expected: int  # 在馆册数
+
+class BorrowedDrift(BaseModel):
+    card_id: int
+    borrowed_count: int
+    expected: int  # 未归还的借阅记录数
+
+class ReconcileResponse(BaseModel):
+    full: bool                            # 是否全量核对 (否则只核对 since_version 之后改过的)
+    since_version: Optional[int] = None
+    version: int                          # 本次核对时的版本号，修正后作为下次增量的起点
+    repaired: bool
+    stock_drift: int
+    borrowed_drift: int
+    stock: List[StockDrift]               # 最多列出前 100 条
+    borrowed: List[BorrowedDrift]
+
 # --- 借阅记录响应 ---
 class BorrowRecordResponse(BaseModel):
     id: int
@@ -88,4 +191,60 @@ class FineResponse(BaseModel):
     remark: Optional[str] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# --- 罚款规则 (按读者类别) ---
+class FineRuleBase(BaseModel):
+    loan_days: int = Field(gt=0)                            # 借阅期限 (天)
+    daily_fine: float = Field(ge=0)                         # 超期每天罚款
+    max_overdue_fine: Optional[float] = Field(None, ge=0)   # 单次借阅超期费上限，不填表示不封顶
+    damage_policy: Literal["price", "fixed"] = "price"       # price=按图书价格赔偿，fixed=固定金额
+    damage_fine: float = Field(50.0, ge=0)                  # 固定赔偿金额 / 图书没有价格时的赔偿
+
+class FineRuleResponse(FineRuleBase):
+    category: str  # "*" 是默认规则
+    class Config:
+        from_attributes = True
+
+# --- 罚款预测 (GET /fines/forecast) ---
+class FineForecastItem(BaseModel):
+    category: str  # "*"：没有单独配置规则的类别
+    open_loans: int
+    overdue_loans: int
+    projected_fines: float
+
+class FineForecast(BaseModel):
+    as_of: datetime
+    open_loans: int
+    overdue_loans: int          # 到 as_of 时超期的
+    capped_loans: int           # 超期费已经封顶的
+    projected_fines: float      # 超期费合计 (不含损坏赔偿)
+    by_category: List[FineForecastItem]
+
+# --- 首页看板统计 ---
+class DailyStatsItem(BaseModel):
+    day: date
+    loans: int
+    returns: int
+    fines_issued: int
+    fines_issued_amount: float
+    fines_collected: int
+    fines_collected_amount: float
+
+class TopBookItem(BaseModel):
+    isbn: str
+    title: Optional[str] = None
+    loans: int
+
+class PublisherStatsItem(BaseModel):
+    publisher_id: int
+    name: Optional[str] = None
+    copies: int
+    available: int
+
+class StatsResponse(BaseModel):
+    daily: List[DailyStatsItem]
+    top_books: List[TopBookItem]
+    publishers: List[PublisherStatsItem]
+    fines_issued_amount: float     # 累计
+    fines_collected_amount: float  # 累计
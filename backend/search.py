@@ -0,0 +1,121 @@
+# 作用：图书 书名/作者 全文检索 (支持中文子串)
+# - MySQL: books 表上的 FULLTEXT 索引 (ngram 分词器，见 models.Book)
+# - SQLite (本地开发/压测): FTS5 trigram 虚拟表 books_fts，由触发器和 books 表保持同步
+# 关键词太短、分词器切不出词时 (SQLite 1~2 个字、MySQL 1 个字)，退回到书名/作者 LIKE 子串匹配：
+# 要扫一遍 books 的书名/作者，但这种查询结果本来就多、只取前 limit 条，目录规模下可以接受
+
+from sqlalchemy import case, column, inspect, literal_column, select, table, text, union
+from sqlalchemy.dialects.mysql import match
+
+import models
+
+MYSQL_FULLTEXT_INDEX = "ft_books_title_author"
+SQLITE_FTS_TABLE = "books_fts"
+_sqlite_fts = table(SQLITE_FTS_TABLE, column("rowid"))
+
+# MySQL ngram_token_size 默认是 2，SQLite trigram 分词至少 3 个字符
+MIN_TOKEN_LENGTH = {"mysql": 2, "sqlite": 3}
+
+_SQLITE_FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE}
+        USING fts5(title, author, content='books', content_rowid='rowid', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, author) VALUES (new.rowid, new.title, new.author);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, author)
+        VALUES ('delete', old.rowid, old.title, old.author);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE ON books BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, author)
+        VALUES ('delete', old.rowid, old.title, old.author);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, author) VALUES (new.rowid, new.title, new.author);
+    END""",
+]
+
+
+def ensure_search_index(engine, rebuild=False):
+    """确保全文索引存在 (幂等)。新建索引时会顺带用 books 表现有数据建一次索引。"""
+    with engine.begin() as conn:
+        if engine.dialect.name == "mysql":
+            indexes = {ix["name"] for ix in inspect(conn).get_indexes("books")}
+            if MYSQL_FULLTEXT_INDEX not in indexes:
+                conn.execute(text(
+                    f"ALTER TABLE books ADD FULLTEXT INDEX {MYSQL_FULLTEXT_INDEX} (title, author) WITH PARSER ngram"
+                ))
+        elif engine.dialect.name == "sqlite":
+            created = not inspect(conn).has_table(SQLITE_FTS_TABLE)
+            for ddl in _SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+            if created or rebuild:
+                conn.execute(text(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def prefix_range(column_, q):
+    """前缀匹配写成范围条件，两种数据库都能直接走 B-Tree 索引 (SQLite 的 LIKE 默认不走索引)。"""
+    return (column_ >= q) & (column_ < q + "\uffff")
+
+
+def _phrase(q):
+    # 整个关键词作为一个短语去匹配 = 子串匹配；去掉引号防止破坏查询语法
+    return '"' + q.replace('"', " ") + '"'
+
+
+def search_books(db, q, limit=20):
+    """按相关度返回前 limit 本书：书名完全相同 > 书名前缀 > 作者前缀 > 其余按全文得分。"""
+    q = q.strip()
+    if not q:
+        return []
+
+    Book = models.Book
+    rank = case(
+        (Book.title == q, 0),
+        (Book.title.startswith(q, autoescape=True), 1),
+        (Book.author.startswith(q, autoescape=True), 2),
+        else_=3
+    )
+    query = db.query(Book)
+    dialect = db.get_bind().dialect.name
+
+    if dialect not in MIN_TOKEN_LENGTH or len(q) < MIN_TOKEN_LENGTH[dialect]:
+        # 其他数据库没有建全文索引；太短的词全文索引切不出来 —— 都只能 LIKE 扫描 (子串匹配，"孤独" 能搜到 "百年孤独")
+        condition = Book.title.contains(q, autoescape=True) | Book.author.contains(q, autoescape=True)
+        return query.filter(condition).order_by(rank, Book.title).limit(limit).all()
+
+    if dialect == "mysql":
+        score = match(Book.title, Book.author, against=_phrase(q)).in_boolean_mode()
+        return query.filter(score).order_by(rank, score.desc()).limit(limit).all()
+
+    # sqlite: 通过 rowid 关联 FTS5 虚拟表，bm25 越小越相关
+    return (
+        query.join(_sqlite_fts, _sqlite_fts.c.rowid == literal_column("books.rowid"))
+        .filter(text(f"{SQLITE_FTS_TABLE} MATCH :fts_query").bindparams(fts_query=_phrase(q)))
+        .order_by(rank, text(f"bm25({SQLITE_FTS_TABLE})"))
+        .limit(limit)
+        .all()
+    )
+
+
+def matching_isbns(db, q):
+    """列表接口 (/books/、/inventory/) 的 q 过滤：书名/作者命中关键词，或 ISBN 以它开头的图书的 ISBN 子查询。
+
+    书名/作者和 search_books 一样走全文索引 (太短时 LIKE 扫描)，ISBN 走主键范围；
+    两部分 UNION 之后按主键回表，不会因为 OR 退化成整表扫描。
+    """
+    q = q.strip()
+    Book = models.Book
+    dialect = db.get_bind().dialect.name
+
+    if dialect not in MIN_TOKEN_LENGTH or len(q) < MIN_TOKEN_LENGTH[dialect]:
+        by_text = select(Book.isbn).where(
+            Book.title.contains(q, autoescape=True) | Book.author.contains(q, autoescape=True)
+        )
+    elif dialect == "mysql":
+        by_text = select(Book.isbn).where(match(Book.title, Book.author, against=_phrase(q)).in_boolean_mode())
+    else:
+        by_text = (
+            select(Book.isbn)
+            .join(_sqlite_fts, _sqlite_fts.c.rowid == literal_column("books.rowid"))
+            .where(text(f"{SQLITE_FTS_TABLE} MATCH :fts_query").bindparams(fts_query=_phrase(q)))
+        )
+    return union(by_text, select(Book.isbn).where(prefix_range(Book.isbn, q)))
@@ -0,0 +1,49 @@
+# 作用：大列表接口 (/books/、/inventory/、/fines/all 等) 的快速序列化
+#
+# 原来的写法是 查出整行 ORM 对象 -> 每行用 Pydantic (from_attributes) 校验成 XxxResponse -> 再编码 JSON，
+# 列表一大 CPU 基本都花在这三步上。这里改成：
+# - columns(schema, model)：按 Response 模型的字段只 select 需要的列，db.query(*列) 返回的是轻量的 Row 元组
+# - json_response(rows, ...)：元组拼成 dict 后用 orjson 一次编码成字节，不再逐行构造 Pydantic 对象
+#
+# 字段名和顺序直接取自 schemas 里的 Response 模型，输出和原来逐行校验的结果一致；
+# 唯一的类型转换是 DECIMAL -> float (和 Pydantic 的 float 字段输出相同)。
+
+import json
+from decimal import Decimal
+
+from fastapi import Response
+
+from pagination import PAGE_HEADERS
+
+try:
+    import orjson
+except ImportError:  # 没装 orjson 时退回标准库，输出一样，只是慢一些
+    orjson = None
+
+
+def columns(schema, model):
+    """Response 模型的每个字段对应的 ORM 列，顺序和模型字段一致。"""
+    return tuple(getattr(model, name) for name in schema.model_fields)
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def dumps_rows(rows):
+    """[Row, ...] -> JSON 数组字节，每行是 {列名: 值} (列名就是 columns() 对应的字段名)。"""
+    fields = rows[0]._fields if rows else ()
+    data = [dict(zip(fields, row)) for row in rows]
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def json_response(rows, response=None):
+    """直接返回编码好的 JSON；response 是接口注入的 Response，带上上面写好的分页响应头。"""
+    headers = {}
+    if response is not None:
+        headers = {h: response.headers[h] for h in PAGE_HEADERS if h in response.headers}
+    return Response(content=dumps_rows(rows), media_type="application/json", headers=headers)
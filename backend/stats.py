@@ -0,0 +1,212 @@
+# 作用：首页看板的流通统计 (汇总表 stats_daily / stats_book_loans / stats_publishers)
+#
+# - 借还书、缴费、馆藏增删等接口在自己的事务里顺手更新汇总表 (UPSERT 累加)，看板只读汇总表，
+#   不用扫描借阅记录和罚款表
+# - 汇总表更新放在事务最后：加锁顺序是 inventory -> readers -> books -> 统计表，不会和借还书互相死锁
+# - stats_daily 每天分 STATS_DAILY_SHARDS 行 (day, shard)：所有借还书都要加今天的计数，只有一行时
+#   每个事务都要等前一个提交才能拿到行锁；随机分到几行上，看板读的时候再 GROUP BY day 求和
+# - 汇总表缺数据或对不上时 (比如直接改过数据库)，用 python stats.py rebuild 从明细表全量重算
+
+import argparse
+import random
+from datetime import date, timedelta
+
+from sqlalchemy import case, delete, func, insert, select
+
+import config
+import models
+
+DailyStats = models.DailyStats.__table__
+BookLoanStats = models.BookLoanStats.__table__
+PublisherStats = models.PublisherStats.__table__
+
+DAILY_COUNTERS = ["loans", "returns", "fines_issued", "fines_issued_amount",
+                  "fines_collected", "fines_collected_amount"]
+
+
+def _dialect(db):
+    # db 可以是 Session 也可以是 Connection (迁移里用)
+    return db.dialect.name if hasattr(db, "dialect") else db.get_bind().dialect.name
+
+
+def _upsert_add(db, table, key, counters, rows):
+    """批量 INSERT；主键已存在时把计数累加上去 (MySQL ON DUPLICATE KEY / SQLite ON CONFLICT)。
+
+    key 是主键列名，复合主键传元组。
+    """
+    if not rows:
+        return
+    keys = (key,) if isinstance(key, str) else tuple(key)
+    if _dialect(db) == "mysql":
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_duplicate_key_update({c: table.c[c] + stmt.inserted[c] for c in counters})
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys), set_={c: table.c[c] + stmt.excluded[c] for c in counters}
+        )
+    # 按主键排序，多个事务加锁顺序一致
+    db.execute(stmt, sorted(rows, key=lambda r: tuple(r[k] for k in keys)))
+
+
+# --- 增量更新 (各接口在 commit 之前调用) ---
+
+def record_day(db, day=None, **deltas):
+    """当天的计数累加，例如 record_day(db, loans=1)。累加到当天随机的一行 (shard) 上。"""
+    row = {c: deltas.get(c, 0) for c in DAILY_COUNTERS}
+    row["day"] = day or date.today()
+    row["shard"] = random.randrange(max(config.STATS_DAILY_SHARDS, 1))
+    _upsert_add(db, DailyStats, ("day", "shard"), DAILY_COUNTERS, [row])
+
+
+def record_book_loans(db, loans_by_isbn):
+    _upsert_add(db, BookLoanStats, "isbn", ["loans"],
+                [{"isbn": isbn, "loans": n} for isbn, n in loans_by_isbn.items() if n])
+
+
+def record_publishers(db, deltas):
+    """deltas: {publisher_id: (馆藏册数变化, 在馆册数变化)}"""
+    _upsert_add(db, PublisherStats, "publisher_id", ["copies", "available"], [
+        {"publisher_id": pid, "copies": copies, "available": available}
+        for pid, (copies, available) in deltas.items() if pid is not None and (copies or available)
+    ])
+
+
+def publishers_of(db, isbns):
+    """{isbn: publisher_id}，一次查出。"""
+    if not isbns:
+        return {}
+    return dict(db.execute(
+        select(models.Book.isbn, models.Book.publisher_id).where(models.Book.isbn.in_(set(isbns)))
+    ).all())
+
+
+def add_deltas(target, key, copies=0, available=0):
+    old = target.get(key, (0, 0))
+    target[key] = (old[0] + copies, old[1] + available)
+
+
+# --- 看板查询 (只读汇总表) ---
+
+def dashboard(db, days=30, top=10):
+    since = date.today() - timedelta(days=days - 1)
+    daily = db.execute(
+        select(DailyStats.c.day, *(func.sum(DailyStats.c[c]).label(c) for c in DAILY_COUNTERS))
+        .where(DailyStats.c.day >= since)
+        .group_by(DailyStats.c.day)
+        .order_by(DailyStats.c.day)
+    ).mappings().all()
+    by_day = {row["day"]: row for row in daily}
+    series = []
+    for i in range(days):
+        day = since + timedelta(days=i)
+        row = by_day.get(day)
+        series.append({"day": day, **{c: (row[c] if row else 0) for c in DAILY_COUNTERS}})
+
+    top_books = db.execute(
+        select(BookLoanStats.c.isbn, models.Book.title, BookLoanStats.c.loans)
+        .join(models.Book, models.Book.isbn == BookLoanStats.c.isbn, isouter=True)
+        .order_by(BookLoanStats.c.loans.desc(), BookLoanStats.c.isbn)
+        .limit(top)
+    ).mappings().all()
+
+    publishers = db.execute(
+        select(PublisherStats.c.publisher_id, models.Publisher.name,
+               PublisherStats.c.copies, PublisherStats.c.available)
+        .join(models.Publisher, models.Publisher.id == PublisherStats.c.publisher_id)
+        .order_by(PublisherStats.c.publisher_id)
+    ).mappings().all()
+
+    # 罚款合计：全部天数的汇总行相加 (一天最多 STATS_DAILY_SHARDS 行，行数很少)
+    totals = db.execute(select(
+        func.coalesce(func.sum(DailyStats.c.fines_issued_amount), 0),
+        func.coalesce(func.sum(DailyStats.c.fines_collected_amount), 0),
+    )).one()
+
+    return {
+        "daily": series,
+        "top_books": [dict(r) for r in top_books],
+        "publishers": [dict(r) for r in publishers],
+        "fines_issued_amount": float(totals[0]),
+        "fines_collected_amount": float(totals[1]),
+    }
+
+
+# --- 全量重算 ---
+
+def rebuild(db):
+    """清空汇总表，从借阅记录 / 罚款 / 馆藏明细表重新统计。返回各表写入行数。"""
+    BorrowRecord, Fine, Inventory, Book = models.BorrowRecord, models.Fine, models.Inventory, models.Book
+    for table in (DailyStats, BookLoanStats, PublisherStats):
+        db.execute(delete(table))
+
+    daily = {}
+
+    def merge(stmt, *counters):
+        for row in db.execute(stmt):
+            day = row[0] if isinstance(row[0], date) else date.fromisoformat(str(row[0])[:10])
+            target = daily.setdefault(day, {"day": day, **{c: 0 for c in DAILY_COUNTERS}})
+            for name, value in zip(counters, row[1:]):
+                target[name] += value or 0
+
+    loan_day = func.date(BorrowRecord.borrow_date)
+    merge(select(loan_day, func.count()).group_by(loan_day), "loans")
+    return_day = func.date(BorrowRecord.return_date)
+    merge(select(return_day, func.count()).where(BorrowRecord.return_date != None).group_by(return_day),
+          "returns")
+    issued_day = func.date(Fine.created_at)
+    merge(select(issued_day, func.count(), func.sum(Fine.amount))
+          .where(Fine.created_at != None).group_by(issued_day),
+          "fines_issued", "fines_issued_amount")
+    paid_day = func.date(Fine.paid_at)
+    merge(select(paid_day, func.count(), func.sum(Fine.amount))
+          .where(Fine.is_paid == 1, Fine.paid_at != None).group_by(paid_day),
+          "fines_collected", "fines_collected_amount")
+    if daily:
+        db.execute(insert(DailyStats), [{**row, "shard": 0} for row in daily.values()])
+
+    book_loans = db.execute(
+        insert(BookLoanStats).from_select(
+            ["isbn", "loans"],
+            select(Inventory.isbn, func.count())
+            .select_from(BorrowRecord)
+            .join(Inventory, Inventory.id == BorrowRecord.inventory_id)
+            .group_by(Inventory.isbn)
+        )
+    ).rowcount
+    publishers = db.execute(
+        insert(PublisherStats).from_select(
+            ["publisher_id", "copies", "available"],
+            select(Book.publisher_id, func.count(), func.sum(case((Inventory.status == 1, 1), else_=0)))
+            .select_from(Inventory)
+            .join(Book, Book.isbn == Inventory.isbn)
+            .where(Book.publisher_id != None)
+            .group_by(Book.publisher_id)
+        )
+    ).rowcount
+    # 早期没有记录产生时间的罚款无法归到某一天，只能跳过
+    undated = db.execute(select(func.count()).where(Fine.created_at == None)).scalar()
+    return {"days": len(daily), "books": book_loans, "publishers": publishers, "undated_fines": undated}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流通统计汇总表")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: 从明细表全量重算汇总表")
+    parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        result = rebuild(db)
+        db.commit()
+    finally:
+        db.close()
+    print(f"重算完成：{result['days']} 天，{result['books']} 种图书，{result['publishers']} 家出版社")
+    if result["undated_fines"]:
+        print(f"⚠️ {result['undated_fines']} 条罚款没有产生时间，未计入每日统计")
+
+
+if __name__ == "__main__":
+    main()
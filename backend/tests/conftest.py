@@ -0,0 +1,79 @@
+# 测试公用：临时 SQLite 文件库 + 已登录的 TestClient
+#
+# 数据库地址等配置在 import main / database 之前就要设好 (模块导入时就会建引擎、建表)，所以放在这个文件顶部。
+# 用法 (在 backend 目录下)：
+#   pip install -r tests/requirements.txt
+#   python -m pytest -q
+
+import contextlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmpdir = tempfile.mkdtemp(prefix="library-tests-")
+# 环境变量优先于 backend/.env，本机的 .env 不会影响测试
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_tmpdir, 'library.db')}",
+    DB_MODE="sync",
+    READ_DATABASE_URL="",
+    AUTH_SECRET="test-secret",
+    AUTH_PBKDF2_ITERATIONS="1000",  # 登录时算哈希不用等几百毫秒
+    IDEMPOTENCY_BACKEND="memory",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import auth  # noqa: E402
+import database  # noqa: E402
+import fine_rules  # noqa: E402
+import init_db  # noqa: E402
+import main  # noqa: E402
+from cache import catalog_cache  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    """每个测试重建一遍演示数据 (init_db.py)，返回已经用 admin1 登录的客户端。"""
+    init_db.init_db(database.engine)
+    # 进程内缓存还记着上一个测试的数据
+    catalog_cache.backend.clear()
+    fine_rules.invalidate()
+    with TestClient(main.app) as c:
+        login = c.post("/login/", json={"username": "admin1", "password": "123456"})
+        assert login.status_code == 200
+        c.headers["Authorization"] = f"Bearer {login.json()['token']}"
+        yield c
+    database.engine.dispose()
+    auth._sessions.clear()
+
+
+@pytest.fixture
+def engine():
+    return database.engine
+
+
+@pytest.fixture
+def statements():
+    """记录 with 块里执行的 SQL：with statements() as executed: ...，executed 是语句列表。"""
+
+    @contextlib.contextmanager
+    def capture(bind=None):
+        bind = bind or database.engine
+        executed = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        event.listen(bind, "before_cursor_execute", record)
+        try:
+            yield executed
+        finally:
+            event.remove(bind, "before_cursor_execute", record)
+
+    return capture
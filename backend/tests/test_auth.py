@@ -0,0 +1,28 @@
+# 令牌校验：伪造 / 乱码的令牌一律 401 (WebSocket 是 1008)，不能变成 500
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import auth
+
+BAD_TOKENS = ["a.1.éé", "é.1.abc", "a.١٢٣.abc", "no-dots", "a.b.c.d", ""]
+
+
+@pytest.mark.parametrize("token", BAD_TOKENS)
+def test_parse_token_rejects_malformed(token):
+    assert auth.parse_token(token) is None
+
+
+@pytest.mark.parametrize("token", ["a.1.éé", "é.1.abc"])
+def test_non_ascii_bearer_token_is_401(client, token):
+    # 请求头按 latin-1 解码，直接传 UTF-8 字节模拟客户端发来的乱码
+    response = client.get("/readers/", headers={"Authorization": f"Bearer {token}".encode("utf-8")})
+    assert response.status_code == 401
+
+
+def test_non_ascii_websocket_token_is_rejected(client):
+    del client.headers["Authorization"]
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/ws/events?token=é.1.abc"):
+            pass
+    assert closed.value.code == 1008
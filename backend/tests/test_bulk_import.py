@@ -0,0 +1,28 @@
+# 图书批量导入：价格没填存 NULL，负数 / 非数字是坏行
+
+from sqlalchemy import select
+
+import models
+
+CSV = """isbn,title,author,publisher_id,price
+IMP-1,有价格,作者,1,39.5
+IMP-2,没填价格,作者,1,
+IMP-3,负价格,作者,1,-1
+IMP-4,不是数字,作者,1,nan
+"""
+
+
+def test_import_books_price(client, engine):
+    response = client.post("/import/books", params={"format": "csv"}, content=CSV.encode("utf-8"))
+    assert response.status_code == 200
+    report = response.json()
+    assert report["books_inserted"] == 2
+    assert [e["line"] for e in report["errors"]] == [4, 5]
+    assert report["errors"][0]["error"] == "价格不能是负数"
+
+    with engine.connect() as conn:
+        prices = dict(conn.execute(
+            select(models.Book.isbn, models.Book.price).where(models.Book.isbn.like("IMP-%"))
+        ).all())
+    assert prices == {"IMP-1": 39.5, "IMP-2": None}
+    assert client.get("/books/", params={"isbn": "IMP-2"}).json()[0]["price"] is None
@@ -0,0 +1,43 @@
+# GET /books/ 的进程内缓存：查库期间失效过的结果不能放进缓存；304 只按 ETag 判断
+
+import models
+from cache import catalog_cache
+
+
+def test_invalidate_during_query_is_not_cached(client, engine, monkeypatch):
+    first = client.get("/books/", params={"limit": 5})
+    assert first.status_code == 200
+
+    # 模拟：请求查完库、还没放进缓存时，别的请求改了图书并 invalidate
+    real_store = catalog_cache.store
+
+    def store_after_concurrent_write(ticket, *args, **kwargs):
+        with engine.begin() as conn:
+            conn.execute(models.Book.__table__.update().values(title="并发改过的书名"))
+        catalog_cache.invalidate("books")
+        return real_store(ticket, *args, **kwargs)
+
+    monkeypatch.setattr(catalog_cache, "store", store_after_concurrent_write)
+    stale = client.get("/books/", params={"limit": 3})
+    monkeypatch.undo()
+
+    assert all(book["title"] != "并发改过的书名" for book in stale.json())
+    fresh = client.get("/books/", params={"limit": 3})
+    assert all(book["title"] == "并发改过的书名" for book in fresh.json())
+
+
+def test_not_modified_only_by_etag(client):
+    first = client.get("/books/", params={"limit": 5})
+    etag = first.headers["ETag"]
+    assert "Last-Modified" not in first.headers
+
+    assert client.get("/books/", params={"limit": 5}, headers={"If-None-Match": etag}).status_code == 304
+    # If-Modified-Since 精确到秒，不用它判断
+    response = client.get("/books/", params={"limit": 5},
+                          headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == 200
+
+    book = first.json()[0]
+    updated = client.put(f"/books/{book['isbn']}", json={**book, "title": book["title"] + "（第二版）"})
+    assert updated.status_code == 200
+    assert client.get("/books/", params={"limit": 5}, headers={"If-None-Match": etag}).status_code == 200
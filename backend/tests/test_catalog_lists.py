@@ -0,0 +1,65 @@
+# GET /books/、GET /inventory/ 的 q 过滤 (全文索引 + ISBN 前缀) 和可选的总数；借书台的在馆副本翻页
+
+import pytest
+from sqlalchemy import insert
+
+import main
+import models
+
+
+@pytest.mark.parametrize("q, isbns", [
+    ("孤独", {"978-7-020"}),          # 书名中间
+    ("计算机系统", {"978-7-302"}),     # 够长，走全文索引
+    ("Cormen", {"978-7-111"}),        # 作者
+    ("978-7-3", {"978-7-302"}),       # ISBN 前缀
+])
+def test_books_q(client, q, isbns):
+    response = client.get("/books/", params={"q": q})
+    assert response.status_code == 200
+    assert {book["isbn"] for book in response.json()} == isbns
+    assert response.headers["X-Total-Count"] == str(len(isbns))
+
+
+def test_books_total_is_optional(client, statements):
+    with statements() as with_count:
+        first = client.get("/books/", params={"limit": 1})
+    with statements() as without_count:
+        page = client.get("/books/", params={"limit": 1, "cursor": first.headers["X-Next-Cursor"], "total": "false"})
+    assert page.status_code == 200
+    assert "X-Total-Count" not in page.headers
+    assert "X-Next-Cursor" in page.headers
+    assert len(without_count) == len(with_count) - 1
+
+
+def test_inventory_q(client):
+    by_title = client.get("/inventory/", params={"q": "算法"}).json()
+    assert by_title and {copy["isbn"] for copy in by_title} == {"978-7-111"}
+
+    copy_id = by_title[0]["id"]
+    by_barcode = client.get("/inventory/", params={"q": str(copy_id)}).json()
+    assert copy_id in [copy["id"] for copy in by_barcode]
+
+
+def test_available_pages_cover_a_fixed_isbn_set(client, engine):
+    # 150 种书名前缀相同的书，每种一册在馆：只取按 ISBN 排序的前 AVAILABLE_MATCH_LIMIT 种，翻页不重复不遗漏
+    with engine.begin() as conn:
+        conn.execute(insert(models.Book), [
+            {"isbn": f"P-{i:03d}", "title": f"批量书{i:03d}", "author": "作者", "publisher_id": 1, "stock_qty": 1}
+            for i in range(150)
+        ])
+        conn.execute(insert(models.Inventory), [{"isbn": f"P-{i:03d}", "status": 1} for i in range(150)])
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/inventory/available", params={"q": "批量书", "limit": 30, "cursor": cursor})
+        assert response.status_code == 200
+        assert response.headers["X-Matches-Truncated"] == "1"
+        seen += [copy["isbn"] for copy in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert sorted(seen) == [f"P-{i:03d}" for i in range(main.AVAILABLE_MATCH_LIMIT)]
+
+    narrow = client.get("/inventory/available", params={"q": "批量书14"})
+    assert "X-Matches-Truncated" not in narrow.headers
+    assert len(narrow.json()) == 10
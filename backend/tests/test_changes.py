@@ -0,0 +1,80 @@
+# 增量同步版本号：事务提交之后才分配 (publish)，提交得晚的改动拿到更大的版本号，/changes 不会漏
+
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+import changes
+import models
+
+ChangeBatch = models.ChangeBatch.__table__
+
+
+def _borrow(client, engine, card_id=900):
+    with engine.begin() as conn:
+        conn.execute(insert(models.Reader).values(card_id=card_id, name="同步测试", category="学生", borrowed_count=0))
+    copy_id = client.get("/inventory/", params={"status": 1, "limit": 1}).json()[0]["id"]
+    assert client.post("/borrow/", json={"card_id": card_id, "inventory_id": copy_id}).status_code == 200
+    return copy_id
+
+
+def test_borrow_is_published_after_commit(client, engine, statements):
+    since = client.get("/changes").json()["version"]
+    with statements() as executed:
+        copy_id = _borrow(client, engine)
+    # 借书事务里只插改动批次，计数器在提交之后的小事务里 +1
+    counter_updates = [i for i, s in enumerate(executed) if s.startswith("UPDATE change_versions")]
+    borrow_insert = next(i for i, s in enumerate(executed) if s.startswith("INSERT INTO borrow_records"))
+    assert len(counter_updates) == 1 and counter_updates[0] > borrow_insert
+
+    result = client.get("/changes", params={"since": since}).json()
+    assert result["version"] == since + 1
+    assert copy_id in [row["id"] for row in result["inventory"]["upserted"]]
+
+
+def test_late_commit_gets_a_later_version(client, engine):
+    since = client.get("/changes").json()["version"]
+    publisher_id = client.get("/publishers/").json()[0]["id"]
+    # 一个慢事务：在客户端拿到 since 之后才提交，而且提交之后没来得及 publish (比如进程挂了)
+    with Session(engine) as db:
+        changes.record(db, publishers=[publisher_id])
+        db.commit()
+    assert client.get("/changes").json()["version"] == since
+
+    # 下一次 publish 把它一起分配到新版本号上，客户端从 since 往后取能拿到
+    _borrow(client, engine)
+    result = client.get("/changes", params={"since": since}).json()
+    assert publisher_id in [row["id"] for row in result["publishers"]["upserted"]]
+    with engine.connect() as conn:
+        assert conn.execute(select(ChangeBatch.c.id).where(ChangeBatch.c.version == None)).first() is None
+
+
+def test_rolled_back_changes_are_never_published(client, engine):
+    since = client.get("/changes").json()["version"]
+    with Session(engine) as db:
+        changes.record(db, deleted={"publishers": [12345]})
+        db.rollback()
+        assert changes.publish(db) == since  # 没有可分配的批次，版本号不变
+    assert client.get("/changes").json()["version"] == since
+
+    _borrow(client, engine)
+    result = client.get("/changes", params={"since": since}).json()
+    assert result["publishers"]["deleted"] == []
+
+
+def test_prune_keeps_unpublished_batches(client, engine):
+    _borrow(client, engine)
+    with engine.begin() as conn:
+        conn.execute(update(ChangeBatch).values(created_at=datetime(2000, 1, 1)))
+        unpublished = conn.execute(
+            insert(ChangeBatch).values(created_at=datetime(2000, 1, 1))
+        ).inserted_primary_key[0]
+    with Session(engine) as db:
+        changes.prune(db, days=30)
+        db.commit()
+        current = changes.committed_version(db)
+    with engine.connect() as conn:
+        left = set(conn.execute(select(ChangeBatch.c.id, ChangeBatch.c.version)).all())
+    assert (unpublished, None) in left
+    assert client.get("/changes", params={"since": current - 1}).json()["reset"] is True
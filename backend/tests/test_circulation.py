@@ -0,0 +1,88 @@
+# 借还书并发：几百个请求同时抢同一册书，只能有一个成功，计数器和借阅记录要对得上
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, insert, select
+
+import models
+
+CONCURRENT_REQUESTS = 200
+FIRST_CARD_ID = 1000
+
+
+def _add_readers(engine, count):
+    with engine.begin() as conn:
+        conn.execute(insert(models.Reader), [
+            {"card_id": FIRST_CARD_ID + i, "name": f"并发读者{i}", "category": "学生", "borrowed_count": 0}
+            for i in range(count)
+        ])
+
+
+def _run_concurrently(client, path, payloads):
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        return list(pool.map(lambda payload: client.post(path, json=payload), payloads))
+
+
+def _assert_counters_match(engine):
+    """stock_qty = 在馆册数，borrowed_count = 未归还的借阅记录数 (和 reconcile.py 核对的是同一件事)。"""
+    Book, Inventory, Reader, BorrowRecord = models.Book, models.Inventory, models.Reader, models.BorrowRecord
+    with engine.connect() as conn:
+        available = dict(conn.execute(
+            select(Inventory.isbn, func.count()).where(Inventory.status == 1).group_by(Inventory.isbn)
+        ).all())
+        for isbn, stock_qty in conn.execute(select(Book.isbn, Book.stock_qty)).all():
+            assert stock_qty == available.get(isbn, 0), isbn
+
+        open_loans = dict(conn.execute(
+            select(BorrowRecord.card_id, func.count())
+            .where(BorrowRecord.return_date == None)
+            .group_by(BorrowRecord.card_id)
+        ).all())
+        for card_id, borrowed_count in conn.execute(select(Reader.card_id, Reader.borrowed_count)).all():
+            assert borrowed_count == open_loans.get(card_id, 0), card_id
+
+
+def _new_copy(client):
+    isbn = client.get("/books/", params={"limit": 1}).json()[0]["isbn"]
+    response = client.post("/inventory/", json={"isbn": isbn})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_concurrent_borrows_of_one_copy(client, engine):
+    _add_readers(engine, CONCURRENT_REQUESTS)
+    inventory_id = _new_copy(client)
+
+    responses = _run_concurrently(client, "/borrow/", [
+        {"card_id": FIRST_CARD_ID + i, "inventory_id": inventory_id} for i in range(CONCURRENT_REQUESTS)
+    ])
+
+    codes = [r.status_code for r in responses]
+    assert codes.count(200) == 1, codes
+    assert codes.count(400) == CONCURRENT_REQUESTS - 1, codes
+
+    with engine.connect() as conn:
+        loans = conn.execute(
+            select(func.count()).select_from(models.BorrowRecord)
+            .where(models.BorrowRecord.inventory_id == inventory_id)
+        ).scalar_one()
+        status = conn.execute(
+            select(models.Inventory.status).where(models.Inventory.id == inventory_id)
+        ).scalar_one()
+    assert loans == 1
+    assert status == 0
+    _assert_counters_match(engine)
+
+
+def test_concurrent_returns_of_one_copy(client, engine):
+    _add_readers(engine, 1)
+    inventory_id = _new_copy(client)
+    assert client.post("/borrow/", json={"card_id": FIRST_CARD_ID, "inventory_id": inventory_id}).status_code == 200
+
+    responses = _run_concurrently(client, "/return/", [{"inventory_id": inventory_id}] * CONCURRENT_REQUESTS)
+
+    # 没抢到的请求看到的是「没有在借记录」
+    codes = [r.status_code for r in responses]
+    assert codes.count(200) == 1, codes
+    assert codes.count(404) == CONCURRENT_REQUESTS - 1, codes
+    _assert_counters_match(engine)
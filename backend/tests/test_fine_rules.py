@@ -0,0 +1,24 @@
+# 罚款规则缓存：读库期间规则被改 (invalidate) 时，读到的结果不能放进缓存
+
+from sqlalchemy import event
+
+import database
+import fine_rules
+
+
+def test_invalidate_during_read_is_not_cached(client, engine):
+    def rules_changed_meanwhile(conn, cursor, statement, parameters, context, executemany):
+        if "fine_rules" in statement:
+            fine_rules.invalidate()
+
+    db = database.SessionLocal()
+    event.listen(engine, "after_cursor_execute", rules_changed_meanwhile)
+    try:
+        fine_rules.current(db)
+    finally:
+        event.remove(engine, "after_cursor_execute", rules_changed_meanwhile)
+    assert fine_rules._cache.get("rules") is None
+
+    rules = fine_rules.current(db)
+    db.close()
+    assert fine_rules._cache.get("rules") is rules
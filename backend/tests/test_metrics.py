@@ -0,0 +1,25 @@
+# SQL 统计：报错的语句不计数，也不能影响后面语句的耗时
+
+import time
+
+import pytest
+from sqlalchemy import exc, text
+
+import metrics
+
+
+def test_failed_statement_does_not_skew_timings(client, engine):
+    stats = metrics.RequestStats(keep_statements=True)
+    token = metrics._current.set(stats)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            time.sleep(0.2)
+            conn.execute(text("SELECT 1"))
+    finally:
+        metrics._current.reset(token)
+
+    assert stats.statements == 1
+    assert stats.db_seconds < 0.1
+    assert [statement for _, statement in stats.log] == ["SELECT 1"]
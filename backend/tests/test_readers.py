@@ -0,0 +1,44 @@
+# GET /readers/：未缴罚款数量要和读者列表一起查出来，不能每个读者再查一次罚款表 (N+1)
+
+from sqlalchemy import insert
+
+import models
+
+
+def test_readers_page_is_one_statement(client, engine, statements):
+    # 再加一批读者，每人几条罚款 (有缴了的也有没缴的)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Reader), [
+            {"card_id": 100 + i, "name": f"读者{i}", "category": "学生", "borrowed_count": 0} for i in range(50)
+        ])
+        conn.execute(insert(models.Fine), [
+            {"card_id": 100 + i, "amount": 1, "remark": "超期", "is_paid": paid}
+            for i in range(50) for paid in (0,) * (i % 3) + (1,)
+        ])
+
+    with statements() as executed:
+        response = client.get("/readers/", params={"limit": 100})
+
+    assert response.status_code == 200
+    readers = response.json()
+    assert len(readers) == 54
+    assert len(executed) == 1, executed
+    unpaid = {r["card_id"]: r["unpaid_fine_count"] for r in readers}
+    assert all(unpaid[100 + i] == i % 3 for i in range(50))
+
+
+def test_readers_statement_count_does_not_grow_with_page_size(client, engine, statements):
+    with engine.begin() as conn:
+        conn.execute(insert(models.Reader), [
+            {"card_id": 100 + i, "name": f"读者{i}", "category": "学生", "borrowed_count": 0} for i in range(30)
+        ])
+        conn.execute(insert(models.Fine), [
+            {"card_id": 100 + i, "amount": 1, "remark": "超期", "is_paid": 0} for i in range(30)
+        ])
+
+    counts = []
+    for limit in (1, 10, 34):
+        with statements() as executed:
+            assert client.get("/readers/", params={"limit": limit}).status_code == 200
+        counts.append(len(executed))
+    assert counts == [1, 1, 1]
@@ -0,0 +1,31 @@
+# /books/search：短关键词 (全文索引切不出词) 也要能做子串匹配
+
+import pytest
+
+
+@pytest.fixture
+def python_book(client):
+    response = client.post("/books/", json={
+        "isbn": "978-1-449", "title": "Learning Python", "author": "Mark Lutz", "publisher_id": 1, "price": 99
+    })
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("q, title", [
+    ("Py", "Learning Python"),   # 2 个字符，词中间
+    ("孤独", "百年孤独"),          # 中文，书名中间
+    ("算", "算法导论"),            # 1 个字，前缀
+    ("Python", "Learning Python"),  # 够长，走全文索引
+])
+def test_search_matches_substrings(client, python_book, q, title):
+    response = client.get("/books/search", params={"q": q})
+    assert response.status_code == 200
+    assert title in [book["title"] for book in response.json()]
+
+
+def test_short_query_ranks_prefix_first(client, python_book):
+    client.post("/books/", json={
+        "isbn": "978-1-450", "title": "Python Cookbook", "author": "David Beazley", "publisher_id": 1, "price": 89
+    })
+    titles = [book["title"] for book in client.get("/books/search", params={"q": "Py"}).json()]
+    assert titles[:2] == ["Python Cookbook", "Learning Python"]
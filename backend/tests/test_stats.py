@@ -0,0 +1,26 @@
+# 看板每日统计：计数分到多行 (day, shard) 上累加，看板按天求和
+
+from datetime import date
+
+from sqlalchemy import func, select
+
+import stats
+
+
+def test_daily_counters_are_sharded_and_summed(client, engine):
+    before = {row["day"]: row for row in client.get("/stats").json()["daily"]}[date.today().isoformat()]
+
+    with engine.begin() as conn:
+        for _ in range(200):
+            stats.record_day(conn, loans=1, fines_issued=1, fines_issued_amount=0.5)
+
+    with engine.connect() as conn:
+        shards = conn.execute(
+            select(func.count()).select_from(stats.DailyStats).where(stats.DailyStats.c.day == date.today())
+        ).scalar_one()
+    assert shards > 1
+
+    after = {row["day"]: row for row in client.get("/stats").json()["daily"]}[date.today().isoformat()]
+    assert after["loans"] == before["loans"] + 200
+    assert after["fines_issued"] == before["fines_issued"] + 200
+    assert after["fines_issued_amount"] == before["fines_issued_amount"] + 100
@@ -10,9 +10,14 @@ const routes = [
     path: '/home',
     name: 'Home',
     component: () => import('../views/Home.vue'),
-    // 这里默认跳转到读者管理，防止右边一片白
-    redirect: '/home/readers',
+    // 默认进入数据看板，防止右边一片白
+    redirect: '/home/dashboard',
     children: [
+      {
+        path: 'dashboard',
+        name: 'Dashboard',
+        component: () => import('../views/Dashboard.vue')
+      },
       {
         path: 'readers',
         name: 'ReaderManage',
@@ -49,4 +54,9 @@ const router = createRouter({
   routes
 })
 
+// 没登录 (没有 token) 不能进后台页面
+router.beforeEach((to) => {
+  if (to.path !== '/' && !localStorage.getItem('token')) return '/'
+})
+
 export default router
\ No newline at end of file
@@ -0,0 +1,39 @@
+import service from './request'
+
+// 订阅后端推送的流通事件 (WebSocket /ws/events)，断线后自动重连
+// 用法：const stop = subscribeEvents(['borrow', 'return'], onEvent, onResync)，页面卸载时调用 stop()
+// onResync：断线重连 (或者处理不过来被服务端断开) 之后调用，这期间可能漏了事件，页面自己重新加载一下
+export const subscribeEvents = (types, onEvent, onResync) => {
+  const base = service.defaults.baseURL.replace(/^http/, 'ws') + '/ws/events'
+  let socket = null
+  let stopped = false
+  let connectedBefore = false
+  let retryDelay = 1000
+
+  const connect = () => {
+    // 浏览器的 WebSocket 不能带 Authorization 头，token 放在查询参数里 (每次重连取最新的)
+    const params = new URLSearchParams({ token: localStorage.getItem('token') || '' })
+    if (types && types.length) params.set('types', types.join(','))
+    socket = new WebSocket(`${base}?${params}`)
+    socket.onopen = () => {
+      retryDelay = 1000
+      if (connectedBefore && onResync) onResync()
+      connectedBefore = true
+    }
+    socket.onmessage = (msg) => {
+      const event = JSON.parse(msg.data)
+      if (event.type !== 'overflow') onEvent(event)
+    }
+    socket.onclose = () => {
+      if (stopped) return
+      setTimeout(connect, retryDelay)
+      retryDelay = Math.min(retryDelay * 2, 30000)
+    }
+  }
+  connect()
+
+  return () => {
+    stopped = true
+    if (socket) socket.close()
+  }
+}
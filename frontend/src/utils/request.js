@@ -1,5 +1,6 @@
 import axios from 'axios'
 import { ElMessage } from 'element-plus'
+import router from '../router'
 
 // 创建 axios 实例
 const service = axios.create({
@@ -7,17 +8,79 @@ const service = axios.create({
   timeout: 5000 // 请求超时时间
 })
 
+// 读写分离：写请求成功后后端返回 X-Read-Primary-Until (服务器时间)，
+// 之后的请求原样带回去，这几秒内的读请求走主库，保证能读到自己刚改的数据
+const PIN_HEADER = 'x-read-primary-until'
+let readPrimaryUntil = null
+service.interceptors.request.use(config => {
+  // 过期很久的就不再带了 (留 60 秒余量，防止本机和服务器时钟不一致)
+  if (readPrimaryUntil && Date.now() / 1000 > Number(readPrimaryUntil) + 60) readPrimaryUntil = null
+  if (readPrimaryUntil) config.headers[PIN_HEADER] = readPrimaryUntil
+  // 登录后拿到的 token，除了登录接口每个请求都要带
+  const token = localStorage.getItem('token')
+  if (token) config.headers.Authorization = `Bearer ${token}`
+  return config
+})
+
+// 借书 / 还书 / 缴费这类不能重复执行的请求传 { idempotent: true }：带上 Idempotency-Key 请求头，
+// 超时 / 断网后用户再点一次 (内容相同) 会复用同一个 key，后端直接返回第一次的结果，不会重复办理。
+// 收到后端的明确答复 (成功或业务错误) 之后 key 就作废，下一次是新的操作
+const pendingKeys = new Map()
+const newKey = () => (window.crypto?.randomUUID
+  ? window.crypto.randomUUID()
+  : `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}`)
+service.interceptors.request.use(config => {
+  if (config.idempotent) {
+    const op = `${config.method} ${config.url} ${JSON.stringify(config.data ?? null)}`
+    if (!pendingKeys.has(op)) pendingKeys.set(op, newKey())
+    config.headers['Idempotency-Key'] = pendingKeys.get(op)
+    config.idempotencyOp = op
+  }
+  return config
+})
+const settleKey = (config, response) => {
+  // 没收到响应 (超时 / 断网) 或者第一次还在处理 (409)：留着 key 给下一次重试
+  if (config?.idempotencyOp && response && response.status !== 409) pendingKeys.delete(config.idempotencyOp)
+}
+
 // 响应拦截器：如果有报错，这里会自动弹出红色提示
 service.interceptors.response.use(
   response => {
+    settleKey(response.config, response)
+    const pin = response.headers[PIN_HEADER]
+    if (pin) readPrimaryUntil = pin
+    // 需要读响应头 (比如分页信息) 的请求，返回完整 response
+    if (response.config.rawResponse) return response
     // 自动剥离外层数据，直接返回后端给的内容
     return response.data
   },
   error => {
+    settleKey(error.config, error.response)
+    // token 过期 / 已退出：清掉本地登录状态，回登录页
+    if (error.response?.status === 401) {
+      localStorage.removeItem('user_id')
+      localStorage.removeItem('token')
+      if (window.location.pathname !== '/') router.push('/')
+    }
     const msg = error.response?.data?.detail || '请求失败，请检查后端是否启动'
     ElMessage.error(msg)
     return Promise.reject(error)
   }
 )
 
+// 分页列表：后端把总数和下一页游标放在响应头里
+// 返回 { items, total, nextCursor }；请求带 total: false 时后端不算总数，total 为 null
+export const getPage = async (url, params = {}) => {
+  const res = await service.get(url, {
+    params,
+    rawResponse: true,
+    paramsSerializer: { indexes: null } // 数组参数序列化成 ?isbn=a&isbn=b
+  })
+  return {
+    items: res.data,
+    total: res.headers['x-total-count'] === undefined ? null : Number(res.headers['x-total-count']),
+    nextCursor: res.headers['x-next-cursor'] || null
+  }
+}
+
 export default service
\ No newline at end of file